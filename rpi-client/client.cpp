@@ -44,6 +44,7 @@ make
 #include <cstdint>
 #include <vector>
 #include <stdexcept>
+#include <string>
 
 #include "bcm2835.h"
 
@@ -231,13 +232,24 @@ void Colossus::_wait_for_busy(uint8_t target_busy)
     }
 }
 
-int main(int argc, char **argv)
+// Optional binary wire format, selected by "--binary" on the command
+// line.  Each command is a four-octet frame (flags, addr, data, 0), and
+// the response is a four-octet frame echoing the command's flags, addr,
+// and data, with the error bit added to the flags, and with the response
+// value in the last octet.  A frame with unknown flags is echoed back with
+// the 'invalid' bit set.  Must match BinaryFrame in tests/transports.py.
+
+struct Frame
 {
-    Colossus colossus;
+    static const size_t N_Octets = 4;
 
-    cout << "READY-FOR-INPUT" << endl;
+    static const uint8_t Has_Addr = 0x01;
+    static const uint8_t Error = 0x02;
+    static const uint8_t Invalid = 0x80;
+};
 
-    std::ifstream in_cmd_file("/tmp/repl-input");
+void run_text_repl(Colossus & colossus, std::ifstream & in_cmd_file)
+{
     std::string cmd_line;
 
     while (std::getline(in_cmd_file, cmd_line))
@@ -269,6 +281,75 @@ int main(int argc, char **argv)
 
         cout.flush();
     }
+}
+
+void run_binary_repl(Colossus & colossus, std::ifstream & in_cmd_file)
+{
+    char frame[Frame::N_Octets];
+
+    while (in_cmd_file.read(frame, Frame::N_Octets))
+    {
+        uint8_t flags = static_cast<uint8_t>(frame[0]);
+        uint8_t addr = static_cast<uint8_t>(frame[1]);
+        uint8_t data = static_cast<uint8_t>(frame[2]);
+        Response response;
+
+        if ((flags & ~Frame::Has_Addr) != 0)
+            flags = Frame::Invalid;
+        else if (flags & Frame::Has_Addr)
+            response = colossus.submit_addr_data(addr, data);
+        else
+            response = colossus.submit_data(data);
+
+        if (response.error_p)
+            flags |= Frame::Error;
+
+        frame[0] = static_cast<char>(flags);
+        frame[3] = static_cast<char>(response.value);
+        cout.write(frame, Frame::N_Octets);
+
+        // Only flush once we have caught up with the commands already sent,
+        // so that a pipelined burst of commands gets its responses in bulk.
+        if (in_cmd_file.rdbuf()->in_avail() < static_cast<std::streamsize>(Frame::N_Octets))
+            cout.flush();
+    }
+
+    cout.flush();
+}
+
+int main(int argc, char **argv)
+{
+    bool binary_p = false;
+    std::string in_cmd_path = "/tmp/repl-input";
+
+    for (int i = 1; i < argc; ++i)
+    {
+        std::string arg(argv[i]);
+        if (arg == "--binary")
+            binary_p = true;
+        else if (arg == "--input" && i + 1 < argc)
+            in_cmd_path = argv[++i];
+        else
+        {
+            std::cerr << "usage: " << argv[0] << " [--binary] [--input PATH]\n";
+            return 1;
+        }
+    }
+
+    Colossus colossus;
+
+    cout << "READY-FOR-INPUT" << endl;
+
+    if (binary_p)
+    {
+        std::ifstream in_cmd_file(in_cmd_path.c_str(), std::ios::binary);
+        run_binary_repl(colossus, in_cmd_file);
+    }
+    else
+    {
+        std::ifstream in_cmd_file(in_cmd_path.c_str());
+        run_text_repl(colossus, in_cmd_file);
+    }
 
     return 0;
 }
@@ -0,0 +1,109 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from colossus import Colossus
+
+
+class AsyncColossus:
+    """
+    Drive one board from asyncio code.  Every public method of Colossus is
+    available here as a method returning an awaitable, e.g.,
+
+        await board.punch_tape(zs)
+        records = await board.printer_read_records()
+
+    Calls for one board are carried out strictly in the order they are made
+    (not the order they are awaited), on a worker thread belonging to that
+    board.  Blocking I/O with one board therefore holds up neither the event
+    loop nor any other board, and several boards can be driven concurrently
+    with asyncio.gather() etc.
+
+    If a call fails, the board is left in an unknown state, so every later
+    call fails with the same exception without being carried out; so does
+    close().  Calls need not all be awaited individually, therefore, but
+    the last one (or close()) must be, to learn whether any failed.
+
+    Constructor arguments are as for Colossus; the (possibly slow) start-up
+    of the board also happens on the worker thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.failure = None
+        self.colossus_future = self.executor.submit(self._guarded, Colossus, *args, **kwargs)
+
+    def _guarded(self, fun, *args, **kwargs):
+        # Runs on the worker thread, so calls see failures in order.
+        if self.failure is not None:
+            raise self.failure
+        try:
+            return fun(*args, **kwargs)
+        except BaseException as e:
+            self.failure = e
+            raise
+
+    @property
+    def colossus(self):
+        """
+        The underlying Colossus object, for use from the worker thread only.
+        """
+        return self.colossus_future.result()
+
+    def _submit(self, method_name, *args, **kwargs):
+        def call():
+            return getattr(self.colossus, method_name)(*args, **kwargs)
+        return asyncio.wrap_future(self.executor.submit(self._guarded, call))
+
+    def __getattr__(self, name):
+        attr = getattr(Colossus, name)
+        if name.startswith('_') or not callable(attr) or isinstance(attr, type):
+            raise AttributeError('%s is not a method of Colossus' % name)
+        def method(*args, **kwargs):
+            return self._submit(name, *args, **kwargs)
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    async def ready(self):
+        """
+        Wait until the board has started up.
+        """
+        await asyncio.wrap_future(self.colossus_future)
+
+    async def close(self):
+        """
+        Wait for all outstanding calls to finish, then release the worker
+        thread.  Raise the first failure of any call.
+        """
+        try:
+            await asyncio.wrap_future(self.executor.submit(self._guarded, lambda: None))
+        finally:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        await self.ready()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            await self.close()
+        except BaseException as e:
+            # Already propagating if it is what ended the 'with' block.
+            if e is not exc_value:
+                raise
@@ -0,0 +1,119 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+# Offline compilation of a whole session into one batch of commands, for
+# the ISE simulator (or any other slow monitor).
+#
+# A session is a function taking a Colossus and driving it with the usual
+# high-level methods.  compile_session() runs it against the software
+# model, recording every command along with the model's response, which
+# becomes that command's expected response.  run_batch() then sends the
+# complete command stream to a monitor in one go, without waiting for any
+# response before sending the next command, collects all the responses,
+# and checks them against the expected ones.  The simulator is therefore
+# never idle waiting for the host.
+#
+# This relies on the session's commands not depending on responses except
+# as the model predicts them, which holds for most test scenarios.
+
+from collections import namedtuple
+import numpy as np
+from colossus import Colossus
+from transports import ModelTransport, MonitorProcessTransport
+from tracing import NullTracer, make_records, Magic
+
+
+class RecordingTransport(ModelTransport):
+    """
+    Model transport which also keeps every command and response.
+    """
+
+    def __init__(self, model=None):
+        super().__init__(model)
+        self.cmds = []
+        self.error_ps = []
+        self.response_bytes = []
+
+    def submit_cmds(self, cmds, max_n_in_flight):
+        error_p, response_bytes = super().submit_cmds(cmds, max_n_in_flight)
+        self.cmds.extend(cmds[:len(error_p)])
+        self.error_ps.append(error_p)
+        self.response_bytes.append(response_bytes)
+        return error_p, response_bytes
+
+
+class BatchScript(namedtuple('BatchScript',
+                             'cmds exp_error_p exp_response_bytes predicted_result')):
+    """
+    Commands of a compiled session, their expected responses, and what the
+    session function returned when run against the model.
+    """
+
+    def write_cmd_file(self, path):
+        """
+        Write the commands in the monitor's text wire format, e.g., for use
+        as the simulator's /tmp/repl-input.
+        """
+        with open(path, 'wt') as f_out:
+            f_out.write(''.join(Colossus._cmd_str(cmd) + '\n' for cmd in self.cmds))
+
+    def write_trace(self, path):
+        """
+        Write the commands and expected responses as a trace file, as
+        understood by tracing.read_trace() and replay.py.
+        """
+        records = make_records(self.cmds, self.exp_error_p, self.exp_response_bytes, 0, 0)
+        with open(path, 'wb') as f_out:
+            f_out.write(Magic)
+            f_out.write(records.tobytes())
+
+
+BatchResult = namedtuple('BatchResult', 'error_p response_bytes mismatch_idxs')
+
+
+def compile_session(session_fn):
+    """
+    Run 'session_fn(colossus)' against the model, returning a BatchScript.
+    The commands include those sent by the Colossus constructor.
+    """
+    transport = RecordingTransport()
+    colossus = Colossus(transport=transport, tracer=NullTracer())
+    predicted_result = session_fn(colossus)
+    return BatchScript(transport.cmds,
+                       np.concatenate(transport.error_ps + [np.zeros(0, dtype=bool)]),
+                       np.concatenate(transport.response_bytes + [np.zeros(0, dtype=np.uint8)]),
+                       predicted_result)
+
+
+def run_batch(script, transport=None):
+    """
+    Send all of the script's commands through the stream transport
+    (default: a new MonitorProcessTransport, closed afterwards) while collecting responses,
+    and return a BatchResult, where 'mismatch_idxs' lists the commands
+    whose responses were not as expected.
+    """
+    own_transport_p = (transport is None)
+    if own_transport_p:
+        transport = MonitorProcessTransport()
+    try:
+        error_p, response_bytes = transport.stream_cmds(script.cmds)
+    finally:
+        if own_transport_p:
+            transport.close()
+    mismatch_idxs = np.flatnonzero((error_p != script.exp_error_p)
+                                   | (response_bytes != script.exp_response_bytes))
+    return BatchResult(error_p, response_bytes, mismatch_idxs)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+# Share one board between many clients over TCP.
+#
+# Each client connection is a session speaking the monitor's wire format
+# (text, or binary frames), so a Colossus can use it through a
+# BoardServerTransport exactly as it would use rpi-client.  Commands from
+# all sessions go through a single worker thread which owns the board's
+# transport; outside transactions, sessions are served round-robin, a
+# batch of commands at a time.  In addition to commands, a session may
+# send:
+#
+#     text       binary frame          meaning
+#     BEGIN      (0x40, 0, 0x01, 0)    start transaction
+#     END        (0x40, 0, 0x00, 0)    end transaction
+#     STATS      ---                   reply with one BOARD-SERVER-STATS line
+#
+# While a session is within a transaction, no other session's commands
+# reach the board.  BEGIN and END get no response.  A session which
+# disconnects mid-transaction has its transaction ended.
+#
+# Since sessions' commands are interleaved, the server tracks each
+# session's address latch itself, sending data-only commands to the board
+# with their address when needed.
+
+import argparse
+import socket
+import sys
+import threading
+import time
+from collections import namedtuple, deque
+from transports import (BinaryFrame, MonitorProcessTransport, ModelTransport,
+                        SocketTransport, cmd_str)
+
+
+class Control:
+    Begin = 'BEGIN'
+    End = 'END'
+    Stats = 'STATS'
+    Invalid = 'INVALID'
+
+    Frame_Flag = 0x40
+    Frame_Data = {0x01: Begin, 0x00: End}
+
+
+BoardServerMetrics = namedtuple('BoardServerMetrics',
+                                ['n_sessions', 'queue_depth', 'max_queue_depth',
+                                 'n_cmds_done', 'n_transactions',
+                                 'busy_seconds', 'uptime_seconds', 'utilisation'])
+
+
+class Session:
+    def __init__(self, sock, session_id, binary_p):
+        self.sock = sock
+        self.session_id = session_id
+        self.binary_p = binary_p
+        self.f_in = sock.makefile('rb')
+        self.f_out = sock.makefile('wb')
+        self.pending = deque()
+        self.last_addr = None
+        self.closed_p = False
+
+    def items(self):
+        """
+        Generate the commands and controls sent by the client.
+        """
+        if self.binary_p:
+            while True:
+                frame = self.f_in.read(BinaryFrame.N_Octets)
+                if len(frame) < BinaryFrame.N_Octets:
+                    return
+                flags, addr, data, _ = frame
+                if flags == BinaryFrame.Has_Addr:
+                    yield (addr, data)
+                elif flags == 0:
+                    yield (data,)
+                elif flags == Control.Frame_Flag and data in Control.Frame_Data:
+                    yield Control.Frame_Data[data]
+                else:
+                    yield (Control.Invalid, frame)
+        else:
+            for line in self.f_in:
+                line = line.rstrip(b'\r\n').decode('ascii', 'replace')
+                if line in (Control.Begin, Control.End, Control.Stats):
+                    yield line
+                    continue
+                try:
+                    cmd = tuple(int(line[i:i+2], 16) for i in range(0, len(line), 2))
+                except ValueError:
+                    cmd = ()
+                if len(line) in (2, 4) and len(cmd) == len(line) // 2:
+                    yield cmd
+                else:
+                    yield (Control.Invalid, line)
+
+    def _write(self, octets):
+        # A client which has gone away must not take the board thread with
+        # it; forget the session and anything it still had queued.
+        if self.closed_p:
+            return
+        try:
+            self.f_out.write(octets)
+        except OSError:
+            self.mark_broken()
+
+    def mark_broken(self):
+        self.closed_p = True
+        self.pending.clear()
+
+    def write_responses(self, cmds, error_p, response_bytes):
+        if self.binary_p:
+            frames = BinaryFrame.command_frames(cmds)
+            frames['flags'] |= error_p.astype('u1') * BinaryFrame.Error
+            frames['reserved'] = response_bytes
+            self._write(frames.tobytes())
+        else:
+            self._write(''.join("COLOSSUS-RESPONSE: %s '%d' %d\n"
+                                % (cmd_str(cmd), e, r)
+                                for cmd, e, r in zip(cmds, error_p, response_bytes))
+                        .encode('ascii'))
+
+    def write_invalid(self, raw):
+        if self.binary_p:
+            self._write(bytes([BinaryFrame.Invalid]) + raw[1:3] + b'\x00')
+        else:
+            self._write(b'COLOSSUS-RESPONSE: ?\n')
+
+    def write_line(self, line):
+        self._write(line.encode('ascii') + b'\n')
+
+    def flush(self):
+        if self.closed_p:
+            return
+        try:
+            self.f_out.flush()
+        except OSError:
+            self.mark_broken()
+
+
+class BoardServer:
+    """
+    Serve the board behind 'transport' to TCP clients at (host, port);
+    port 0 means choose a free one (see 'address').
+    """
+
+    def __init__(self, transport, host='127.0.0.1', port=0,
+                 wire_format='text', max_batch=64):
+        self.transport = transport
+        self.binary_p = (wire_format == 'binary')
+        self.max_batch = max_batch
+        self.listen_sock = socket.create_server((host, port))
+        self.address = self.listen_sock.getsockname()[:2]
+        self.cond = threading.Condition()
+        self.sessions = []
+        self.rr_idx = 0
+        self.transaction_owner = None
+        self.stopping_p = False
+        self.next_session_id = 0
+        self.board_addr = None
+        self.n_cmds_done = 0
+        self.n_transactions = 0
+        self.max_queue_depth = 0
+        self.busy_seconds = 0.0
+        self.t_start = time.monotonic()
+        self.threads = [threading.Thread(target=self._accept_loop, daemon=True),
+                        threading.Thread(target=self._board_loop, daemon=True)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.stopping_p = True
+            self.cond.notify_all()
+        self.listen_sock.close()
+        for session in list(self.sessions):
+            session.sock.close()
+        self.threads[1].join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _queue_depth(self):
+        return sum(len(session.pending) for session in self.sessions)
+
+    def metrics(self):
+        with self.cond:
+            uptime = time.monotonic() - self.t_start
+            return BoardServerMetrics(len(self.sessions),
+                                      self._queue_depth(),
+                                      self.max_queue_depth,
+                                      self.n_cmds_done,
+                                      self.n_transactions,
+                                      self.busy_seconds,
+                                      uptime,
+                                      self.busy_seconds / uptime if uptime > 0 else 0.0)
+
+    ########################################################################
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.listen_sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.cond:
+                session = Session(sock, self.next_session_id, self.binary_p)
+                self.next_session_id += 1
+                self.sessions.append(session)
+            session.write_line('READY-FOR-INPUT')
+            session.flush()
+            threading.Thread(target=self._read_loop, args=(session,), daemon=True).start()
+
+    def _read_loop(self, session):
+        try:
+            for item in session.items():
+                with self.cond:
+                    if session.closed_p:
+                        break
+                    session.pending.append(item)
+                    self.max_queue_depth = max(self.max_queue_depth, self._queue_depth())
+                    self.cond.notify_all()
+        except OSError:
+            pass
+        with self.cond:
+            session.closed_p = True
+            self.cond.notify_all()
+
+    def _next_session(self):
+        """
+        Choose which session to serve next, removing closed ones, or return
+        None if there is nothing to do.  Must hold the lock.
+        """
+        for session in [s for s in self.sessions if s.closed_p and not s.pending]:
+            self.sessions.remove(session)
+            session.sock.close()
+            if self.transaction_owner is session:
+                self.transaction_owner = None
+        if self.transaction_owner is not None:
+            owner = self.transaction_owner
+            return owner if owner.pending else None
+        n_sessions = len(self.sessions)
+        for i in range(n_sessions):
+            session = self.sessions[(self.rr_idx + i) % n_sessions]
+            if session.pending:
+                self.rr_idx = (self.rr_idx + i + 1) % n_sessions
+                return session
+        return None
+
+    def _board_loop(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopping_p:
+                        return
+                    session = self._next_session()
+                    if session is not None:
+                        break
+                    self.cond.wait()
+                item = session.pending.popleft()
+                cmds = []
+                reply = None
+                if isinstance(item[0], int):
+                    cmds.append(item)
+                    while (session.pending and len(cmds) < self.max_batch
+                           and isinstance(session.pending[0][0], int)):
+                        cmds.append(session.pending.popleft())
+                elif item == Control.Begin:
+                    if self.transaction_owner is None:
+                        self.transaction_owner = session
+                        self.n_transactions += 1
+                elif item == Control.End:
+                    if self.transaction_owner is session:
+                        self.transaction_owner = None
+                elif item == Control.Stats:
+                    stats_line = ('BOARD-SERVER-STATS: '
+                                  + ' '.join('%s=%s' % kv for kv in
+                                             self.metrics()._asdict().items()))
+                    reply = lambda: session.write_line(stats_line)
+                else:
+                    raw = item[1] if isinstance(item[1], bytes) else b''
+                    reply = lambda: session.write_invalid(raw)
+                self.cond.notify_all()
+            # Write to the client without holding the lock, so that a slow
+            # client holds up nobody else.
+            if cmds:
+                self._execute(session, cmds)
+            elif reply is not None:
+                reply()
+                session.flush()
+            if session.closed_p:
+                with self.cond:
+                    self.cond.notify_all()
+
+    def _execute(self, session, cmds):
+        # Make data-only commands explicit if another session has moved the
+        # board's address latch since this session set it.
+        board_cmds = []
+        addr = session.last_addr
+        board_addr = self.board_addr
+        for cmd in cmds:
+            if len(cmd) == 2:
+                addr = cmd[0]
+                board_cmds.append(cmd)
+            elif addr is not None and addr != board_addr:
+                board_cmds.append((addr, cmd[0]))
+            else:
+                board_cmds.append(cmd)
+            if addr is not None:
+                board_addr = addr
+        session.last_addr = addr
+        self.board_addr = board_addr
+
+        t0 = time.monotonic()
+        n_done = 0
+        while n_done < len(cmds):
+            # The board's transport stops at a failed command; carry on
+            # with the rest, as a monitor would.
+            error_p, response_bytes = self.transport.submit_cmds(
+                board_cmds[n_done:], self.max_batch)
+            session.write_responses(cmds[n_done:n_done + len(error_p)],
+                                    error_p, response_bytes)
+            n_done += len(error_p)
+            if session.closed_p:
+                break
+        session.flush()
+        with self.cond:
+            self.busy_seconds += time.monotonic() - t0
+            self.n_cmds_done += len(cmds)
+
+
+class BoardServerTransport(SocketTransport):
+    """
+    Transport to a BoardServer, shared with other clients.
+    """
+
+    shared_p = True
+
+    @classmethod
+    def connect(cls, host, port, wire_format='text', **kwargs):
+        return cls.connect_tcp(host, port, wire_format, **kwargs)
+
+    def _send_control(self, text, frame_data):
+        if self.binary_p:
+            self._write(bytes([Control.Frame_Flag, 0, frame_data, 0]))
+        else:
+            self._write(text.encode('ascii') + b'\n')
+
+    def begin_transaction(self):
+        self._send_control(Control.Begin, 0x01)
+
+    def end_transaction(self):
+        self._send_control(Control.End, 0x00)
+
+    def stats(self):
+        """
+        Ask the server for its metrics, as a dict of strings (text wire
+        format only).
+        """
+        if self.binary_p:
+            raise ValueError('stats only available with text wire format')
+        self._write(Control.Stats.encode('ascii') + b'\n')
+        while True:
+            line = self.f_resp.readline()
+            if not line:
+                raise RuntimeError('board server closed connection')
+            line = line.decode('ascii').rstrip()
+            if line.startswith('BOARD-SERVER-STATS: '):
+                return dict(kv.split('=', 1) for kv in line.split()[1:])
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Share one board between many clients')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7373)
+    parser.add_argument('--binary', action='store_true',
+                        help='use binary wire format, to clients and to board')
+    parser.add_argument('--backend', choices=['monitor-repl', 'model'],
+                        default='monitor-repl')
+    args = parser.parse_args(args)
+
+    wire_format = 'binary' if args.binary else 'text'
+    transport = (ModelTransport() if args.backend == 'model'
+                 else MonitorProcessTransport(wire_format))
+    server = BoardServer(transport, args.host, args.port, wire_format).start()
+    print('serving on %s:%d' % server.address)
+    try:
+        while True:
+            time.sleep(60)
+            print(server.metrics())
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
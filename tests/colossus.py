@@ -16,10 +16,15 @@
 # "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
+from contextlib import contextmanager
+import functools
+import hashlib
 import numpy as np
-import subprocess
-import re
+import os
 from enum import Enum
+from transports import (ColossusResponse, BinaryFrame, cmd_str,
+                        ModelTransport, MonitorProcessTransport)
+from tracing import RingBufferTracer
 
 
 class QPanelTopUnitCfg(namedtuple('QPanelTopUnitCfg',
@@ -123,6 +128,9 @@ class SteppingCfg(namedtuple('SteppingCfg',
                 + int(self.ign_rpt))
 
 
+StepCountVectorPhase = namedtuple('StepCountVectorPhase', 'fast_wheel_idxs n_steps')
+
+
 class SetTotalOperation(Enum):
     Count_GT_Threshold = 0
     Count_LT_Threshold = 1
@@ -150,31 +158,14 @@ SetTotalCfg.AlwaysPrint = SetTotalCfg(0, SetTotalOperation.Always_True)
 SetTotalCfg.NeverPrint = SetTotalCfg(0, SetTotalOperation.Count_LT_Threshold)
 
 
-class ColossusResponse(namedtuple('ColossusResponse',
-                                  ['cmd', 'error_p', 'response_byte'])):
-    @classmethod
-    def from_cmd_response(cls, cmd, line):
-        s_cmd_echo, s_error_p, s_response_byte = line.rstrip().split()
-        if len(s_cmd_echo) == 2:
-            cmd_echo = (int(s_cmd_echo, 16),)
-        elif len(s_cmd_echo) == 4:
-            cmd_echo = (int(s_cmd_echo[:2], 16), int(s_cmd_echo[2:], 16))
-        else:
-            raise ValueError('expected echo to be of length 2 or 4')
-        if cmd_echo != cmd:
-            raise ValueError('expected echo to match given cmd')
-        if s_error_p == "'0'":
-            error_p = False
-        elif s_error_p == "'1'":
-            error_p = True
-        else:
-            raise ValueError("expected error-p to be '0' or '1'")
-        response_byte = int(s_response_byte)
-        return cls(cmd, error_p, response_byte)
-
-    @property
-    def cmd_str(self):
-        return ''.join('%02x' % x for x in self.cmd)
+class SweepConfig(namedtuple('SweepConfig',
+                             'q_selector_cfg top_cfgs bottom_cfgs negating_cfg',
+                             defaults=((), (), None))):
+    """
+    One configuration for Colossus.sweep_configs(): a Q selector config,
+    and Q panel unit configs as for q_panel.compile_q_panel().  Q panel
+    units not given are reset.
+    """
 
 
 class Colossus:
@@ -188,37 +179,335 @@ class Colossus:
     Step_Fast_Cfg = SteppingCfg(True, False, False, False)
     No_Stepping_Cfg = SteppingCfg(False, False, False, False)
 
-    def __init__(self):
-        self.monitor_process = subprocess.Popen(['./monitor-repl.sh'],
-                                                stdout=subprocess.PIPE,
-                                                universal_newlines=True)
-        self.f_cmd = open('/tmp/repl-input', 'wt')
-        self.f_cmd_spool = open('/tmp/repl-input-spool', 'wt')
-        self.f_resp = self.monitor_process.stdout
-        self.f_spool = open('/tmp/repl-output', 'wt')
-        while True:
-            if self.f_resp.readline().startswith('READY-FOR-INPUT'):
-                break
+    # Backends:
+    #
+    #     'monitor-repl' --- the ISE simulator, or real hardware if run on
+    #                        the Raspberry Pi; see monitor-repl.sh
+    #     'model' --- in-process software model; see colossus_model.py
+    #
+    # If no backend is given, the COLOSSUS_BACKEND environment variable is
+    # consulted, defaulting to 'monitor-repl'.
+    #
+    # Alternatively, pass any Transport (see transports.py), e.g., a
+    # MonitorProcessTransport with its own FIFO, or a SocketTransport to a
+    # board server; each Colossus then owns its own endpoint.
+    #
+    # Traffic is recorded by 'tracer' (see tracing.py); by default, a
+    # RingBufferTracer, which writes the recent history to a file if a
+    # command fails.
+    #
+    Backends = ['monitor-repl', 'model']
+
+    def __init__(self, backend=None, wire_format='text', transport=None, tracer=None):
+        if transport is None:
+            transport = self.make_transport(backend, wire_format)
+        self.transport = transport
+        self.transport.tracer = tracer if tracer is not None else RingBufferTracer()
+        self.model = getattr(transport, 'model', None)
+        self.config_shadow = {}
+        self.tape_shadow = None
+        self.tape_write_ptr = None
+        self.wheel_pattern_shadow = {}
+        self.last_addr = None
+        self.transaction_depth = 0
         self.reset_all_stepping()
         self.reset_all_step_count_vector_configs()
         self.reset_all_set_total_configs()
 
+    @classmethod
+    def make_transport(cls, backend=None, wire_format='text'):
+        backend = backend or os.environ.get('COLOSSUS_BACKEND', 'monitor-repl')
+        if backend not in cls.Backends:
+            raise ValueError('backend must be one of %s' % ', '.join(cls.Backends))
+        if wire_format not in ('text', 'binary'):
+            raise ValueError('wire_format must be "text" or "binary"')
+        if backend == 'model':
+            return ModelTransport()
+        return MonitorProcessTransport(wire_format)
+
+    def close(self):
+        self.transport.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager within which our commands are not interleaved with
+        those of other clients of a shared board (see board_server.py).
+        May be nested.
+        """
+        if self.transaction_depth == 0:
+            self.transport.begin_transaction()
+            if self.transport.shared_p:
+                self.invalidate()
+        self.transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.transport.end_transaction()
+
+    # Maximum number of commands submit_cmds() will have outstanding at once.
+    PIPELINE_DEPTH = 64
+
+    _cmd_str = staticmethod(cmd_str)
+
+    def _submit_cmds(self, cmds, max_n_in_flight):
+        self._forget_shadowed_state(cmds)
+        return self.transport.submit_cmds(cmds, max_n_in_flight)
+
     def __call__(self, addr_or_data, data=None):
         cmd_tup = (addr_or_data,) + ((data,) if data is not None else ())
-        cmd_txt = ('{0:02x}\n'.format(addr_or_data)
-                   if data is None
-                   else '{0:02x}{1:02x}\n'.format(addr_or_data, data))
-        self.f_cmd.write(cmd_txt)
-        self.f_cmd.flush()
-        self.f_cmd_spool.write(cmd_txt)
-        self.f_cmd_spool.flush()
-        while True:
-            m_resp_line = self.f_resp.readline()
-            self.f_spool.write(m_resp_line)
-            m_resp_match = re.match('^COLOSSUS-RESPONSE: (.*)', m_resp_line)
-            if m_resp_match:
-                return ColossusResponse.from_cmd_response(
-                    cmd_tup, m_resp_match.group(1))
+        error_p, response_bytes = self._submit_cmds([cmd_tup], 1)
+        if error_p[0]:
+            self.transport.tracer.on_error()
+        return ColossusResponse(cmd_tup, bool(error_p[0]), int(response_bytes[0]))
+
+    def submit_cmds(self, cmds, max_n_in_flight=None):
+        """
+        Send all of the given commands, each an (addr, data) or (data,) tuple,
+        keeping up to 'max_n_in_flight' of them outstanding at once.  Return
+        the list of responses, in command order.  If a command fails, no
+        further commands are sent, but those already in flight are waited
+        for, so the returned list is one longer than the index of the first
+        failed command (or longer).
+        """
+        cmds = [tuple(cmd) for cmd in cmds]
+        error_p, response_bytes = self._submit_cmds(
+            cmds, max_n_in_flight or self.PIPELINE_DEPTH)
+        if np.any(error_p):
+            self.transport.tracer.on_error()
+        return [ColossusResponse(cmd, bool(e), int(r))
+                for cmd, e, r in zip(cmds, error_p, response_bytes)]
+
+    def do_cmds(self, cmds, exp_responses=None, max_n_in_flight=None):
+        """
+        Pipelined equivalent of do_cmd() for a sequence of commands, returning
+        a uint8 array of response bytes.  If 'exp_responses' is given (either
+        one value for all commands, or one per command), also check that each
+        response is as expected, where a negative expected value means any
+        response is acceptable.  Any error, or unexpected response, is
+        reported against the command which caused it.
+        """
+        cmds = [tuple(cmd) for cmd in cmds]
+        error_p, response_bytes = self._submit_cmds(
+            cmds, max_n_in_flight or self.PIPELINE_DEPTH)
+        if np.any(error_p):
+            self.transport.tracer.on_error()
+            idx = np.flatnonzero(error_p)[0]
+            raise RuntimeError('error for %s (command %d of %d): %02x'
+                               % (self._cmd_str(cmds[idx]), idx, len(cmds),
+                                  response_bytes[idx]))
+        if exp_responses is not None:
+            exp_responses = np.broadcast_to(exp_responses, (len(cmds),))
+            unexp_idxs = np.flatnonzero((response_bytes != exp_responses)
+                                        & (exp_responses >= 0))
+            if len(unexp_idxs):
+                self.transport.tracer.on_error()
+                idx = unexp_idxs[0]
+                raise RuntimeError('unexpected response for %s (command %d of %d):'
+                                   ' got %02x but expected %02x'
+                                   % (self._cmd_str(cmds[idx]), idx, len(cmds),
+                                      response_bytes[idx], exp_responses[idx]))
+        return response_bytes
+
+    ########################################################################
+    # Bulk register readback
+    #
+    # Each entry of Readback_Map names a fixed set of independent reads (see
+    # the address table in src/design.org).  'lsb_cmds' gives the (addr,
+    # data) read for each element of the result; if 'msb_cmds' is given,
+    # each element is a uint16 assembled from the two octets, otherwise it
+    # is a uint8.  Any number of entries can be read as one pipelined batch.
+
+    Readback = namedtuple('Readback', 'lsb_cmds msb_cmds')
+
+    Readback_Map = {
+        'counters': Readback(
+            [(16, i) for i in range(N_COUNTERS)],
+            [(16, 0x10 + i) for i in range(N_COUNTERS)]),
+        'comparator_counter_values': Readback(
+            [(128, 0x20 + i) for i in range(N_COUNTERS)],
+            [(128, 0x30 + i) for i in range(N_COUNTERS)]),
+        'comparator_setting_labels': Readback(
+            [(128, i) for i in range(N_WHEELS)],
+            None),
+        'comparator_flags': Readback(
+            [(128, 0x40 + i) for i in range(4)],
+            None),
+        'step_count_vector_values': Readback(
+            [(236, i) for i in range(N_WHEELS)],
+            None),
+        'step_counts_via_wheels': Readback(
+            [(171 + 2 * i, 0x80) for i in range(N_WHEELS)],
+            None),
+        'printer_fill_level': Readback(
+            [(242, 0x00)],
+            [(242, 0x01)]),
+        # Z (including stop bit, so sampling the tape at the read
+        # pointer), Q, Chi and A; see Snoop_Targets.
+        'snooped_buses': Readback(
+            [(25, target) for target in (0x00, 0x01, 0x02, 0x05)],
+            None),
+    }
+
+    @classmethod
+    def _readback_cmds(cls, name):
+        readback = cls.Readback_Map[name]
+        return readback.lsb_cmds + (readback.msb_cmds or [])
+
+    @classmethod
+    def _decode_readback(cls, name, responses):
+        """
+        Values of the Readback_Map entry 'name', assembled from 'responses'
+        to its _readback_cmds(), which run along the last axis.
+        """
+        readback = cls.Readback_Map[name]
+        n = len(readback.lsb_cmds)
+        if readback.msb_cmds is None:
+            return responses[..., :n].copy()
+        lsbs_and_msbs = responses[..., :2 * n].astype(np.uint16)
+        return lsbs_and_msbs[..., :n] | (lsbs_and_msbs[..., n:] << 8)
+
+    @classmethod
+    def _decode_readbacks(cls, names, responses):
+        """
+        Dict from each of the named entries of Readback_Map to its values,
+        assembled from 'responses', one per command of the entries'
+        _readback_cmds() in turn.
+        """
+        values = {}
+        idx0 = 0
+        for name in names:
+            n_cmds = len(cls._readback_cmds(name))
+            values[name] = cls._decode_readback(name, responses[idx0 : idx0 + n_cmds])
+            idx0 += n_cmds
+        return values
+
+    def read_registers(self, names=None):
+        """
+        Perform the reads of each of the named entries of Readback_Map
+        (default all of them) as one batch, returning a dict from name to
+        array of values.
+        """
+        if names is None:
+            names = list(self.Readback_Map)
+        cmds = [cmd for name in names for cmd in self._readback_cmds(name)]
+        return self._decode_readbacks(names, self.do_cmds(cmds))
+
+    def read_register(self, name):
+        return self.read_registers([name])[name]
+
+    def snapshot(self):
+        """
+        Read all of Readback_Map, returning a MachineSnapshot.  A read
+        which fails (e.g., because the bodies disagree) does not stop the
+        others, but is flagged in the snapshot's 'errors'.
+        """
+        names = list(self.Readback_Map)
+        cmds = [cmd for name in names for cmd in self._readback_cmds(name)]
+        responses = []
+        while len(responses) < len(cmds):
+            # submit_cmds() stops at a failed command; carry on after it.
+            # Every read names its address, so resuming part-way is safe.
+            responses.extend(self.submit_cmds(cmds[len(responses):]))
+        error_p = np.array([r.error_p for r in responses], dtype=bool)
+        response_bytes = np.array([r.response_byte for r in responses], dtype=np.uint8)
+        # A value assembled from two reads is flagged if either failed.
+        errors = {name: flags != 0
+                  for name, flags in self._decode_readbacks(names, error_p).items()}
+        return MachineSnapshot.from_values(self._decode_readbacks(names, response_bytes),
+                                           errors)
+
+    ########################################################################
+    # Shadow of write-only configuration registers and tape loop RAM
+    #
+    # We remember the last value written to each configuration register, so
+    # writes which would not change anything can be skipped.  Any command
+    # which might change a register behind the shadow's back (including a
+    # raw write to the register itself) makes us forget that register.  If
+    # the board might have been reset, call invalidate().
+    #
+    # Similarly we remember the contents of the tape loop RAM and the
+    # position of its write pointer, as last set by punch_tape() or
+    # clear_tape().  The tape shadow is an array with -1 for unknown
+    # entries, or None if nothing is known.
+    #
+    # And we remember, by content hash, the pattern each cam wheel was last
+    # loaded with.
+    #
+    # If the board is shared with other clients, the shadow is only trusted
+    # within a transaction.
+
+    Shadowed_Config_Addrs = frozenset(
+        [23]                                  # Q selector
+        + list(range(80, 122))                # Q panel
+        + list(range(130, 140))               # set-total
+        + list(range(224, 236)))              # step count vector
+
+    Cam_Wheel_Stepping_Addrs = frozenset(range(171, 171 + 2 * N_WHEELS, 2))
+
+    def invalidate(self):
+        """
+        Forget all remembered configuration, so that it is all written
+        afresh next time it is set.
+        """
+        self.config_shadow = {}
+        self.tape_shadow = None
+        self.tape_write_ptr = None
+        self.wheel_pattern_shadow = {}
+
+    def _forget_shadowed_state(self, cmds):
+        shadow = self.config_shadow
+        addr = self.last_addr
+        for cmd in cmds:
+            if len(cmd) == 2:
+                addr, data = cmd
+            else:
+                data = cmd[0]
+            if addr is None:
+                # Data-only command with no address latched yet; it has no
+                # known target.
+                continue
+            if addr == 26:
+                self.tape_shadow = None
+            elif addr in (28, 29):
+                self.tape_shadow = None
+                self.tape_write_ptr = None
+            elif (addr + 1) in self.Cam_Wheel_Stepping_Addrs:
+                self.wheel_pattern_shadow.pop((addr - 170) // 2, None)
+            if not shadow:
+                continue
+            if addr in self.Shadowed_Config_Addrs:
+                shadow.pop(addr, None)
+            elif addr in self.Cam_Wheel_Stepping_Addrs:
+                if data < 0x40:
+                    shadow.pop(addr, None)
+            elif (addr + 1) in self.Cam_Wheel_Stepping_Addrs:
+                # New pattern for wheel; stepping must be re-applied to
+                # take effect.
+                shadow.pop(addr + 1, None)
+            elif addr == 240 or (addr == 236 and (data >> 4) == 3):
+                # Step counts broadcast or transferred to bodies.
+                for stepping_addr in self.Cam_Wheel_Stepping_Addrs:
+                    shadow.pop(stepping_addr, None)
+        self.last_addr = addr
+
+    def _distrust_shadow_if_shared(self):
+        if self.transport.shared_p and self.transaction_depth == 0:
+            self.invalidate()
+
+    def _set_configs(self, writes, exp_response):
+        """
+        Perform those of the given (addr, value) configuration writes which
+        would change the shadowed value, checking each response.
+        """
+        self._distrust_shadow_if_shared()
+        cmds = [(addr, value) for addr, value in writes
+                if self.config_shadow.get(addr) != value]
+        if cmds:
+            self.do_cmds(cmds, exp_response)
+            self.config_shadow.update(cmds)
 
     def do_cmd(self, addr_or_data, data=None):
         r = self(addr_or_data, data)
@@ -226,14 +515,46 @@ class Colossus:
             raise RuntimeError('error for %s: %02x' % (r.cmd_str, r.response_byte))
         return r.response_byte
 
+    TAPE_LOOP_RAM_SIZE = 16384
+
     def punch_tape(self, zs, append_stop_p=True):
-        assert self.do_cmd(28, 0) == 0x44
-        if len(zs) > 0:
-            assert self.do_cmd(29, zs[0]) == 0x55
-            for z in zs[1:]:
-                assert self.do_cmd(z) == 0x55
+        """
+        Write the given letters, and optionally a stop marker, to the tape
+        loop RAM.  Only the region which differs from what we know the RAM
+        already holds is written, resuming from the current write pointer if
+        that lies before the first difference.
+        """
+        image = np.array(zs, dtype=np.int64)
         if append_stop_p:
-            assert self.do_cmd(29, 0x3f) == 0x55
+            image = np.append(image, 0x3f)
+        n_image = len(image)
+        if n_image > self.TAPE_LOOP_RAM_SIZE:
+            raise ValueError('tape too long for tape loop RAM')
+        self._distrust_shadow_if_shared()
+
+        old_shadow = self.tape_shadow
+        if old_shadow is None:
+            old_shadow = np.full(self.TAPE_LOOP_RAM_SIZE, -1, dtype=np.int16)
+        changed_idxs = np.flatnonzero(old_shadow[:n_image] != image)
+        if len(changed_idxs) == 0:
+            return
+
+        write_ptr = self.tape_write_ptr
+        write_end = changed_idxs[-1] + 1
+        if write_ptr is not None and write_ptr <= changed_idxs[0]:
+            write_start, cmds, exp_responses = write_ptr, [], []
+        else:
+            write_start, cmds, exp_responses = 0, [(28, 0)], [0x44]
+        to_write = image[write_start:write_end].tolist()
+        cmds.append((29, to_write[0]))
+        cmds.extend((z,) for z in to_write[1:])
+        exp_responses.extend([0x55] * len(to_write))
+        self.do_cmds(cmds, exp_responses)
+
+        new_shadow = old_shadow.copy()
+        new_shadow[write_start:write_end] = to_write
+        self.tape_shadow = new_shadow
+        self.tape_write_ptr = write_end % self.TAPE_LOOP_RAM_SIZE
 
     def punch_random_tape(self, n_letters, seed=42, value_ub=32):
         np.random.seed(seed)
@@ -243,6 +564,7 @@ class Colossus:
 
     def clear_tape(self):
         assert self.do_cmd(26, 0) == 0x33
+        self.tape_shadow = np.full(self.TAPE_LOOP_RAM_SIZE, 0xa5, dtype=np.int16)
 
     def reset_tape_read_pointer(self):
         assert self.do_cmd(27, 0x00) == 0x45
@@ -252,19 +574,59 @@ class Colossus:
 
     def read_tape_contents(self, n_sprockets):
         self.reset_tape_read_pointer()
-        return np.array([self.read_tape_and_advance_read_pointer()
-                         for _ in range(n_sprockets)], dtype=np.uint8)
-
-    def _load_wheel_pattern(self, ctrl_addr, pattern):
-        pattern = pattern[::-1]
-        n_excess = len(pattern) % 8
-        if n_excess:
-            pattern = np.concatenate([np.zeros(8 - n_excess, dtype=np.uint8),
-                                      pattern])
-        assert len(pattern) % 8 == 0
-        for i in range(0, len(pattern), 8):
-            chunk = int(''.join(str(b) for b in pattern[i:i+8]), 2)
-            assert self.do_cmd(ctrl_addr, chunk) == 0x58
+        return self.do_cmds([(27, 0x01)] * n_sprockets)
+
+    @staticmethod
+    def _wheel_pattern_bytes(pattern):
+        return np.ascontiguousarray(pattern, dtype=np.uint8).tobytes()
+
+    # Bounded, so that a search over many candidate patterns does not grow
+    # the cache without limit.
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _wheel_pattern_octets(pattern_bytes):
+        """
+        The octets which load the pattern with the given bytes (one per
+        cam): the pattern reversed, zero-padded at the front to a whole
+        number of octets, and packed most-significant bit first.
+        """
+        pattern = np.frombuffer(pattern_bytes, dtype=np.uint8)[::-1]
+        padded = np.zeros(-(-len(pattern) // 8) * 8, dtype=np.uint8)
+        padded[len(padded) - len(pattern):] = pattern
+        return tuple(int(x) for x in np.packbits(padded))
+
+    def load_cam_wheels(self, patterns_by_wheel_idx):
+        """
+        Load each of the given patterns (a dict from wheel index to
+        pattern) into its cam wheel, as one batch of commands, skipping
+        wheels which we know already hold their pattern.
+        """
+        self._distrust_shadow_if_shared()
+        cmds = []
+        new_hashes = {}
+        for wheel_idx, pattern in patterns_by_wheel_idx.items():
+            if len(pattern) != self.N_CAMS_ALL[wheel_idx]:
+                raise ValueError('bad pattern length for wheel %d' % wheel_idx)
+            pattern_bytes = self._wheel_pattern_bytes(pattern)
+            pattern_hash = hashlib.sha1(pattern_bytes).digest()
+            if self.wheel_pattern_shadow.get(wheel_idx) == pattern_hash:
+                continue
+            ctrl_addr = 170 + 2 * wheel_idx
+            cmds.extend((ctrl_addr, octet)
+                        for octet in self._wheel_pattern_octets(pattern_bytes))
+            new_hashes[wheel_idx] = pattern_hash
+        if cmds:
+            self.do_cmds(cmds, 0x58)
+            self.wheel_pattern_shadow.update(new_hashes)
+
+    def load_all_wheels(self, chi, psi, mu):
+        """
+        Load the five chi, five psi and two mu wheel patterns.
+        """
+        patterns = list(chi) + list(psi) + list(mu)
+        if len(patterns) != self.N_WHEELS:
+            raise ValueError('need %d wheel patterns' % self.N_WHEELS)
+        self.load_cam_wheels(dict(enumerate(patterns)))
 
     def load_chi_wheel_pattern(self, chi_wheel_idx, pattern):
         self.load_cam_wheel(chi_wheel_idx, pattern)
@@ -282,37 +644,68 @@ class Colossus:
         assert self.do_cmd(22, 1) == 0xb5
 
     def set_q_selector_cfg(self, cfg):
-        assert self.do_cmd(23, cfg) == 0x12
+        self._set_configs([(23, cfg)], 0x12)
 
     N_Q_PANEL_TOP_UNITS = 10
 
-    def set_q_panel_top_unit_cfg(self, unit_idx, cfg):
+    @staticmethod
+    def _q_panel_top_unit_cfg_writes(unit_idx, cfg):
         base_addr = 80 + 3 * unit_idx
-        self.do_cmd(base_addr, cfg.cfg_0)
-        self.do_cmd(base_addr + 1, cfg.cfg_1)
-        self.do_cmd(base_addr + 2, cfg.cfg_2)
+        return [(base_addr, cfg.cfg_0),
+                (base_addr + 1, cfg.cfg_1),
+                (base_addr + 2, cfg.cfg_2)]
+
+    def set_q_panel_top_unit_cfg(self, unit_idx, cfg):
+        self._set_configs(self._q_panel_top_unit_cfg_writes(unit_idx, cfg), 0x12)
 
     N_Q_PANEL_BOTTOM_UNITS = 5
 
-    def set_q_panel_bottom_unit_cfg(self, unit_idx, cfg):
+    @staticmethod
+    def _q_panel_bottom_unit_cfg_writes(unit_idx, cfg):
         base_addr = 110 + 2 * unit_idx
-        self.do_cmd(base_addr, cfg.cfg_0)
-        self.do_cmd(base_addr + 1, cfg.cfg_1)
+        return [(base_addr, cfg.cfg_0),
+                (base_addr + 1, cfg.cfg_1)]
 
-    def set_q_panel_negating_cfg(self, cfg):
+    def set_q_panel_bottom_unit_cfg(self, unit_idx, cfg):
+        self._set_configs(self._q_panel_bottom_unit_cfg_writes(unit_idx, cfg), 0x12)
+
+    @staticmethod
+    def _q_panel_negating_cfg_writes(cfg):
         base_addr = 120
-        assert self.do_cmd(base_addr, cfg.cfg_0) == 0x12
-        assert self.do_cmd(base_addr + 1, cfg.cfg_1) == 0x12
+        return [(base_addr, cfg.cfg_0),
+                (base_addr + 1, cfg.cfg_1)]
 
-    def reset_q_panel_cfg(self):
+    def set_q_panel_negating_cfg(self, cfg):
+        self._set_configs(self._q_panel_negating_cfg_writes(cfg), 0x12)
+
+    @classmethod
+    def _q_panel_cfg_writes(cls, top_cfgs=(), bottom_cfgs=(), negating_cfg=None):
+        """
+        Writes configuring the whole Q panel: the given top and bottom unit
+        configs for units 0 upwards, and negating config; all other units,
+        and the negating config if not given, are reset.
+        """
         top_nop_cfg = QPanelTopUnitCfg(0, 0, 0, 0)
-        for idx in range(self.N_Q_PANEL_TOP_UNITS):
-            self.set_q_panel_top_unit_cfg(idx, top_nop_cfg)
         bottom_nop_cfg = QPanelBottomUnitCfg(0, 0, 0)
-        for idx in range(self.N_Q_PANEL_BOTTOM_UNITS):
-            self.set_q_panel_bottom_unit_cfg(idx, bottom_nop_cfg)
         negates_nop_cfg = QPanelNegatingCfg(0, 0)
-        self.set_q_panel_negating_cfg(negates_nop_cfg)
+        if (len(top_cfgs) > cls.N_Q_PANEL_TOP_UNITS
+            or len(bottom_cfgs) > cls.N_Q_PANEL_BOTTOM_UNITS):
+            #
+            raise ValueError('too many Q panel units')
+        top_cfgs = list(top_cfgs) + [top_nop_cfg] * (cls.N_Q_PANEL_TOP_UNITS - len(top_cfgs))
+        bottom_cfgs = (list(bottom_cfgs)
+                       + [bottom_nop_cfg] * (cls.N_Q_PANEL_BOTTOM_UNITS - len(bottom_cfgs)))
+        writes = []
+        for idx, cfg in enumerate(top_cfgs):
+            writes.extend(cls._q_panel_top_unit_cfg_writes(idx, cfg))
+        for idx, cfg in enumerate(bottom_cfgs):
+            writes.extend(cls._q_panel_bottom_unit_cfg_writes(idx, cfg))
+        writes.extend(cls._q_panel_negating_cfg_writes(
+            negating_cfg if negating_cfg is not None else negates_nop_cfg))
+        return writes
+
+    def reset_q_panel_cfg(self):
+        self._set_configs(self._q_panel_cfg_writes(), 0x12)
 
     def reset_movement(self):
         assert self.do_cmd(24, 0x00) == 0x61
@@ -323,6 +716,69 @@ class Colossus:
     def run_tape_once(self):
         self.scheduler_trigger_manual(WorkerIndex.Movement_Run_Tape_Once)
 
+    Sweep_Result_Dtype = np.dtype([('q_selector_cfg', 'u1'),
+                                   ('counters', '<u2', (N_COUNTERS,))])
+
+    def sweep_configs(self, configs, zs=None, wheel_patterns=None, step_counts=None):
+        """
+        Run the tape once under each of the given SweepConfigs in turn,
+        returning a structured array, indexed by configuration, with fields
+        'q_selector_cfg' and 'counters'.  If given, the tape letters 'zs',
+        the (chi, psi, mu) 'wheel_patterns' and the 'step_counts' of all
+        wheels are set up first, once.
+
+        For each configuration, only the configuration registers which
+        differ from the previous configuration are written; the movement
+        is then reset, the tape run, and the counters snapshotted and read.
+        All of this is sent as one pipelined batch.
+        """
+        configs = list(configs)
+        with self.transaction():
+            if zs is not None:
+                self.punch_tape(zs)
+            if wheel_patterns is not None:
+                self.load_all_wheels(*wheel_patterns)
+            if step_counts is not None:
+                if len(step_counts) != self.N_WHEELS:
+                    raise ValueError('need %d step counts' % self.N_WHEELS)
+                for wheel_idx, step_count in enumerate(step_counts):
+                    self.set_cam_wheel_stepping(wheel_idx, int(step_count))
+
+            shadow = dict(self.config_shadow)
+            counter_cmds = self._readback_cmds('counters')
+            cmds = []
+            exp_responses = []
+            counter_read_idxs = []
+            for config in configs:
+                writes = ([(23, config.q_selector_cfg)]
+                          + self._q_panel_cfg_writes(config.top_cfgs,
+                                                     config.bottom_cfgs,
+                                                     config.negating_cfg))
+                writes = [(addr, value) for addr, value in writes
+                          if shadow.get(addr) != value]
+                shadow.update(writes)
+                cmds.extend(writes)
+                exp_responses.extend([0x12] * len(writes))
+
+                cmds.extend([(24, 0x00),
+                             (144, WorkerIndex.Movement_Run_Tape_Once.value),
+                             (16, 0x82)])
+                exp_responses.extend([0x61, 0x12, 0xa2])
+
+                counter_read_idxs.append(len(cmds))
+                cmds.extend(counter_cmds)
+                exp_responses.extend([-1] * len(counter_cmds))
+
+            responses = self.do_cmds(cmds, np.array(exp_responses, dtype=np.int16))
+            self.config_shadow.update(shadow)
+
+        read_idxs = (np.array(counter_read_idxs, dtype=np.int64)[:, None]
+                     + np.arange(len(counter_cmds)))
+        results = np.zeros(len(configs), dtype=self.Sweep_Result_Dtype)
+        results['q_selector_cfg'] = [config.q_selector_cfg for config in configs]
+        results['counters'] = self._decode_readback('counters', responses[read_idxs])
+        return results
+
     def _snoop_x(self, snoop_tgt, post_move_p):
         x = self.do_cmd(25, snoop_tgt)
         if post_move_p:
@@ -338,20 +794,62 @@ class Colossus:
     def snoop_A(self, post_move_p=False):
         return self._snoop_x(0x05, post_move_p)
 
-    def _snoop_x_vec(self, snoop_tgt, n_sprockets, reset_first_p):
+    Snoop_Targets = {'Z': 0x00, 'Q': 0x01, 'Chi': 0x02, 'A': 0x05}
+
+    def snoop_vec(self, n_sprockets, buses=('Z', 'Q', 'A'),
+                  positions=None, reset_first_p=True):
+        """
+        Walk the tape through 'n_sprockets' sprockets, snooping each of the
+        named buses (keys of Snoop_Targets) at each of the given positions
+        (default all) before moving on.  Return a structured array with a
+        'position' field and a uint8 field per bus.  All commands are sent
+        as one pipelined batch.
+        """
+        if positions is None:
+            positions = range(n_sprockets)
+        positions = np.asarray(positions, dtype=np.int64)
+        if np.any(np.diff(positions) <= 0):
+            raise ValueError('positions must be strictly increasing')
+        if len(positions) and (positions[0] < 0 or positions[-1] >= n_sprockets):
+            raise ValueError('positions must lie within the %d sprockets' % n_sprockets)
+        snoop_cmds = [(25, self.Snoop_Targets[bus]) for bus in buses]
+
         if reset_first_p:
             self.reset_movement()
-        return np.array([self._snoop_x(snoop_tgt, post_move_p=True)
-                         for _ in range(n_sprockets)], dtype=np.uint8)
+
+        sampled_p = np.zeros(n_sprockets, dtype=bool)
+        sampled_p[positions] = True
+        cmds = []
+        for sampled in sampled_p:
+            if sampled:
+                cmds.extend(snoop_cmds)
+            cmds.append((24, 0x01))
+        responses = self.do_cmds(cmds)
+
+        move_p = np.array([cmd[0] == 24 for cmd in cmds])
+        if np.any(responses[move_p] != 0x63):
+            raise RuntimeError('unexpected response to move_one_sprocket()')
+        snooped = responses[~move_p].reshape(len(positions), len(buses))
+
+        result = np.zeros(len(positions),
+                          dtype=[('position', np.int64)]
+                                + [(bus, np.uint8) for bus in buses])
+        result['position'] = positions
+        for i, bus in enumerate(buses):
+            result[bus] = snooped[:, i]
+        return result
+
+    def _snoop_x_vec(self, bus, n_sprockets, reset_first_p):
+        return self.snoop_vec(n_sprockets, [bus], reset_first_p=reset_first_p)[bus]
 
     def snoop_Z_vec(self, n_sprockets, reset_first_p=True):
-        return self._snoop_x_vec(0x00, n_sprockets, reset_first_p)
+        return self._snoop_x_vec('Z', n_sprockets, reset_first_p)
 
     def snoop_Q_vec(self, n_sprockets, reset_first_p=True):
-        return self._snoop_x_vec(0x01, n_sprockets, reset_first_p)
+        return self._snoop_x_vec('Q', n_sprockets, reset_first_p)
 
     def snoop_A_vec(self, n_sprockets, reset_first_p=True):
-        return self._snoop_x_vec(0x05, n_sprockets, reset_first_p)
+        return self._snoop_x_vec('A', n_sprockets, reset_first_p)
 
     def reset_counters(self):
         assert self.do_cmd(16, 0x80) == 0xa0
@@ -368,7 +866,7 @@ class Colossus:
         return counter_lsb + (counter_msb << 8)
 
     def read_all_counters(self):
-        return np.array([self.read_counter(i) for i in range(5)])
+        return self.read_register('counters').astype(np.int64)
 
     def printer_reset(self):
         assert self.do_cmd(243, 0) == 0x11
@@ -385,15 +883,10 @@ class Colossus:
         n_chars_high = self.do_cmd(242, 0x01)
         n_chars = n_chars_low + (n_chars_high << 8)
         assert self.do_cmd(242, 0x02) == 0x32
-        return np.array([self.do_cmd(242, 0x03) for _ in range(n_chars)],
-                        dtype=np.uint8)
+        return self.do_cmds([(242, 0x03)] * n_chars)
 
     def printer_read_records(self):
-        octets = self.printer_read_contents()
-        record_len = PrintRecord.Encoded_N_Octets
-        assert len(octets) % record_len == 0
-        return [PrintRecord.from_octets(octets[idx0 : (idx0 + record_len)])
-                for idx0 in range(0, len(octets), record_len)]
+        return PrintRecord.array_from_octets(self.printer_read_contents())
 
     def scheduler_trigger_manual(self, worker_tag):
         assert self.do_cmd(144, worker_tag.value) == 0x12
@@ -405,27 +898,25 @@ class Colossus:
         assert self.do_cmd(241, body_idx) == 0x19
 
     def comparator_read_setting_labels(self):
-        return np.array([self.do_cmd(128, wheel_idx)
-                         for wheel_idx in range(self.N_WHEELS)],
-                        dtype=np.uint8)
+        return self.read_register('comparator_setting_labels')
 
     def comparator_read_counter_values(self):
-        lsbs = np.array([self.do_cmd(128, 0x20 + counter_idx)
-                         for counter_idx in range(self.N_COUNTERS)],
-                        dtype=np.uint16)
-        msbs = np.array([self.do_cmd(128, 0x30 + counter_idx)
-                         for counter_idx in range(self.N_COUNTERS)],
-                        dtype=np.uint16)
-        return (lsbs + msbs * 256)
+        return self.read_register('comparator_counter_values')
+
+    @staticmethod
+    def _set_total_config_writes(counter_idx, cfg):
+        base_addr = 130 + 2 * counter_idx
+        return [(base_addr, cfg.cfg_0),
+                (base_addr + 1, cfg.cfg_1)]
 
     def reset_all_set_total_configs(self):
+        writes = []
         for i in range(self.N_COUNTERS):
-            self.set_set_total_config(i, SetTotalCfg.NeverPrint)
+            writes.extend(self._set_total_config_writes(i, SetTotalCfg.NeverPrint))
+        self._set_configs(writes, 0x12)
 
     def set_set_total_config(self, counter_idx, cfg):
-        base_addr = 130 + 2 * counter_idx
-        self.do_cmd(base_addr, cfg.cfg_0)
-        self.do_cmd(base_addr + 1, cfg.cfg_1)
+        self._set_configs(self._set_total_config_writes(counter_idx, cfg), 0x12)
 
     def read_counter_value_gt_threshold(self):
         return self.do_cmd(128, 0x40)
@@ -443,16 +934,15 @@ class Colossus:
         assert self.do_cmd(240, 255) == 0x15
 
     def load_cam_wheel(self, wheel_idx, pattern):
-        self._load_wheel_pattern(170 + 2 * wheel_idx, pattern)
+        self.load_cam_wheels({wheel_idx: pattern})
 
     def reset_all_stepping(self):
-        for wh in range(self.N_WHEELS):
-            self.set_cam_wheel_stepping(wh, 0)
+        self._set_configs([(171 + 2 * wh, 0) for wh in range(self.N_WHEELS)], 0x30)
 
     def set_cam_wheel_stepping(self, wheel_idx, step_count):
         if step_count >= self.N_CAMS_ALL[wheel_idx]:
             raise ValueError('bad step count')
-        assert self.do_cmd(171 + 2 * wheel_idx, step_count) == 0x30
+        self._set_configs([(171 + 2 * wheel_idx, step_count)], 0x30)
 
     def reset_all_cam_wheel_ng_movements(self):
         for wh in range(self.N_WHEELS):
@@ -480,24 +970,78 @@ class Colossus:
                         dtype=np.uint8)
 
     def read_step_counts_via_wheels(self):
-        return np.array([self.read_cam_wheel_step_count(i)
-                         for i in range(self.N_WHEELS)])
+        return self.read_register('step_counts_via_wheels').astype(np.int64)
+
+    @classmethod
+    def plan_step_count_vector(cls, tgt_counts, start_counts=None):
+        """
+        Plan how to step the step-count vector from 'start_counts' (default
+        all zero) to 'tgt_counts', as a list of StepCountVectorPhase.  In
+        each phase, exactly the listed wheels are set to step fast and the
+        vector is stepped 'n_steps' times.  Every wheel still short of its
+        target steps in every phase, and drops out once there, so the total
+        number of steps is the most any one wheel needs, and each wheel's
+        config changes at most twice.
+        """
+        n_cams = np.array(cls.N_CAMS_ALL)
+        tgt_counts = np.asarray(tgt_counts)
+        if start_counts is None:
+            start_counts = np.zeros(cls.N_WHEELS, dtype=np.int64)
+        start_counts = np.asarray(start_counts)
+        for counts in [tgt_counts, start_counts]:
+            if counts.shape != (cls.N_WHEELS,) or np.any((counts < 0) | (counts >= n_cams)):
+                raise ValueError('bad step counts')
+
+        n_steps_needed = (tgt_counts - start_counts) % n_cams
+        phases = []
+        n_steps_done = 0
+        for n_steps in np.unique(n_steps_needed[n_steps_needed > 0]):
+            fast_wheel_idxs = tuple(np.flatnonzero(n_steps_needed >= n_steps).tolist())
+            phases.append(StepCountVectorPhase(fast_wheel_idxs, int(n_steps) - n_steps_done))
+            n_steps_done = int(n_steps)
+        return phases
+
+    def move_step_count_vector_to(self, tgt_counts, reset_first_p=True):
+        """
+        Bring the step-count vector to 'tgt_counts' by executing the plan
+        from plan_step_count_vector(), as one pipelined batch.  The vector
+        is first reset, unless 'reset_first_p' is False, in which case it
+        continues from its current values (e.g., to resume from an arbitrary
+        setting).  All step-count-vector configs are left as no-stepping.
+        """
+        self._distrust_shadow_if_shared()
+        if reset_first_p:
+            start_counts = None
+            cmds, exp_responses = [(236, 0x20)], [0x18]
+        else:
+            start_counts = self.read_step_count_vector_values()
+            cmds, exp_responses = [], []
+        phases = self.plan_step_count_vector(tgt_counts, start_counts)
+
+        cfgs = {224 + i: self.config_shadow.get(224 + i) for i in range(self.N_WHEELS)}
+        fast_cfg = self.Step_Fast_Cfg.cfg_half_octet
+        no_stepping_cfg = self.No_Stepping_Cfg.cfg_half_octet
+        for fast_wheel_idxs, n_steps in phases + [StepCountVectorPhase((), 0)]:
+            for i in range(self.N_WHEELS):
+                cfg = fast_cfg if i in fast_wheel_idxs else no_stepping_cfg
+                if cfgs[224 + i] != cfg:
+                    cmds.append((224 + i, cfg))
+                    exp_responses.append(0x12)
+                    cfgs[224 + i] = cfg
+            cmds.extend([(236, 0x21)] * n_steps)
+            exp_responses.extend([0x19] * n_steps)
+
+        self.do_cmds(cmds, exp_responses)
+        self.config_shadow.update(cfgs)
 
     def set_step_count_vector_values(self, tgt_counts):
         # Would not be used like this in real life (altering configs and then using
         # without first resetting), but should allow us to set arbitrary values in
         # the vector.
-        self.reset_all_step_count_vector_configs()
-        self.reset_step_count_vector()
-        for i, n in enumerate(tgt_counts):
-            self.set_step_count_vector_config(i, self.Step_Fast_Cfg)
-            for _ in range(n):
-                self.next_step_count_vector()
-            self.set_step_count_vector_config(i, self.No_Stepping_Cfg)
+        self.move_step_count_vector_to(tgt_counts)
 
     def read_step_count_vector_values(self):
-        return np.array([self.do_cmd(236, i) for i in range(self.N_WHEELS)],
-                        dtype=np.uint8)
+        return self.read_register('step_count_vector_values')
 
     def read_step_count_vector_ended(self):
         return self.do_cmd(236, 0x10)
@@ -523,12 +1067,13 @@ class Colossus:
                         dtype=np.uint8)
 
     def set_step_count_vector_config(self, wheel_idx, cfg):
-        self.do_cmd(224 + wheel_idx, cfg.cfg_half_octet)
+        self._set_configs([(224 + wheel_idx, cfg.cfg_half_octet)], 0x12)
 
     def reset_all_step_count_vector_configs(self):
         no_stepping_cfg = SteppingCfg(False, False, False, False)
-        for i in range(self.N_WHEELS):
-            self.set_step_count_vector_config(i, no_stepping_cfg)
+        self._set_configs([(224 + i, no_stepping_cfg.cfg_half_octet)
+                           for i in range(self.N_WHEELS)],
+                          0x12)
 
     def add_nibbles(self, n0, n1):
         datum = (n1 << 4) | n0;
@@ -538,6 +1083,26 @@ class Colossus:
 class PrintRecord(namedtuple('PrintRecord', 'body_id stepping_settings counters')):
     Encoded_N_Octets = 1 + Colossus.N_WHEELS + 2 * Colossus.N_COUNTERS
 
+    Dtype = np.dtype([('body_id', 'u1'),
+                      ('stepping_settings', 'u1', (Colossus.N_WHEELS,)),
+                      ('counters', '<u2', (Colossus.N_COUNTERS,))])
+
+    @classmethod
+    def array_from_octets(cls, encoded_records):
+        """
+        View a uint8 vector holding a whole number of encoded records as a
+        record array with fields 'body_id', 'stepping_settings' and
+        'counters'.  No data is copied.
+        """
+        if (encoded_records.ndim != 1
+            or encoded_records.dtype != np.uint8
+            or len(encoded_records) % cls.Encoded_N_Octets != 0):
+            #
+            raise ValueError('expected vector of uint8s of length a multiple of %d'
+                             % cls.Encoded_N_Octets)
+
+        return encoded_records.view(cls.Dtype).view(np.recarray)
+
     @classmethod
     def from_octets(cls, encoded_record):
         if (encoded_record.shape != (cls.Encoded_N_Octets,)
@@ -552,6 +1117,81 @@ class PrintRecord(namedtuple('PrintRecord', 'body_id stepping_settings counters'
         return cls(body_id, settings, counters)
 
 
+class MachineSnapshot:
+    """
+    All readable state of the machine at one moment, as one record with a
+    field for each entry of Colossus.Readback_Map.  Fields are available
+    as attributes, e.g., snapshot.counters.  The record's 'errors' field
+    flags, with the same layout, the values whose reads failed, e.g.,
+    snapshot.errors['counters'].
+    """
+    Value_Names = tuple(Colossus.Readback_Map)
+
+    Errors_Dtype = np.dtype([(name, '?', (len(readback.lsb_cmds),))
+                             for name, readback in Colossus.Readback_Map.items()])
+
+    Dtype = np.dtype([(name, '<u2' if readback.msb_cmds is not None else 'u1',
+                       (len(readback.lsb_cmds),))
+                      for name, readback in Colossus.Readback_Map.items()]
+                     + [('errors', Errors_Dtype)])
+
+    FieldDiff = namedtuple('FieldDiff', 'idxs old new')
+
+    def __init__(self, record):
+        self.record = record
+
+    @classmethod
+    def from_values(cls, values, errors=None):
+        """
+        Snapshot of the given dict of values, and (default none) dict of
+        error flags, each from name to array.
+        """
+        record = np.zeros((), dtype=cls.Dtype)
+        for name in cls.Value_Names:
+            record[name] = values[name]
+            if errors is not None:
+                record['errors'][name] = errors[name]
+        return cls(record)
+
+    def __getattr__(self, name):
+        if name in self.Dtype.names:
+            return self.record[name]
+        raise AttributeError(name)
+
+    def __eq__(self, other):
+        if not isinstance(other, MachineSnapshot):
+            return NotImplemented
+        return self.record.tobytes() == other.record.tobytes()
+
+    def diff(self, other):
+        """
+        Dict, from the name of each field which differs between this
+        snapshot and the later snapshot 'other', to a FieldDiff giving the
+        indexes of the elements which changed and their old and new values.
+        Changes in error flags are keyed by 'errors.' and the field's name.
+        """
+        if self == other:
+            return {}
+        diffs = {}
+        for name in self.Value_Names:
+            for key, old, new in [(name, self.record[name], other.record[name]),
+                                  ('errors.' + name,
+                                   self.record['errors'][name],
+                                   other.record['errors'][name])]:
+                idxs = np.flatnonzero(old != new)
+                if len(idxs):
+                    diffs[key] = self.FieldDiff(idxs, old[idxs], new[idxs])
+        return diffs
+
+    def __repr__(self):
+        error_names = [name for name in self.Value_Names
+                       if np.any(self.record['errors'][name])]
+        return ('MachineSnapshot(%s, errors=%s)'
+                % (', '.join('%s=%s' % (name, self.record[name].tolist())
+                             for name in self.Value_Names),
+                   error_names))
+
+
 class ColossusTesting:
     SHORT_TAPE_LENGTH = 60
 
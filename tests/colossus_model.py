@@ -0,0 +1,801 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process software model of the FPGA Colossus.
+
+ColossusModel answers the same commands as the design (see the address map
+in src/design.org), with the same response bytes and error codes as the
+VHDL.  It is not cycle-accurate; where the hardware's state after an
+operation depends on pipeline timing (e.g., how far the tape and wheels
+have overrun at the end of a run), the model reproduces the VHDL's
+behaviour as closely as can be observed via the command interface.
+
+Runs of the tape (whether one-off or as part of a whole setting run) are
+computed with vectorized NumPy over all letters, and, for a setting run,
+over all the step-count vectors one body is given.
+"""
+
+import numpy as np
+from q_panel import (summand_octets_from_registers, truth_table_from_summand_octets,
+                     counter_totals)
+from q_selector import q_stream, q_delta_p, counted_q
+from wheels import chi_letters, motor_offsets, letter_from_wheels
+
+
+N_WHEELS = 12
+N_COUNTERS = 5
+N_CAMS_ALL = [41, 31, 29, 26, 23, 43, 47, 51, 53, 59, 61, 37]
+N_BODIES = 2
+BROADCAST_BODY_ID = 63
+
+TAPE_LOOP_RAM_SIZE = 16384
+PRINTER_RAM_SIZE = 4096
+COUNTER_MODULUS = 1 << 14
+RECORD_N_OCTETS = 1 + N_WHEELS + 2 * N_COUNTERS
+
+# Wheel indices of the motor wheels:
+MU_61 = 10
+MU_37 = 11
+
+# How far the run_tape_once worker lets the tape and the wheels overrun
+# the stop letter before it stops them; see movement_controller.vhd.
+RUN_EXTRA_WHEEL_MOVES = 4
+RUN_EXTRA_TAPE_MOVES = 8
+
+# Upper bound on the number of (setting, letter) pairs computed at once, to
+# keep the memory used by a long setting run modest.
+MAX_CHUNK_ELEMENTS = 1 << 22
+
+
+class Hang(RuntimeError):
+    """
+    The command would make the real machine wait forever.
+    """
+    pass
+
+
+def _bits_from_int(x, n_bits):
+    """
+    Vector of 'n_bits' bits of 'x', least-significant first.
+    """
+    return np.array([(x >> i) & 1 for i in range(n_bits)], dtype=np.uint8)
+
+
+def _counter_vec_from_bits(bits):
+    """
+    Pack a length-5 per-counter vector into the octet form the comparator
+    and snoop bus use, in which counter 0 is the most-significant bit.
+    """
+    return sum(int(b) << (4 - i) for i, b in enumerate(bits))
+
+
+class WheelStreams:
+    """
+    Letters generated by the cam wheels over a run of sprockets, for a
+    batch of starting positions.  'patterns' gives the (current) pattern of
+    each wheel, and 'starts' is a (n_settings, N_WHEELS) array of where each
+    wheel starts, as an offset into its pattern.  The psi wheels are moved
+    under control of the motor wheels as on the real machine.
+    """
+    def __init__(self, patterns, starts, n_sprockets):
+        starts = np.asarray(starts, dtype=np.int64)
+        self.chi = chi_letters(patterns[:5], starts[:, :5], n_sprockets)
+        moves = motor_offsets(patterns[MU_61:], starts[:, MU_61:], n_sprockets)
+        self.psi = letter_from_wheels(patterns[5:10], starts[:, 5:10], moves.psi[:, :-1])
+
+        self.end_positions = starts.copy()
+        self.end_positions[:, :5] += n_sprockets
+        self.end_positions[:, 5:10] += moves.psi[:, -1:]
+        self.end_positions[:, MU_61] += n_sprockets
+        self.end_positions[:, MU_37] += moves.mu_37[:, -1]
+
+
+class CamWheel:
+    def __init__(self, n_cams):
+        self.n_cams = n_cams
+        self.pattern_register = 0
+        self.step_count = 0
+        self.stepped_pattern = np.zeros(n_cams, dtype=np.uint8)
+        self.pattern = np.zeros(n_cams, dtype=np.uint8)
+        self.position = 0
+
+    @property
+    def w(self):
+        return int(self.pattern[self.position % self.n_cams])
+
+    def load_pattern_octet(self, octet):
+        self.pattern_register = (((self.pattern_register << 8) | octet)
+                                 & ((1 << self.n_cams) - 1))
+
+    def stepped_pattern_for(self, step_count):
+        bits = _bits_from_int(self.pattern_register, self.n_cams)
+        return np.roll(bits, -step_count)
+
+    def set_step_count(self, step_count):
+        self.step_count = step_count
+        self.stepped_pattern = self.stepped_pattern_for(step_count)
+
+    def reset_movement(self):
+        self.pattern = self.stepped_pattern.copy()
+        self.position = 0
+
+    def move(self, n=1):
+        self.position = (self.position + n) % self.n_cams
+
+
+class QPanelModel:
+    """
+    Configuration of the Q panel, and the summand computation it performs.
+    """
+    N_TOP_UNITS = 10
+    N_BOTTOM_UNITS = 5
+
+    def __init__(self):
+        self.top_cfgs = np.zeros((self.N_TOP_UNITS, 3), dtype=np.uint8)
+        self.bottom_cfgs = np.zeros((self.N_BOTTOM_UNITS, 2), dtype=np.uint8)
+        self.negates_cfg = np.zeros(2, dtype=np.uint8)
+
+    def summand_octets(self):
+        """
+        A-bus octet (five-bit, counter 0 most significant) for each of the
+        32 Q letters.
+        """
+        return summand_octets_from_registers(self.top_cfgs, self.bottom_cfgs,
+                                             self.negates_cfg)
+
+    def summands(self, q):
+        """
+        Summand vector (as five-bit octet, counter 0 most significant) for
+        each Q letter in the given array.
+        """
+        return self.summand_octets()[np.asarray(q, dtype=np.uint8)]
+
+    def summand_table(self):
+        """
+        (32, N_COUNTERS) array giving, for each Q letter, whether it adds
+        one to each counter.
+        """
+        return truth_table_from_summand_octets(self.summand_octets()).astype(np.int64)
+
+
+class ComparatorModel:
+    def __init__(self):
+        self.step_count_labels = np.zeros(N_WHEELS, dtype=np.uint8)
+        self.counter_values = np.zeros(N_COUNTERS, dtype=np.int64)
+        self.raw_set_total_cfg = np.zeros(2 * N_COUNTERS, dtype=np.uint8)
+
+    @property
+    def thresholds(self):
+        raw = self.raw_set_total_cfg.astype(np.int64)
+        return (raw[0::2] | (raw[1::2] << 8)) & 0x3fff
+
+    @property
+    def operations(self):
+        return (self.raw_set_total_cfg[1::2] >> 6).astype(np.int64)
+
+    def print_required_vecs(self, counter_values):
+        """
+        Boolean array, same shape as 'counter_values' (whose final axis
+        indexes the counters), of which counters call for printing.
+        """
+        gt = counter_values > self.thresholds
+        lt = counter_values < self.thresholds
+        ops = self.operations
+        return np.where(ops == 0, gt, np.where(ops == 1, lt, True))
+
+    def comparison_octets(self):
+        values = self.counter_values
+        return (_counter_vec_from_bits(values > self.thresholds),
+                _counter_vec_from_bits(values < self.thresholds),
+                _counter_vec_from_bits(self.print_required_vecs(values)))
+
+
+class BodyModel:
+    """
+    One body of the machine: bedstead, Q selector, Q panel, counters,
+    comparator, and cam wheels.
+    """
+    def __init__(self, body_id):
+        self.body_id = body_id
+        self.tape = np.zeros(TAPE_LOOP_RAM_SIZE, dtype=np.uint8)
+        self.tape_read_addr = 0
+        self.tape_write_addr = 0
+        self.tape_cmd_read_addr = 0
+        self.q_selector_cfg = 0
+        self.q = 0
+        self.one_back = (0, 0, 0)
+        self.q_panel = QPanelModel()
+        self.live_counts = np.zeros(N_COUNTERS, dtype=np.int64)
+        self.latched_counts = np.zeros(N_COUNTERS, dtype=np.int64)
+        self.comparator = ComparatorModel()
+        self.wheels = [CamWheel(n) for n in N_CAMS_ALL]
+
+    ########################################################################
+    # Buses
+
+    @property
+    def aug_z(self):
+        return int(self.tape[self.tape_read_addr])
+
+    @property
+    def z(self):
+        return self.aug_z & 0x1f
+
+    def _wheels_letter(self, wheel_idx0):
+        return sum(self.wheels[wheel_idx0 + i].w << (4 - i) for i in range(5))
+
+    @property
+    def chi(self):
+        return self._wheels_letter(0)
+
+    @property
+    def psi(self):
+        return self._wheels_letter(5)
+
+    @property
+    def summands(self):
+        return int(self.q_panel.summands(self.q))
+
+    ########################################################################
+    # Q selector
+
+    @property
+    def q_delta_p(self):
+        return q_delta_p(self.q_selector_cfg)
+
+    def reset_q_selector(self):
+        self.q = 0
+        self.one_back = (0, 0, 0)
+
+    def enable_q_selector(self):
+        streams = (self.z, self.chi, self.psi)
+        self.q = int(q_stream(self.q_selector_cfg, *([s] for s in streams),
+                              one_back=self.one_back)[0])
+        self.one_back = streams
+
+    def q_streams(self, z, chi, psi):
+        """
+        Q letters for the given (n_settings, n_sprockets) z, chi and psi
+        streams, as computed following a reset of the Q selector.
+        """
+        return q_stream(self.q_selector_cfg, z, chi, psi)
+
+    ########################################################################
+    # Cam wheels
+
+    def move_wheels(self):
+        psi_move_p = self.wheels[MU_37].w
+        mu_37_move_p = self.wheels[MU_61].w
+        for i in range(5):
+            self.wheels[i].move()
+        if psi_move_p:
+            for i in range(5, 10):
+                self.wheels[i].move()
+        self.wheels[MU_61].move()
+        if mu_37_move_p:
+            self.wheels[MU_37].move()
+
+    def reset_wheels_movement(self):
+        for wheel in self.wheels:
+            wheel.reset_movement()
+
+    def set_step_counts(self, step_counts):
+        for wheel, step_count in zip(self.wheels, step_counts):
+            wheel.set_step_count(int(step_count))
+
+    @property
+    def step_counts(self):
+        return np.array([wheel.step_count for wheel in self.wheels], dtype=np.uint8)
+
+    ########################################################################
+    # Tape runs
+
+    def run_length(self):
+        stop_idxs = np.flatnonzero(self.tape & 0x20)
+        if len(stop_idxs) == 0:
+            raise Hang('tape has no stop marker')
+        return int(stop_idxs[0])
+
+    def _tape_z_stream(self, n_sprockets):
+        return self.tape[np.arange(n_sprockets) % TAPE_LOOP_RAM_SIZE] & 0x1f
+
+    def counts_for_streams(self, q, run_length):
+        """
+        Counter values for each row of the (n_settings, n_sprockets) array
+        of Q letters, counting the first 'run_length' letters (or all but
+        the first of them, if the Q selector involves a delta).
+        """
+        counted = counted_q(self.q_selector_cfg, q, run_length)
+        return counter_totals(self.q_panel.summand_table(), counted) % COUNTER_MODULUS
+
+    def run_tape_once(self):
+        run_length = self.run_length()
+        n_sprockets = run_length + RUN_EXTRA_WHEEL_MOVES
+        patterns = [wheel.pattern for wheel in self.wheels]
+        starts = np.array([[wheel.position for wheel in self.wheels]])
+        streams = WheelStreams(patterns, starts, n_sprockets)
+        z = self._tape_z_stream(n_sprockets)[None, :]
+        q = self.q_streams(z, streams.chi, streams.psi)
+
+        self.live_counts = self.counts_for_streams(q, run_length)[0]
+
+        for wheel, position in zip(self.wheels, streams.end_positions[0]):
+            wheel.position = int(position) % wheel.n_cams
+        self.q = int(q[0, -1])
+        self.one_back = (int(z[0, -1]), int(streams.chi[0, -1]), int(streams.psi[0, -1]))
+        self.tape_read_addr = (run_length + RUN_EXTRA_TAPE_MOVES) % TAPE_LOOP_RAM_SIZE
+
+    def run_settings(self, step_count_vecs):
+        """
+        Counter values, as (n_vecs, N_COUNTERS) array, for a run of the tape
+        from each of the given step-count vectors.
+        """
+        run_length = self.run_length()
+        n_vecs = len(step_count_vecs)
+        counts = np.zeros((n_vecs, N_COUNTERS), dtype=np.int64)
+        if n_vecs == 0:
+            return counts
+        patterns = [wheel.stepped_pattern_for(0) for wheel in self.wheels]
+        z = self._tape_z_stream(run_length)[None, :]
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // max(1, run_length))
+        for idx0 in range(0, n_vecs, chunk_size):
+            starts = step_count_vecs[idx0 : idx0 + chunk_size]
+            streams = WheelStreams(patterns, starts, run_length)
+            q = self.q_streams(z, streams.chi, streams.psi)
+            counts[idx0 : idx0 + chunk_size] = self.counts_for_streams(q, run_length)
+        return counts
+
+    ########################################################################
+    # Workers
+
+    def copy_settings(self):
+        self.comparator.step_count_labels = self.step_counts
+
+    def copy_counter_values(self):
+        self.comparator.counter_values = self.latched_counts.copy()
+
+    def latch_counters(self):
+        self.latched_counts = self.live_counts.copy()
+
+    def record_if_required(self):
+        comparator = self.comparator
+        if not np.any(comparator.print_required_vecs(comparator.counter_values)):
+            return []
+        return self.record_octets(comparator.step_count_labels,
+                                  comparator.counter_values[None, :])[0]
+
+    def record_octets(self, labels, counter_values):
+        """
+        Print records, as (n_records, RECORD_N_OCTETS) uint8 array, for the
+        given rows of step-count labels and counter values.
+        """
+        n_records = counter_values.shape[0]
+        records = np.zeros((n_records, RECORD_N_OCTETS), dtype=np.uint8)
+        records[:, 0] = self.body_id
+        records[:, 1 : 1 + N_WHEELS] = labels
+        records[:, 1 + N_WHEELS :: 2] = counter_values & 0xff
+        records[:, 2 + N_WHEELS :: 2] = (counter_values >> 8) & 0x3f
+        return records
+
+    def process_settings(self, step_count_vecs):
+        """
+        Perform the body's part of a setting run for each of the given
+        step-count vectors in turn.  Return the print record for each
+        vector, and whether it is actually printed.
+        """
+        step_count_vecs = np.asarray(step_count_vecs, dtype=np.int64)
+        if len(step_count_vecs) == 0:
+            return (np.zeros((0, RECORD_N_OCTETS), dtype=np.uint8),
+                    np.zeros(0, dtype=bool))
+
+        counts = self.run_settings(step_count_vecs)
+        print_p = np.any(self.comparator.print_required_vecs(counts), axis=1)
+        records = self.record_octets(step_count_vecs, counts)
+
+        # Leave the body in the state it would have after processing the
+        # final vector.
+        self.set_step_counts(step_count_vecs[-1])
+        self.copy_settings()
+        self.reset_wheels_movement()
+        self.run_tape_once()
+        self.latch_counters()
+        self.copy_counter_values()
+
+        return records, print_p
+
+    ########################################################################
+    # Command targets
+
+    def submit(self, addr, data):
+        """
+        Return (error_p, response_byte) for the given command, or None if
+        nothing in the body is mapped at 'addr'.
+        """
+        if addr == 8:
+            return False, ((data & 0x0f) + (data >> 4)) & 0x0f
+        if addr == 16:
+            return self._counters_cmd(data)
+        if addr == 22:
+            return self._q_selector_cmd(data)
+        if addr == 23:
+            self.q_selector_cfg = data & 0x3f
+            return False, 0x12
+        if addr == 24:
+            return self._movement_cmd(data)
+        if addr == 25:
+            return self._snoop_cmd(data)
+        if 26 <= addr <= 29:
+            return self._bedstead_cmd(addr, data)
+        if 80 <= addr < 110:
+            self.q_panel.top_cfgs[(addr - 80) // 3, (addr - 80) % 3] = data
+            return False, 0x12
+        if 110 <= addr < 120:
+            self.q_panel.bottom_cfgs[(addr - 110) // 2, (addr - 110) % 2] = data
+            return False, 0x12
+        if addr in (120, 121):
+            self.q_panel.negates_cfg[addr - 120] = data
+            return False, 0x12
+        if addr == 128:
+            return self._comparator_cmd(data)
+        if 130 <= addr < 130 + 2 * N_COUNTERS:
+            self.comparator.raw_set_total_cfg[addr - 130] = data
+            return False, 0x12
+        if addr == 144:
+            return self._scheduler_cmd(data)
+        if 170 <= addr < 170 + 2 * N_WHEELS:
+            return self._cam_wheel_cmd((addr - 170) // 2, addr % 2, data)
+        if addr == 196:
+            return self._cam_wheels_panel_cmd(data)
+        return None
+
+    def _counters_cmd(self, data):
+        if data == 0x80:
+            self.live_counts[:] = 0
+            return False, 0xa0
+        if data == 0x81:
+            summands = self.summands
+            for i in range(N_COUNTERS):
+                if (summands >> (4 - i)) & 1:
+                    self.live_counts[i] = (self.live_counts[i] + 1) % COUNTER_MODULUS
+            return False, 0xa1
+        if data == 0x82:
+            self.latch_counters()
+            return False, 0xa2
+        # The VHDL does not define the result of reading a non-existent
+        # counter; treat as a bad sub-command.
+        counter_idx = data & 0x0f
+        if data >> 4 in (0, 1) and counter_idx < N_COUNTERS:
+            value = int(self.latched_counts[counter_idx])
+            return False, (value & 0xff) if data >> 4 == 0 else (value >> 8)
+        return True, 0x52
+
+    def _q_selector_cmd(self, data):
+        if data == 0x00:
+            self.reset_q_selector()
+            return False, 0xb4
+        if data == 0x01:
+            self.enable_q_selector()
+            return False, 0xb5
+        return True, 0x59
+
+    def _movement_cmd(self, data):
+        if data == 0x00:
+            self.reset_wheels_movement()
+            self.tape_read_addr = 0
+            self.reset_q_selector()
+            self.enable_q_selector()
+            return False, 0x61
+        if data == 0x01:
+            self.tape_read_addr = (self.tape_read_addr + 1) % TAPE_LOOP_RAM_SIZE
+            self.move_wheels()
+            self.enable_q_selector()
+            return False, 0x63
+        return True, 0x98
+
+    def _snoop_cmd(self, data):
+        if data == 0x00:
+            aug_z = self.aug_z
+            return False, ((aug_z & 0x20) << 2) | (aug_z & 0x1f)
+        if data == 0x01:
+            return False, self.q
+        if data == 0x02:
+            return False, self.chi
+        if data == 0x05:
+            return False, self.summands
+        return True, 0x34
+
+    def _bedstead_cmd(self, addr, data):
+        if addr == 26:
+            self.tape[:] = 0xa5
+            return False, 0x33
+        if addr == 27:
+            if data == 0x00:
+                self.tape_cmd_read_addr = 0
+                return False, 0x45
+            if data == 0x01:
+                value = int(self.tape[self.tape_cmd_read_addr])
+                self.tape_cmd_read_addr = (self.tape_cmd_read_addr + 1) % TAPE_LOOP_RAM_SIZE
+                return False, value
+            return True, 0x98
+        if addr == 28:
+            if data == 0x00:
+                self.tape_write_addr = 0
+                return False, 0x44
+            return True, 0x34
+        self.tape[self.tape_write_addr] = data
+        self.tape_write_addr = (self.tape_write_addr + 1) % TAPE_LOOP_RAM_SIZE
+        return False, 0x55
+
+    def _comparator_cmd(self, data):
+        hi, lo = data >> 4, data & 0x0f
+        comparator = self.comparator
+        if hi == 0 and lo < N_WHEELS:
+            return False, int(comparator.step_count_labels[lo])
+        if hi in (2, 3) and lo < N_COUNTERS:
+            value = int(comparator.counter_values[lo])
+            return False, (value & 0xff) if hi == 2 else ((value >> 8) & 0x3f)
+        if hi == 4 and lo < 4:
+            gt, lt, print_required_vec = comparator.comparison_octets()
+            return False, [gt, lt, print_required_vec, int(print_required_vec != 0)][lo]
+        return True, 0xab
+
+    def _scheduler_cmd(self, data):
+        workers = [self.copy_settings,
+                   self.copy_counter_values,
+                   self.run_tape_once,
+                   self.latch_counters,
+                   self.reset_wheels_movement]
+        if data >= len(workers):
+            return True, 0xad
+        workers[data]()
+        return False, 0x12
+
+    def _cam_wheel_cmd(self, wheel_idx, ctrl_p, data):
+        wheel = self.wheels[wheel_idx]
+        if not ctrl_p:
+            wheel.load_pattern_octet(data)
+            return False, 0x58
+        op = data >> 6
+        if op == 0:
+            wheel.set_step_count(data & 0x3f)
+            return False, 0x30
+        if op == 1:
+            if data & 0x01:
+                wheel.move()
+                return False, 0x33
+            wheel.reset_movement()
+            return False, 0x32
+        if op == 2:
+            return False, wheel.step_count
+        return False, wheel.w
+
+    def _cam_wheels_panel_cmd(self, data):
+        if data == 0x00:
+            self.reset_wheels_movement()
+            return False, 0x70
+        if data == 0x01:
+            self.move_wheels()
+            return False, 0x71
+        if data == 0x10:
+            return False, self.chi
+        if data == 0x11:
+            return False, self.psi
+        if data == 0x12:
+            return False, (self.wheels[MU_37].w << 1) | self.wheels[MU_61].w
+        return True, 0x7f
+
+
+class StepCountVectorModel:
+    """
+    The head's step-count vector and its configuration.
+    """
+    def __init__(self):
+        self.counts = np.zeros(N_WHEELS, dtype=np.int64)
+        self.cfg = np.zeros(N_WHEELS, dtype=np.uint8)
+
+    def _cfg_bits(self, shift):
+        return ((self.cfg >> shift) & 1).astype(bool)
+
+    @property
+    def ended(self):
+        return bool(np.all((self.counts == 0) | self._cfg_bits(0)))
+
+    def reset(self):
+        self.counts[:] = 0
+
+    def step(self):
+        n_cams = np.array(N_CAMS_ALL)
+        fast = self._cfg_bits(3)
+        self.counts[fast] = (self.counts[fast] + 1) % n_cams[fast]
+        if np.any(fast & self._cfg_bits(1) & (self.counts == 0)):
+            slow = self._cfg_bits(2)
+            self.counts[slow] = (self.counts[slow] + 1) % n_cams[slow]
+
+    def run_vectors(self):
+        """
+        All vectors a setting run goes through, as (n_vecs, N_WHEELS) array.
+        Leaves the vector in its final (ended) state.
+        """
+        self.reset()
+        vecs = [self.counts.copy()]
+        self.step()
+        while not self.ended:
+            vecs.append(self.counts.copy())
+            self.step()
+        return np.array(vecs)
+
+    def cmd_stream(self, body_id=BROADCAST_BODY_ID):
+        """
+        Successive values on the set-step command bus (as seen by the snoop
+        of command 0x3X) when the vector is emitted.
+        """
+        history = np.zeros(16, dtype=np.uint8)
+        history[1] = 0x2d
+        history[2] = body_id
+        history[3 : 3 + N_WHEELS] = self.counts
+        return history
+
+
+class PrinterModel:
+    def __init__(self):
+        self.ram = np.zeros(PRINTER_RAM_SIZE, dtype=np.uint8)
+        self.write_addr = 0
+        self.n_written = 0
+        self.read_addr = 0
+
+    def erase(self):
+        self.write_addr = PRINTER_RAM_SIZE - 1
+        self.n_written = 0
+
+    def write(self, octets):
+        for octet in octets:
+            if self.n_written == PRINTER_RAM_SIZE - 1:
+                break
+            self.write_addr = (self.write_addr + 1) % PRINTER_RAM_SIZE
+            self.ram[self.write_addr] = octet
+            self.n_written += 1
+
+    def read(self):
+        octet = int(self.ram[self.read_addr])
+        self.read_addr = (self.read_addr + 1) % PRINTER_RAM_SIZE
+        return octet
+
+
+class ColossusModel:
+    """
+    Whole machine: head (step-count vector, head scheduler), the bodies, and
+    tail (tail scheduler, printer), behind the RPi interface's address
+    latch.
+    """
+    def __init__(self):
+        self.addr = 0
+        self.bodies = [BodyModel(body_id) for body_id in range(N_BODIES)]
+        self.step_count_vector = StepCountVectorModel()
+        self.printer = PrinterModel()
+
+    def submit(self, addr_or_data, data=None):
+        """
+        Perform the given command, returning (error_p, response_byte).
+        As for the real interface, a data-only command goes to the most
+        recently given address.
+        """
+        if data is None:
+            data = addr_or_data
+        else:
+            self.addr = addr_or_data
+        if self.addr >= 0xe0:
+            return self._head_tail_cmd(self.addr, data)
+        return self._body_cmd(self.addr, data)
+
+    def _body_cmd(self, addr, data):
+        # Mirror the chain of Replicate_Validators.
+        responses = [body.submit(addr, data) for body in self.bodies]
+        if all(r is None for r in responses):
+            return True, 0x06
+        if any(r != responses[0] for r in responses):
+            return True, 0x07
+        return responses[0]
+
+    def _bodies_with_id(self, body_id):
+        bodies = [body for body in self.bodies
+                  if body_id in (body.body_id, BROADCAST_BODY_ID)]
+        if not bodies:
+            raise Hang('no body with id %d' % body_id)
+        return bodies
+
+    def _head_tail_cmd(self, addr, data):
+        if 224 <= addr < 224 + N_WHEELS:
+            self.step_count_vector.cfg[addr - 224] = data
+            return False, 0x12
+        if addr == 236:
+            return self._step_count_vector_cmd(data)
+        if addr == 240:
+            return self._head_scheduler_cmd(data)
+        if addr == 241:
+            if data >> 6 != 0:
+                return True, 0xad
+            body_id = data & 0x3f
+            if body_id >= N_BODIES:
+                raise Hang('no body with id %d' % body_id)
+            self.printer.write(self.bodies[body_id].record_if_required())
+            return False, 0x19
+        if addr == 242:
+            return self._printer_cmd(data)
+        if addr == 243:
+            self.printer.erase()
+            return False, 0x11
+        if addr == 244:
+            self.printer.write([data])
+            return False, 0x12
+        return True, 0x09
+
+    def _step_count_vector_cmd(self, data):
+        hi, lo = data >> 4, data & 0x0f
+        scv = self.step_count_vector
+        if hi == 0:
+            return False, int(scv.counts[lo]) if lo < N_WHEELS else 0
+        if data == 0x10:
+            return False, int(scv.ended)
+        if data == 0x20:
+            scv.reset()
+            return False, 0x18
+        if data == 0x21:
+            scv.step()
+            return False, 0x19
+        if hi == 3:
+            for body in self.bodies:
+                body.set_step_counts(scv.counts)
+            return False, int(scv.cmd_stream()[lo])
+        return True, 0x2f
+
+    def _head_scheduler_cmd(self, data):
+        op = data >> 6
+        if op == 0:
+            for body in self._bodies_with_id(data & 0x3f):
+                body.set_step_counts(self.step_count_vector.counts)
+            return False, 0x12
+        if op == 3:
+            self.initiate_run()
+            return False, 0x15
+        return True, 0xad
+
+    def initiate_run(self):
+        vecs = self.step_count_vector.run_vectors()
+        # Vectors are handed out alternately, starting with body 1, and the
+        # tail collects the resulting records in the same order.
+        body_idxs = (np.arange(len(vecs)) + 1) % N_BODIES
+        records = np.zeros((len(vecs), RECORD_N_OCTETS), dtype=np.uint8)
+        print_p = np.zeros(len(vecs), dtype=bool)
+        for body in self.bodies:
+            body_vec_p = (body_idxs == body.body_id)
+            records[body_vec_p], print_p[body_vec_p] = \
+                body.process_settings(vecs[body_vec_p])
+        self.printer.write(records[print_p].ravel())
+
+    def _printer_cmd(self, data):
+        printer = self.printer
+        if data == 0x00:
+            return False, printer.n_written & 0xff
+        if data == 0x01:
+            return False, printer.n_written >> 8
+        if data == 0x02:
+            printer.read_addr = 0
+            return False, 0x32
+        if data == 0x03:
+            return False, printer.read()
+        return True, 0x76
@@ -24,8 +24,36 @@ from colossus import Colossus
 def pytest_addoption(parser):
     parser.addoption("--runslow", action="store_true",
         help="run slow tests")
+    parser.addoption("--backend", choices=Colossus.Backends,
+        help="backend to drive (default from COLOSSUS_BACKEND, else monitor-repl)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: needs --runslow option to run")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runslow"):
+        return
+    skip_slow = pytest.mark.skip(reason="need --runslow option to run")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
 
 
 @pytest.fixture(scope='session')
-def colossus():
-    return Colossus()
+def colossus(request):
+    return Colossus(backend=request.config.getoption("--backend"))
+
+
+@pytest.fixture
+def sent_cmds(colossus, monkeypatch):
+    sent = []
+    orig_submit_cmds = colossus._submit_cmds
+
+    def recording_submit_cmds(cmds, max_n_in_flight):
+        sent.extend(cmds)
+        return orig_submit_cmds(cmds, max_n_in_flight)
+
+    monkeypatch.setattr(colossus, '_submit_cmds', recording_submit_cmds)
+    return sent
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+# Stand-in for rpi-client, backed by the software model instead of the
+# FPGA.  Takes the same arguments:
+#
+#     --binary       use the binary wire format
+#     --input PATH   read commands from PATH rather than /tmp/repl-input
+
+import argparse
+import sys
+from colossus_model import ColossusModel
+from transports import serve_repl
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--binary', action='store_true')
+    parser.add_argument('--input', default='/tmp/repl-input')
+    args = parser.parse_args(args)
+
+    model = ColossusModel()
+    wire_format = 'binary' if args.binary else 'text'
+    f_out = sys.stdout.buffer
+    # Announce readiness before opening the input, as rpi-client does, since
+    # the far end of the FIFO will block on its open until we open ours.
+    f_out.write(b'READY-FOR-INPUT\n')
+    f_out.flush()
+    with open(args.input, 'rb') as f_in:
+        serve_repl(model.submit, f_in, f_out, wire_format, announce_ready_p=False)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
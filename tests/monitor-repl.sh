@@ -2,8 +2,14 @@
 
 if [ $USER = "pi" ]; then
     cd ../rpi-client/
-    exec sudo ./rpi-client
+    exec sudo ./rpi-client "$@"
 else
+    # The simulator's testbench reads commands from /tmp/repl-input in
+    # text format only.
+    if [ $# -gt 0 ]; then
+        echo "$0: options '$*' not supported by simulator" >&2
+        exit 1
+    fi
     cd ../src
     ulimit -v 6291456  # 6GB
     exec ./monitor-repl -tclbatch run_all_exit.tcl
@@ -0,0 +1,137 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+# The Q panel as a pure function of the Q letter.
+#
+# Since Q is a five-bit letter, a complete Q panel configuration can be
+# compiled into a (32, 5) boolean truth table saying, for each Q letter,
+# which of the five counters it adds one to.  The A bus (the summands, as a
+# five-bit octet with counter 0 as the most significant bit) and counter
+# totals then follow from a Q stream by array indexing or by one histogram
+# of Q and a dot product.
+
+import numpy as np
+
+N_TOP_UNITS = 10
+N_BOTTOM_UNITS = 5
+N_COUNTERS = 5
+
+Q_LETTERS = np.arange(32, dtype=np.uint8)
+PARITY = np.array([bin(q).count('1') & 1 for q in range(32)], dtype=np.uint8)
+
+
+def summand_octets_from_registers(top_regs, bottom_regs, negating_regs):
+    """
+    A-bus octet for each of the 32 Q letters, given the raw contents of
+    the Q panel configuration registers: (N_TOP_UNITS, 3) octets for the
+    top units, (N_BOTTOM_UNITS, 2) for the bottom units, and two for the
+    negating register (command addresses 80-121 in order).
+    """
+    top_regs = np.asarray(top_regs, dtype=np.uint8).reshape(-1, 3)
+    bottom_regs = np.asarray(bottom_regs, dtype=np.uint8).reshape(-1, 2)
+    q = Q_LETTERS[:, None]
+
+    match_en, match_tgt, top_cfg_2 = top_regs.T
+    top_counter_en = top_cfg_2 & 0x1f
+    negate = (top_cfg_2 >> 7) & 1
+    match = ((q ^ match_tgt) & match_en & 0x1f) == 0
+    top_factors = np.where(match ^ negate, 0x1f, 0x1f & ~top_counter_en)
+    top_product = np.bitwise_and.reduce(top_factors, axis=1, initial=0x1f)
+
+    coeff, bottom_cfg_1 = bottom_regs.T
+    bottom_counter_en = bottom_cfg_1 & 0x1f
+    tgt = (bottom_cfg_1 >> 7) & 1
+    parity = PARITY[q & coeff & 0x1f]
+    bottom_factors = np.where(parity == tgt, 0x1f, 0x1f & ~bottom_counter_en)
+    bottom_product = np.bitwise_and.reduce(bottom_factors, axis=1, initial=0x1f)
+
+    top_negates, global_negates = np.asarray(negating_regs, dtype=np.uint8) & 0x1f
+    return (((top_product ^ top_negates) & bottom_product) ^ global_negates).astype(np.uint8)
+
+
+def truth_table_from_summand_octets(summand_octets):
+    """
+    (32, N_COUNTERS) boolean truth table from the A-bus octet of each Q
+    letter.
+    """
+    shifts = (N_COUNTERS - 1) - np.arange(N_COUNTERS)
+    return ((np.asarray(summand_octets)[:, None] >> shifts) & 1).astype(bool)
+
+
+def summand_octets_from_truth_table(table):
+    weights = 1 << ((N_COUNTERS - 1) - np.arange(N_COUNTERS))
+    return (np.asarray(table, dtype=np.uint8) @ weights).astype(np.uint8)
+
+
+def registers_from_cfgs(top_cfgs=(), bottom_cfgs=(), negating_cfg=None):
+    """
+    Raw register contents (top_regs, bottom_regs, negating_regs), as taken
+    by summand_octets_from_registers(), for the Q panel configured with the
+    given QPanelTopUnitCfgs (for units 0 upwards), QPanelBottomUnitCfgs
+    and QPanelNegatingCfg.  Units not given are taken to be reset, as by
+    Colossus.reset_q_panel_cfg().
+    """
+    if len(top_cfgs) > N_TOP_UNITS or len(bottom_cfgs) > N_BOTTOM_UNITS:
+        raise ValueError('too many Q panel units')
+    top_regs = np.zeros((N_TOP_UNITS, 3), dtype=np.uint8)
+    for i, cfg in enumerate(top_cfgs):
+        top_regs[i] = (cfg.cfg_0, cfg.cfg_1, cfg.cfg_2)
+    bottom_regs = np.zeros((N_BOTTOM_UNITS, 2), dtype=np.uint8)
+    for i, cfg in enumerate(bottom_cfgs):
+        bottom_regs[i] = (cfg.cfg_0, cfg.cfg_1)
+    negating_regs = np.array((negating_cfg.cfg_0, negating_cfg.cfg_1)
+                             if negating_cfg is not None else (0, 0),
+                             dtype=np.uint8)
+    return top_regs, bottom_regs, negating_regs
+
+
+def compile_q_panel(top_cfgs=(), bottom_cfgs=(), negating_cfg=None):
+    """
+    (32, N_COUNTERS) boolean truth table for the Q panel configured with
+    the given unit configurations, as for registers_from_cfgs().
+    """
+    return truth_table_from_summand_octets(
+        summand_octets_from_registers(*registers_from_cfgs(top_cfgs, bottom_cfgs,
+                                                           negating_cfg)))
+
+
+def a_bus(table, q):
+    """
+    A-bus octet for each letter of the Q stream (of any shape).
+    """
+    return summand_octets_from_truth_table(table)[q]
+
+
+def q_histograms(q):
+    """
+    Number of occurrences of each Q letter along the last axis of 'q', as an
+    array of shape q.shape[:-1] + (32,).
+    """
+    q = np.asarray(q)
+    n_rows = int(np.prod(q.shape[:-1], dtype=np.int64))
+    offsets = 32 * np.arange(n_rows).reshape(q.shape[:-1] + (1,))
+    counts = np.bincount((q + offsets).ravel(), minlength=32 * n_rows)
+    return counts.reshape(q.shape[:-1] + (32,))
+
+
+def counter_totals(table, q):
+    """
+    Counter totals for the Q stream(s) along the last axis of 'q', as an
+    array of shape q.shape[:-1] + (N_COUNTERS,).  Totals are not reduced
+    modulo the counters' capacity.
+    """
+    return q_histograms(q) @ np.asarray(table, dtype=np.int64)
@@ -0,0 +1,96 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+# The Q selector as a vectorized function of the Z, chi and psi streams.
+#
+# The six configuration bits are, most significant first, (Z, delta-Z,
+# chi, delta-chi, psi, delta-psi).  A stream contributes to Q if its
+# 'include' bit is set, and then it contributes the XOR of the current and
+# previous letter if its 'delta' bit is also set.  A 'delta' bit without
+# its 'include' bit has no effect.
+#
+# After a reset of the Q selector, the 'one back' letters are all zero, so
+# the first Q letter of a delta'd stream is the bare first letter of that
+# stream.  The counters therefore ignore that first letter: their count
+# enable is delayed by one cycle whenever any stream is delta'd.
+
+import numpy as np
+
+STREAM_NAMES = ('z', 'chi', 'psi')
+
+
+def stream_cfg(cfg, stream_idx):
+    """
+    (include_p, delta_p) for the stream with the given index into
+    STREAM_NAMES.
+    """
+    shift = 4 - 2 * stream_idx
+    return bool((cfg >> (shift + 1)) & 1), bool((cfg >> shift) & 1)
+
+
+def q_delta_p(cfg):
+    """
+    Whether the Q selector configuration takes the delta of any stream.
+    """
+    return any(include_p and delta_p
+               for include_p, delta_p in (stream_cfg(cfg, i) for i in range(3)))
+
+
+def first_counted_idx(cfg):
+    """
+    Index of the first Q letter, after a reset of the Q selector, which the
+    counters count.
+    """
+    return 1 if q_delta_p(cfg) else 0
+
+
+def q_stream(cfg, z, chi_letters, psi_letters, one_back=(0, 0, 0)):
+    """
+    Q letters produced by the Q selector with configuration 'cfg' from the
+    given Z, chi and psi letters, which must broadcast together to an
+    array of at least one dimension, with the sprocket axis last.  For
+    example, a (n_sprockets,) Z stream can be combined with (n_settings,
+    n_sprockets) chi and psi streams for a batch of candidate settings.
+    'one_back' gives the (z, chi, psi) letters the Q selector holds from
+    before the first sprocket; these are zero after a reset.
+    """
+    streams = np.broadcast_arrays(*(np.asarray(s, dtype=np.uint8)
+                                    for s in (z, chi_letters, psi_letters)))
+    q = np.zeros(streams[0].shape, dtype=np.uint8)
+    for i, stream in enumerate(streams):
+        include_p, delta_p = stream_cfg(cfg, i)
+        if not include_p:
+            continue
+        if delta_p:
+            stream_1b = np.empty(stream.shape, dtype=np.uint8)
+            stream_1b[..., 0] = one_back[i]
+            stream_1b[..., 1:] = stream[..., :-1]
+            q ^= stream ^ stream_1b
+        else:
+            q ^= stream
+    return q
+
+
+def counted_q(cfg, q, run_length=None):
+    """
+    Those letters of the Q stream(s) 'q', produced following a reset of
+    the Q selector, which the counters count during a run of 'run_length'
+    sprockets (default: all of them).
+    """
+    if run_length is None:
+        run_length = np.shape(q)[-1]
+    return np.asarray(q)[..., first_counted_idx(cfg):run_length]
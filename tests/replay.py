@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+# Replay a recorded command stream against a board (or model) at full
+# pipeline speed, checking every response against a recorded or reference
+# one, and reporting throughput and per-address latency.
+#
+# A command stream is either a text file of commands, one per line, in
+# the monitor's text wire format (e.g., repl-input-short-run-with-chi.txt),
+# which carries no responses, or a trace file written by tracing.py, which
+# does.  Without recorded responses, the stream can be replayed against a
+# reference backend first to obtain some.
+
+import argparse
+import sys
+from collections import namedtuple
+import numpy as np
+from colossus import Colossus
+from tracing import RingBufferTracer, read_trace, Has_Addr, Error
+
+
+def load_cmd_stream(path):
+    """
+    Return (cmds, expected) from the given text or trace file, where
+    'expected' is an (error_p, response_bytes) pair, or None if the file
+    holds no responses.
+    """
+    if path.endswith('.txt'):
+        with open(path, 'rt') as f_in:
+            lines = [line.strip() for line in f_in]
+        cmds = [tuple(int(line[i:i+2], 16) for i in range(0, len(line), 2))
+                for line in lines if line]
+        return cmds, None
+    records = read_trace(path)
+    cmds = [(int(r['addr']), int(r['data'])) if r['flags'] & Has_Addr
+            else (int(r['data']),)
+            for r in records]
+    return cmds, ((records['flags'] & Error) != 0, records['response'].copy())
+
+
+def effective_addrs(cmds):
+    """
+    Address each command goes to, with data-only commands taking the most
+    recent address; -1 if not known.
+    """
+    addrs = np.zeros(len(cmds), dtype=np.int64)
+    addr = -1
+    for i, cmd in enumerate(cmds):
+        if len(cmd) == 2:
+            addr = cmd[0]
+        addrs[i] = addr
+    return addrs
+
+
+AddrLatency = namedtuple('AddrLatency', 'addr n_cmds p50_us p90_us p99_us max_us')
+
+
+class ReplayResult(namedtuple('ReplayResult',
+                              ['cmds', 'error_p', 'response_bytes',
+                               'latency_ns', 'elapsed_s', 'mismatch_idxs'])):
+    @property
+    def n_cmds(self):
+        return len(self.cmds)
+
+    @property
+    def cmds_per_second(self):
+        return self.n_cmds / self.elapsed_s if self.elapsed_s > 0 else float('inf')
+
+    def latency_by_addr(self):
+        """
+        List of AddrLatency, one per address, in address order.
+        """
+        addrs = effective_addrs(self.cmds)
+        latency_us = self.latency_ns * 1e-3
+        result = []
+        for addr in np.unique(addrs):
+            addr_latency_us = latency_us[addrs == addr]
+            p50, p90, p99 = np.percentile(addr_latency_us, [50, 90, 99])
+            result.append(AddrLatency(int(addr), len(addr_latency_us),
+                                      p50, p90, p99, addr_latency_us.max()))
+        return result
+
+    def report(self, f_out=sys.stdout):
+        f_out.write('%d commands in %.3fs: %.0f commands/s\n'
+                    % (self.n_cmds, self.elapsed_s, self.cmds_per_second))
+        f_out.write('%d mismatched responses\n' % len(self.mismatch_idxs))
+        for idx in self.mismatch_idxs[:10]:
+            f_out.write('    command %d (%s): got %s %02x\n'
+                        % (idx, Colossus._cmd_str(self.cmds[idx]),
+                           "'1'" if self.error_p[idx] else "'0'",
+                           self.response_bytes[idx]))
+        f_out.write('addr  n_cmds   p50/us   p90/us   p99/us   max/us\n')
+        for lat in self.latency_by_addr():
+            f_out.write('%4s %7d %8.1f %8.1f %8.1f %8.1f\n'
+                        % (('%02x' % lat.addr) if lat.addr >= 0 else '?',
+                           lat.n_cmds, lat.p50_us, lat.p90_us, lat.p99_us, lat.max_us))
+
+
+def replay(transport, cmds, expected=None, max_n_in_flight=Colossus.PIPELINE_DEPTH):
+    """
+    Send all the given commands through 'transport', pipelined, and return
+    a ReplayResult.  A failing command does not stop the replay.  If
+    'expected' (error_p, response_bytes) is given, 'mismatch_idxs' lists
+    the commands whose responses differ from it.
+    """
+    n_cmds = len(cmds)
+    error_p = np.zeros(n_cmds, dtype=bool)
+    response_bytes = np.zeros(n_cmds, dtype=np.uint8)
+    saved_tracer = transport.tracer
+    tracer = RingBufferTracer(capacity=max(n_cmds, 1), per_cmd_timing_p=True)
+    transport.tracer = tracer
+    try:
+        n_done = 0
+        while n_done < n_cmds:
+            chunk_error_p, chunk_response_bytes = transport.submit_cmds(
+                cmds[n_done:], max_n_in_flight)
+            n_chunk = len(chunk_error_p)
+            error_p[n_done:n_done + n_chunk] = chunk_error_p
+            response_bytes[n_done:n_done + n_chunk] = chunk_response_bytes
+            n_done += n_chunk
+    finally:
+        transport.tracer = saved_tracer
+
+    records = tracer.records()
+    elapsed_s = ((int(records['t_ns'][-1]) + int(records['latency_ns'][-1])
+                  - int(records['t_ns'][0])) * 1e-9
+                 if n_cmds else 0.0)
+    if expected is not None:
+        exp_error_p, exp_response_bytes = expected
+        mismatch_idxs = np.flatnonzero((error_p != exp_error_p)
+                                       | (response_bytes != exp_response_bytes))
+    else:
+        mismatch_idxs = np.zeros(0, dtype=np.int64)
+    return ReplayResult(cmds, error_p, response_bytes,
+                        records['latency_ns'].astype(np.int64), elapsed_s, mismatch_idxs)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Replay and benchmark a command stream')
+    parser.add_argument('cmd_stream', help='text command file or trace file')
+    parser.add_argument('--backend', choices=Colossus.Backends, default=None)
+    parser.add_argument('--wire-format', choices=['text', 'binary'], default='text')
+    parser.add_argument('--reference-backend', choices=Colossus.Backends, default=None,
+                        help='backend giving the expected responses'
+                             ' (default: those recorded in the trace, if any)')
+    parser.add_argument('--max-n-in-flight', type=int, default=Colossus.PIPELINE_DEPTH)
+    args = parser.parse_args(args)
+
+    cmds, expected = load_cmd_stream(args.cmd_stream)
+    if args.reference_backend is not None:
+        reference = Colossus.make_transport(args.reference_backend, args.wire_format)
+        ref_result = replay(reference, cmds, max_n_in_flight=args.max_n_in_flight)
+        reference.close()
+        expected = (ref_result.error_p, ref_result.response_bytes)
+
+    transport = Colossus.make_transport(args.backend, args.wire_format)
+    result = replay(transport, cmds, expected, args.max_n_in_flight)
+    transport.close()
+    result.report()
+    return 1 if len(result.mismatch_idxs) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -17,6 +17,7 @@
 
 from colossus import QPanelBottomUnitCfg, SteppingCfg, SetTotalOperation, SetTotalCfg, Colossus
 import wheel_patterns
+import numpy as np
 import pickle
 
 
@@ -66,10 +67,10 @@ def chi34_results(colossus, both_fast_p):
 
     print_records = colossus.printer_read_records()
 
-    raw_results = [(r.stepping_settings[2], r.stepping_settings[3], r.counters[4])
-                   for r in print_records]
-
-    return raw_results
+    # One row per record: CHI-3 setting, CHI-4 setting, count.
+    return np.column_stack([print_records.stepping_settings[:, 2],
+                            print_records.stepping_settings[:, 3],
+                            print_records.counters[:, 4]])
 
 
 if __name__ == '__main__':
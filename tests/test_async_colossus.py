@@ -0,0 +1,102 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import pytest
+import numpy as np
+from colossus import Colossus, QPanelTopUnitCfg, SetTotalCfg
+from async_colossus import AsyncColossus
+
+
+@pytest.fixture
+def model_backend_only(colossus):
+    if colossus.model is None:
+        pytest.skip('needs several boards; only possible with model backend')
+
+
+def _punch_run_and_print(board, zs):
+    board.punch_tape(zs)
+    board.reset_q_panel_cfg()
+    board.set_q_panel_top_unit_cfg(0, QPanelTopUnitCfg(0x01, 0x01, 0x00, 0x05))
+    board.set_set_total_config(0, SetTotalCfg.AlwaysPrint)
+    board.printer_reset()
+    board.initiate_run()
+    # For an AsyncColossus, only the last call need be awaited, since calls
+    # are carried out in the order made, and any earlier failure makes the
+    # last call fail too.
+    return board.printer_read_records()
+
+
+def test_calls_ordered(model_backend_only):
+    async def go():
+        async with AsyncColossus(backend='model') as board:
+            zs = np.random.randint(32, size=100)
+            board.punch_tape(zs)
+            return zs, await board.read_tape_contents(len(zs))
+
+    zs, got_zs = asyncio.run(go())
+    assert np.all(got_zs == zs)
+
+
+def test_several_boards(model_backend_only):
+    tapes = [np.random.randint(32, size=n) for n in [100, 150, 200]]
+
+    async def go():
+        boards = [AsyncColossus(backend='model') for _ in tapes]
+        records = await asyncio.gather(*[_punch_run_and_print(board, zs)
+                                         for board, zs in zip(boards, tapes)])
+        await asyncio.gather(*[board.close() for board in boards])
+        return records
+
+    sync_board = Colossus(backend='model')
+    for zs, records in zip(tapes, asyncio.run(go())):
+        exp_records = _punch_run_and_print(sync_board, zs)
+        assert np.array_equal(records, exp_records)
+
+
+def test_error_propagates(model_backend_only):
+    async def go():
+        async with AsyncColossus(backend='model') as board:
+            await board.do_cmds([(27, 2)])
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(go())
+
+
+def test_earlier_failure_poisons_later_calls(model_backend_only):
+    async def go():
+        board = AsyncColossus(backend='model')
+        failing = board.do_cmds([(27, 2)])
+        later = board.read_tape_contents(4)
+        results = await asyncio.gather(failing, later, return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await board.close()
+        return results
+
+    failing_result, later_result = asyncio.run(go())
+    assert isinstance(failing_result, RuntimeError)
+    assert later_result is failing_result
+
+
+def test_only_methods_proxied(model_backend_only):
+    async def go():
+        async with AsyncColossus(backend='model') as board:
+            for name in ['_submit_cmds', 'N_WHEELS', 'Readback_Map']:
+                with pytest.raises(AttributeError):
+                    getattr(board, name)
+
+    asyncio.run(go())
@@ -0,0 +1,109 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import sys
+import numpy as np
+import pytest
+from colossus import QPanelTopUnitCfg, SetTotalCfg
+from transports import MonitorProcessTransport, StreamTransport, TESTS_DIR
+import batch_script
+from batch_script import compile_session, run_batch
+from replay import load_cmd_stream
+
+
+def session(colossus):
+    colossus.punch_random_tape(82)
+    colossus.load_chi_wheel_pattern(0, np.arange(41) % 2)
+    colossus.set_step_count_vector_config(0, colossus.Step_Fast_Cfg)
+    colossus.reset_q_panel_cfg()
+    colossus.set_q_selector_cfg(int('001010', 2))
+    colossus.set_q_panel_top_unit_cfg(0, QPanelTopUnitCfg(0x10, 0x10, 0x00, 0x01))
+    colossus.set_set_total_config(0, SetTotalCfg.AlwaysPrint)
+    colossus.printer_reset()
+    colossus.initiate_run()
+    return colossus.printer_read_records()
+
+
+def model_monitor(tmp_path, wire_format='text'):
+    return MonitorProcessTransport(
+        wire_format,
+        monitor_cmd=[sys.executable, os.path.join(TESTS_DIR, 'model_monitor.py')],
+        cmd_fifo_path=str(tmp_path / 'repl-input'))
+
+
+def test_compile_and_run_batch(tmp_path):
+    script = compile_session(session)
+    assert len(script.predicted_result) == 41
+    assert len(script.cmds) > 300
+    assert len(script.exp_error_p) == len(script.cmds)
+
+    transport = model_monitor(tmp_path)
+    result = run_batch(script, transport)
+    transport.close()
+    assert len(result.mismatch_idxs) == 0
+
+    # Expected responses are checked:
+    script.exp_response_bytes[-1] ^= 1
+    transport = model_monitor(tmp_path, 'binary')
+    result = run_batch(script, transport)
+    transport.close()
+    assert list(result.mismatch_idxs) == [len(script.cmds) - 1]
+
+
+
+class BrokenPipeTransport(StreamTransport):
+    def __init__(self):
+        super().__init__()
+        self.f_resp = io.BytesIO()
+        self.closed_p = False
+
+    def _write(self, payload):
+        raise BrokenPipeError('monitor went away')
+
+    def close(self):
+        self.closed_p = True
+        super().close()
+
+
+def test_run_batch_send_failure(monkeypatch):
+    script = compile_session(session)
+    transports = []
+
+    def make_transport():
+        transports.append(BrokenPipeTransport())
+        return transports[-1]
+
+    monkeypatch.setattr(batch_script, 'MonitorProcessTransport', make_transport)
+    with pytest.raises(BrokenPipeError):
+        run_batch(script)
+    assert transports[0].closed_p
+
+def test_write_script(tmp_path):
+    script = compile_session(session)
+    cmd_path = str(tmp_path / 'session.txt')
+    trace_path = str(tmp_path / 'session.bin')
+    script.write_cmd_file(cmd_path)
+    script.write_trace(trace_path)
+
+    cmds, expected = load_cmd_stream(cmd_path)
+    assert cmds == script.cmds
+    cmds, expected = load_cmd_stream(trace_path)
+    assert cmds == script.cmds
+    assert np.all(expected[0] == script.exp_error_p)
+    assert np.all(expected[1] == script.exp_response_bytes)
@@ -0,0 +1,152 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import struct
+import threading
+import pytest
+import numpy as np
+from colossus import Colossus
+from transports import ModelTransport
+from board_server import BoardServer, BoardServerTransport
+
+
+@pytest.fixture
+def server(request):
+    wire_format = getattr(request, 'param', 'text')
+    with BoardServer(ModelTransport(), wire_format=wire_format) as server:
+        yield server
+
+
+def connect(server):
+    wire_format = 'binary' if server.binary_p else 'text'
+    return Colossus(transport=BoardServerTransport.connect(*server.address, wire_format))
+
+
+def run_concurrently(fns):
+    errors = []
+    def wrap(fn):
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=wrap, args=(fn,)) for fn in fns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+@pytest.mark.parametrize('server', ['text', 'binary'], indirect=True)
+def test_transactions_not_interleaved(server):
+    clients = [connect(server) for _ in range(3)]
+
+    def load_and_check(colossus, seed):
+        rng = np.random.RandomState(seed)
+        for _ in range(5):
+            zs = rng.randint(32, size=200)
+            with colossus.transaction():
+                colossus.punch_tape(zs)
+                got_zs = colossus.read_tape_contents(len(zs))
+            assert np.all(got_zs == zs)
+
+    run_concurrently([lambda c=c, i=i: load_and_check(c, i)
+                      for i, c in enumerate(clients)])
+    assert server.metrics().n_transactions == 15
+    for colossus in clients:
+        colossus.close()
+
+
+@pytest.mark.parametrize('server', ['text', 'binary'], indirect=True)
+def test_address_latch_per_session(server):
+    clients = [connect(server) for _ in range(2)]
+
+    def add_nibbles(colossus, n0):
+        # All but the first command are data-only, for address 8.
+        n1s = np.arange(16).repeat(20)
+        cmds = [(8, (n1s[0] << 4) | n0)] + [((n1 << 4) | n0,) for n1 in n1s[1:]]
+        assert np.all(colossus.do_cmds(cmds) == (n1s + n0) % 16)
+
+    run_concurrently([lambda c=c, i=i: add_nibbles(c, i)
+                      for i, c in enumerate(clients)])
+    for colossus in clients:
+        colossus.close()
+
+
+def test_abandoned_transaction_released(server):
+    colossus_0 = connect(server)
+    colossus_0.transport.begin_transaction()
+    assert colossus_0.add_nibbles(1, 2) == 3
+    colossus_0.close()
+
+    colossus_1 = connect(server)
+    assert colossus_1.add_nibbles(3, 4) == 7
+    colossus_1.close()
+
+
+def test_shadow_distrusted_outside_transaction(server):
+    colossus_0 = connect(server)
+    colossus_1 = connect(server)
+    zs = colossus_0.punch_random_tape(50)
+    colossus_1.punch_random_tape(50, seed=99)
+    colossus_0.punch_random_tape(50)
+    assert np.all(colossus_0.read_tape_contents(50) == zs)
+    colossus_0.close()
+    colossus_1.close()
+
+
+def test_metrics(server):
+    colossus = connect(server)
+    colossus.do_cmds([(8, 0x12)] * 100)
+    stats = colossus.transport.stats()
+    assert int(stats['n_sessions']) == 1
+    assert int(stats['n_cmds_done']) >= 100
+    metrics = server.metrics()
+    assert metrics.queue_depth == 0
+    assert metrics.max_queue_depth >= 1
+    assert 0.0 <= metrics.utilisation <= 1.0
+    colossus.close()
+
+
+def test_abrupt_disconnect_does_not_stop_board(server):
+    sock = socket.create_connection(server.address)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    sock.sendall(b'0803\n' * 200000)
+    sock.close()  # with RST, since lingering is off
+
+    colossus = connect(server)
+    assert colossus.add_nibbles(5, 6) == 11
+    assert server.threads[1].is_alive()
+    colossus.close()
+
+
+def test_latched_address_not_repeated(server, monkeypatch):
+    board_cmds = []
+    orig_submit_cmds = server.transport.submit_cmds
+
+    def recording_submit_cmds(cmds, max_n_in_flight):
+        board_cmds.extend(cmds)
+        return orig_submit_cmds(cmds, max_n_in_flight)
+
+    monkeypatch.setattr(server.transport, 'submit_cmds', recording_submit_cmds)
+    colossus = connect(server)
+    del board_cmds[:]
+    colossus.do_cmds([(8, 0x12), (0x34,), (0x56,)])
+    assert board_cmds == [(8, 0x12), (0x34,), (0x56,)]
+    colossus.close()
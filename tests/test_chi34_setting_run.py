@@ -20,42 +20,32 @@ import wheels
 import wheel_patterns
 import numpy as np
 import pickle
-from operator import itemgetter as nth
 from sample_long_run import chi34_results, set_total_threshold
 
 
-slow = pytest.mark.skipif(
-    not pytest.config.getoption("--runslow"),
-    reason="need --runslow option to run"
-)
+slow = pytest.mark.slow
 
 
-def delta_stream(x):
-    return x[1:] ^ x[:-1]
+def dot_3_plus_4(delta_de_chi):
+    impulse_3 = (delta_de_chi >> 2) & 1
+    impulse_4 = (delta_de_chi >> 1) & 1
+    return (impulse_3 ^ impulse_4) == 0
 
 
 @pytest.fixture
 def exp_results():
     with open('sample_PP_Z.pkl', 'rb') as f_in:
         specimen_ciphertext = pickle.load(f_in)
-    tape_length = specimen_ciphertext.size
 
-    records = []
+    dot3p4_counts = wheels.count_grid(specimen_ciphertext, wheel_patterns.chi,
+                                      [2, 3], dot_3_plus_4, delta_p=True)
+
     # Iterate over chi4 in the outer loop as that is 'slow' stepping
     # in the test below.
-    for chi4 in range(wheel_patterns.chi[3].size):
-        for chi3 in range(wheel_patterns.chi[2].size):
-            candidate_chi_wheels = wheels.Chi(wheel_patterns.chi, [0, 0, chi3, chi4, 0])
-            candidate_chi_letters = candidate_chi_wheels.letters(tape_length)
-            candidate_de_chi = specimen_ciphertext ^ candidate_chi_letters
-
-            impulse_3 = np.minimum(1, candidate_de_chi & 4)
-            impulse_4 = np.minimum(1, candidate_de_chi & 2)
-            dot3p4 = np.sum(delta_stream(impulse_3 ^ impulse_4) == 0)
-
-            records.append((chi3, chi4, dot3p4))
+    chi4s, chi3s = np.indices(dot3p4_counts.T.shape)
+    records = np.column_stack([chi3s.ravel(), chi4s.ravel(), dot3p4_counts.T.ravel()])
 
-    return [r for r in records if r[2] < set_total_threshold]
+    return records[records[:, 2] < set_total_threshold]
 
 
 @slow
@@ -63,7 +53,8 @@ def exp_results():
 def test_chi34_run(colossus, both_fast_p, exp_results):
     raw_results = chi34_results(colossus, both_fast_p)
 
-    got_results = (sorted(raw_results, key=nth(1, 0)) if both_fast_p
+    got_results = (raw_results[np.lexsort((raw_results[:, 0], raw_results[:, 1]))]
+                   if both_fast_p
                    else raw_results)
 
-    assert got_results == exp_results
+    assert np.array_equal(got_results, exp_results)
@@ -0,0 +1,96 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from colossus_model import ColossusModel, Hang, N_CAMS_ALL
+
+
+def load_random_wheels(model, seed):
+    np.random.seed(seed)
+    for wheel_idx, n_cams in enumerate(N_CAMS_ALL):
+        pattern = np.random.randint(2, size=n_cams)
+        octets = np.packbits(np.concatenate([np.zeros(-n_cams % 8, dtype=np.uint8),
+                                             pattern[::-1]]))
+        for octet in octets:
+            assert model.submit(170 + 2 * wheel_idx, int(octet)) == (False, 0x58)
+        assert model.submit(171 + 2 * wheel_idx, 3) == (False, 0x30)
+
+
+def punch(model, zs):
+    assert model.submit(28, 0) == (False, 0x44)
+    for z in zs:
+        assert model.submit(29, int(z)) == (False, 0x55)
+    assert model.submit(29, 0x3f) == (False, 0x55)
+
+
+def read_counters(model):
+    assert model.submit(16, 0x82) == (False, 0xa2)
+    return [model.submit(16, i)[1] + (model.submit(16, 0x10 + i)[1] << 8)
+            for i in range(5)]
+
+
+@pytest.mark.parametrize('q_selector_cfg', [0x20, 0x2a, 0x22, 0x0a])
+def test_vectorized_run_matches_stepping(q_selector_cfg):
+    model = ColossusModel()
+    load_random_wheels(model, 42)
+    np.random.seed(99)
+    zs = np.random.randint(32, size=300)
+    punch(model, zs)
+    model.submit(23, q_selector_cfg)
+    # Count 'impulse 1 is cross' into counter 0, and '2 + 3 = dot' into counter 1:
+    model.submit(80, 0x10)
+    model.submit(81, 0x10)
+    model.submit(82, 0x10)
+    model.submit(110, 0x0c)
+    model.submit(111, 0x08)
+
+    model.submit(24, 0x00)
+    model.submit(16, 0x80)
+    for _ in zs:
+        assert model.submit(16, 0x81) == (False, 0xa1)
+        assert model.submit(24, 0x01) == (False, 0x63)
+    stepped_counts = read_counters(model)
+
+    model.submit(24, 0x00)
+    assert model.submit(144, 2) == (False, 0x12)
+    run_counts = read_counters(model)
+
+    assert run_counts == stepped_counts
+
+
+def test_bodies_disagree_after_run():
+    model = ColossusModel()
+    punch(model, np.zeros(10, dtype=np.uint8))
+    model.submit(224, 0x08)
+    assert model.submit(240, 0xff) == (False, 0x15)
+    # Body 1 ran vector 40 and body 0 ran vector 39:
+    assert model.submit(171, 0x80) == (True, 0x07)
+    # But commands which do not depend on the bodies' histories agree:
+    assert model.submit(8, 0x34) == (False, 0x07)
+
+
+def test_tape_without_stop_hangs():
+    model = ColossusModel()
+    # (A cleared tape is all 0xa5, which includes the stop bit.)
+    model.submit(28, 0)
+    model.submit(29, 0)
+    for _ in range(16383):
+        model.submit(0)
+    with pytest.raises(Hang):
+        model.submit(144, 2)
@@ -0,0 +1,131 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from colossus import QPanelTopUnitCfg, SetTotalCfg
+
+
+def test_redundant_writes_skipped(colossus, sent_cmds):
+    for _ in range(2):
+        del sent_cmds[:]
+        colossus.reset_q_panel_cfg()
+        colossus.reset_all_stepping()
+        colossus.reset_all_set_total_configs()
+        colossus.reset_all_step_count_vector_configs()
+    assert sent_cmds == []
+
+    cfg = QPanelTopUnitCfg(0x3, 0x2, 0x1, 0x2)
+    colossus.set_q_panel_top_unit_cfg(4, cfg)
+    n_sent = len(sent_cmds)
+    assert n_sent > 0
+    colossus.set_q_panel_top_unit_cfg(4, cfg)
+    assert len(sent_cmds) == n_sent
+
+
+def test_raw_write_forgets_shadow(colossus, sent_cmds):
+    colossus.set_q_selector_cfg(0x42)
+    colossus.do_cmd(23, 0x00)
+    del sent_cmds[:]
+    colossus.set_q_selector_cfg(0x42)
+    assert sent_cmds == [(23, 0x42)]
+
+
+def test_set_total_partial_write(colossus, sent_cmds):
+    colossus.set_set_total_config(2, SetTotalCfg.NeverPrint)
+    del sent_cmds[:]
+    try:
+        # Only the threshold's low octet differs from the current config.
+        colossus.set_set_total_config(2, SetTotalCfg.NeverPrint._replace(threshold=42))
+        assert sent_cmds == [(134, 42)]
+    finally:
+        colossus.set_set_total_config(2, SetTotalCfg.NeverPrint)
+
+
+def test_stepping_reapplied_after_new_pattern(colossus):
+    wheel_idx = 0
+    n_cams = colossus.N_CAMS_ALL[wheel_idx]
+    for pattern in [np.arange(n_cams) % 2, np.arange(n_cams) % 3 == 0]:
+        pattern = pattern.astype(np.uint8)
+        colossus.load_cam_wheel(wheel_idx, pattern)
+        # Same stepping as previous time round; must not be skipped.
+        got_pattern = colossus.read_cam_wheel_pattern(wheel_idx, 3)
+        assert np.all(got_pattern == np.concatenate([pattern[3:], pattern[:3]]))
+
+
+def test_invalidate(colossus, sent_cmds):
+    colossus.invalidate()
+    colossus.reset_all_stepping()
+    assert len(sent_cmds) == colossus.N_WHEELS
+
+
+def test_wheel_patterns_skipped(colossus, sent_cmds):
+    np.random.seed(42)
+    patterns = [np.random.randint(2, size=n).astype(np.uint8)
+                for n in colossus.N_CAMS_ALL]
+    chi, psi, mu = patterns[:5], patterns[5:10], patterns[10:]
+
+    colossus.invalidate()
+    colossus.load_all_wheels(chi, psi, mu)
+    n_octets = sum((n + 7) // 8 for n in colossus.N_CAMS_ALL)
+    assert len(sent_cmds) == n_octets
+
+    del sent_cmds[:]
+    colossus.load_all_wheels(chi, psi, mu)
+    assert sent_cmds == []
+
+    psi[2] = 1 - psi[2]
+    colossus.load_all_wheels(chi, psi, mu)
+    assert set(addr for addr, _ in sent_cmds) == {170 + 2 * 7}
+
+    # A raw write to a wheel's pattern register forgets that wheel.
+    colossus.do_cmd(170, 0x00)
+    del sent_cmds[:]
+    colossus.load_all_wheels(chi, psi, mu)
+    assert set(addr for addr, _ in sent_cmds) == {170}
+
+    for wheel_idx, pattern in enumerate(patterns):
+        got_pattern = colossus.read_cam_wheel_pattern(wheel_idx, 0)
+        assert np.all(got_pattern == (psi[2] if wheel_idx == 7 else pattern))
+
+
+def test_wheel_pattern_octets(colossus):
+    pattern = np.array([1, 1, 0, 1, 0, 0, 0, 0, 0, 1, 1], dtype=np.uint8)
+    octets = colossus._wheel_pattern_octets(colossus._wheel_pattern_bytes(pattern))
+    # Reversed and zero-padded at the front: 00000110 00001011
+    assert octets == (0x06, 0x0b)
+
+
+def test_forget_shadowed_state_without_latched_addr(colossus):
+    colossus.punch_random_tape(50)
+    colossus.load_chi_wheel_pattern(0, np.arange(colossus.N_CAMS_ALL[0]) % 2)
+    colossus.set_set_total_config(0, SetTotalCfg.NeverPrint)
+    shadows = (dict(colossus.config_shadow), colossus.tape_shadow.copy(),
+               colossus.tape_write_ptr, dict(colossus.wheel_pattern_shadow))
+    assert shadows[0] and shadows[3]
+
+    last_addr = colossus.last_addr
+    try:
+        colossus.last_addr = None
+        colossus._forget_shadowed_state([(0x03,)])
+        # The data-only command has no known target, so nothing is forgotten:
+        assert colossus.config_shadow == shadows[0]
+        assert np.all(colossus.tape_shadow == shadows[1])
+        assert colossus.tape_write_ptr == shadows[2]
+        assert colossus.wheel_pattern_shadow == shadows[3]
+        assert colossus.last_addr is None
+    finally:
+        colossus.last_addr = last_addr
@@ -39,12 +39,7 @@ def test_decryption(colossus):
     cipher = key ^ plain
     colossus.punch_tape(cipher)
 
-    for i, chi in enumerate(wheel_patterns.chi):
-        colossus.load_chi_wheel_pattern(i, chi)
-    for i, psi in enumerate(wheel_patterns.psi):
-        colossus.load_psi_wheel_pattern(i, psi)
-    for i, mu in enumerate(wheel_patterns.mu):
-        colossus.load_mu_wheel_pattern(i, mu)
+    colossus.load_all_wheels(wheel_patterns.chi, wheel_patterns.psi, wheel_patterns.mu)
 
     colossus.reset_all_stepping()
     for i, stepping_setting in enumerate(stepping_settings):
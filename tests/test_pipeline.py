@@ -15,8 +15,10 @@
 # You should have received a copy of the GNU General Public License along with
 # "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
 
+import pytest
 import numpy as np
 
+import wheels
 from colossus import (SetTotalOperation, SetTotalCfg,
                       SteppingCfg, QPanelTopUnitCfg,
                       WorkerIndex, PrintRecord, ColossusTesting)
@@ -45,18 +47,22 @@ def test_short_run(colossus):
     print_records = colossus.printer_read_records()
 
     assert len(print_records) == 41
-    assert np.all([r.stepping_settings[0] for r in print_records] == np.arange(41))
-    assert np.all(np.array([r.stepping_settings[1:] for r in print_records]) == 0)
-    assert np.all(np.array([r.counters[1:] for r in print_records]) == tape_len)
+    assert np.all(print_records.stepping_settings[:, 0] == np.arange(41))
+    assert np.all(print_records.stepping_settings[:, 1:] == 0)
+    assert np.all(print_records.counters[:, 1:] == tape_len)
 
-    body_ids = np.array([r.body_id for r in print_records])
+    body_ids = print_records.body_id
     assert np.sum(body_ids == 0) == 20
     assert np.sum(body_ids == 1) == 21
 
-    got_ctr_0s = np.array([r.counters[0] for r in print_records])
+    got_ctr_0s = print_records.counters[:, 0]
     exp_ctr_0s = np.array([expected_count(zs, chi_1, i) for i in range(41)])
     assert np.all(got_ctr_0s == exp_ctr_0s)
 
+    # Cross-check against counts for all rotations at once:
+    impulse_1s = (zs >> 4) & 1
+    assert np.all(wheels.rotation_counts(impulse_1s, [chi_1], target=1) == exp_ctr_0s)
+
 
 def expected_count(zs, chi_1, stepping):
     assert len(zs) % len(chi_1) == 0
@@ -68,3 +74,20 @@ def expected_count(zs, chi_1, stepping):
     q = zs ^ full_chi
     q1 = np.where(q & 16, 1, 0)
     return np.sum(q1)
+
+
+def test_print_record_array_layout():
+    n_records = 3
+    octets = np.arange(n_records * PrintRecord.Encoded_N_Octets, dtype=np.uint8)
+    records = PrintRecord.array_from_octets(octets)
+    assert np.shares_memory(records, octets)
+    for i, record in enumerate(records):
+        idx0 = i * PrintRecord.Encoded_N_Octets
+        exp_record = PrintRecord.from_octets(
+            octets[idx0 : (idx0 + PrintRecord.Encoded_N_Octets)])
+        assert record.body_id == exp_record.body_id
+        assert np.all(record.stepping_settings == exp_record.stepping_settings)
+        assert np.all(record.counters == exp_record.counters)
+
+    with pytest.raises(ValueError):
+        PrintRecord.array_from_octets(octets[:-1])
@@ -0,0 +1,70 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+import numpy as np
+from colossus import BinaryFrame
+
+
+def nibble_add_cmds(nibble_pairs):
+    return [(8, (n1 << 4) | n0) for n0, n1 in nibble_pairs]
+
+
+@pytest.mark.parametrize('max_n_in_flight', [1, 3, 64])
+def test_pipelined_responses_in_order(colossus, max_n_in_flight):
+    nibble_pairs = [(n0, n1) for n0 in range(16) for n1 in range(0, 16, 5)]
+    got_sums = colossus.do_cmds(nibble_add_cmds(nibble_pairs),
+                                max_n_in_flight=max_n_in_flight)
+    exp_sums = [(n0 + n1) % 16 for n0, n1 in nibble_pairs]
+    assert np.all(got_sums == exp_sums)
+
+
+def test_pipelined_error_attribution(colossus):
+    # Command 27 with data other than 0 or 1 is an error:
+    cmds = nibble_add_cmds([(1, 2), (3, 4)]) + [(27, 0x02)] + nibble_add_cmds([(5, 6)])
+    with pytest.raises(RuntimeError, match=r'error for 1b02 \(command 2 of 4\): 98'):
+        colossus.do_cmds(cmds)
+    # The command stream should still be in step:
+    assert colossus.add_nibbles(7, 8) == 15
+
+
+def test_pipelined_unexpected_response(colossus):
+    with pytest.raises(RuntimeError, match=r'command 1 of 2.*got 0b but expected 0a'):
+        colossus.do_cmds(nibble_add_cmds([(1, 2), (5, 6)]), [3, 10])
+
+
+def test_pipelined_tape_punch(colossus):
+    zs = colossus.punch_random_tape(1000)
+    tape = colossus.read_tape_contents(1001)
+    assert np.all(tape[:-1] == zs)
+    assert tape[-1] == 0x3f
+
+
+def test_binary_frame_decoding():
+    cmds = [(0x1d, 0x3f), (0x07,), (0x1b, 0x02)]
+    cmd_frames = BinaryFrame.command_frames(cmds)
+    assert cmd_frames.tobytes() == bytes([0x01, 0x1d, 0x3f, 0x00,
+                                          0x00, 0x00, 0x07, 0x00,
+                                          0x01, 0x1b, 0x02, 0x00])
+    raw_frames = bytes([0x01, 0x1d, 0x3f, 0x55,
+                        0x00, 0x00, 0x07, 0x55,
+                        0x03, 0x1b, 0x02, 0x98])
+    error_p, response_bytes = BinaryFrame.decode_responses(raw_frames, cmd_frames)
+    assert list(error_p) == [False, False, True]
+    assert list(response_bytes) == [0x55, 0x55, 0x98]
+    with pytest.raises(ValueError, match='echo'):
+        BinaryFrame.decode_responses(raw_frames[4:] + raw_frames[:4], cmd_frames)
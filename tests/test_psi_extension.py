@@ -16,64 +16,54 @@
 # "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
+import pytest
 from colossus import Colossus
+import wheels
+from test_wheels import reference_extended_psi
 
 
-class PsiAndMu:
-    def __init__(self, psi, mu):
-        if list(map(len, psi)) != Colossus.N_CAMS_PSI:
-            raise ValueError('wrong psi lengths')
-        if list(map(len, mu)) != Colossus.N_CAMS_MU:
-            raise ValueError('wrong mu lengths')
-        self.psi = psi
-        self.mu = mu
-
-    @property
-    def psi_letter(self):
-        # PSI_1, stored as psi[0], is the MOST-significant bit.
-        return (16 * self.psi[0][0]
-                + 8 * self.psi[1][0]
-                + 4 * self.psi[2][0]
-                + 2 * self.psi[3][0]
-                + 1 * self.psi[4][0])
-
-    def move(self):
-        mu_61 = self.mu[0]
-        mu_37 = self.mu[1]
-        if mu_37[0]:
-            self.psi = [w[1:] + w[:1] for w in self.psi]
-        if mu_61[0]:
-            self.mu[1] = mu_37[1:] + mu_37[:1]
-        self.mu[0] = mu_61[1:] + mu_61[:1]
-
-    def psi_letter_then_move(self):
-        psi = self.psi_letter
-        self.move()
-        return psi
-
-    @classmethod
-    def extend_psi(cls, psi, mu, n_sprockets):
-        psi_and_mu = cls(psi, mu)
-        return np.array(
-                   [psi_and_mu.psi_letter_then_move() for _ in range(n_sprockets)],
-                   dtype=np.uint8)
-
-
-def test_psi_extension(colossus):
+def load_random_psi_and_mu(colossus):
     np.random.seed(42)
-    psi = [list(np.random.randint(2, size=n)) for n in Colossus.N_CAMS_PSI]
-    mu = [list(np.random.randint(2, size=n)) for n in Colossus.N_CAMS_MU]
+    psi = [np.random.randint(2, size=n).astype(np.uint8) for n in Colossus.N_CAMS_PSI]
+    mu = [np.random.randint(2, size=n).astype(np.uint8) for n in Colossus.N_CAMS_MU]
 
     for i, p in enumerate(psi):
         colossus.load_psi_wheel_pattern(i, p)
     for i, p in enumerate(mu):
         colossus.load_mu_wheel_pattern(i, p)
 
+    return psi, mu
+
+
+def test_psi_extension(colossus):
+    psi, mu = load_random_psi_and_mu(colossus)
+
     colossus.reset_all_stepping()
     colossus.set_q_selector_cfg(int('000010', 2))
 
     n_letters = 120
     q = colossus.snoop_Q_vec(n_letters)
-    exp_extended_psi = PsiAndMu.extend_psi(psi, mu, n_letters)
+    exp_extended_psi = reference_extended_psi(psi, mu, [0] * 5, [0] * 2, n_letters)
 
     assert np.all(q == exp_extended_psi)
+    assert np.all(wheels.extended_psi_letters(psi, mu, [0] * 5, [0] * 2, n_letters)
+                  == exp_extended_psi)
+
+
+def test_psi_extension_mu_grid(colossus):
+    psi, mu = load_random_psi_and_mu(colossus)
+    psi_settings = [3, 1, 4, 1, 5]
+    mu_settings = np.stack(np.meshgrid([0, 7, 60], [0, 20, 36], indexing='ij'), axis=-1)
+
+    n_letters = 120
+    exp_extended_psi = wheels.extended_psi_letters(psi, mu, psi_settings, mu_settings,
+                                                   n_letters)
+    assert exp_extended_psi.shape == (3, 3, n_letters)
+
+    colossus.set_q_selector_cfg(int('000010', 2))
+    for idxs in np.ndindex(*mu_settings.shape[:2]):
+        colossus.reset_all_stepping()
+        for i, setting in enumerate(psi_settings + list(mu_settings[idxs])):
+            colossus.set_cam_wheel_stepping(5 + i, int(setting))
+        q = colossus.snoop_Q_vec(n_letters)
+        assert np.all(q == exp_extended_psi[idxs])
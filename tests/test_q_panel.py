@@ -22,6 +22,7 @@ TAPE_LENGTH = 320
 
 from colossus import (QPanelTopUnitCfg, QPanelBottomUnitCfg, QPanelNegatingCfg,
                       ColossusTesting)
+import q_panel
 
 
 def test_summands(colossus):
@@ -107,3 +108,65 @@ def test_summands_global_negations(colossus, seed, global_negate):
         np.ones_like(zs)]) ^ global_negate
 
     assert np.all(got_a == exp_a)
+
+
+def random_q_panel_cfgs(seed):
+    rng = np.random.RandomState(seed)
+    top_cfgs = [QPanelTopUnitCfg(*rng.randint(32, size=2), rng.randint(2), rng.randint(32))
+                for _ in range(rng.randint(4))]
+    bottom_cfgs = [QPanelBottomUnitCfg(rng.randint(32), rng.randint(2), rng.randint(32))
+                   for _ in range(rng.randint(3))]
+    negating_cfg = QPanelNegatingCfg(rng.randint(32), rng.randint(32))
+    return top_cfgs, bottom_cfgs, negating_cfg
+
+
+def brute_force_summands(top_cfgs, bottom_cfgs, negating_cfg, q):
+    par = ColossusTesting.parity
+    top_product = 0x1f
+    for cfg in top_cfgs:
+        match = all(((q >> i) & 1) == ((cfg.match_tgt >> i) & 1)
+                    for i in range(5) if (cfg.match_en >> i) & 1)
+        if match == bool(cfg.negate):
+            top_product &= ~cfg.counter_en
+    bottom_product = 0x1f
+    for cfg in bottom_cfgs:
+        if par[q & cfg.coeff] != int(cfg.tgt):
+            bottom_product &= ~cfg.counter_en
+    return ((((top_product ^ negating_cfg.top_negates) & bottom_product)
+             ^ negating_cfg.global_negates) & 0x1f)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_compiled_truth_table(seed):
+    cfgs = random_q_panel_cfgs(seed)
+    table = q_panel.compile_q_panel(*cfgs)
+    assert table.shape == (32, 5)
+    exp_a = [brute_force_summands(*cfgs, q) for q in range(32)]
+    assert np.all(q_panel.a_bus(table, np.arange(32)) == exp_a)
+
+
+def test_counter_totals():
+    table = q_panel.compile_q_panel(*random_q_panel_cfgs(99))
+    qs = np.random.RandomState(1).randint(32, size=(3, 4, 500))
+    totals = q_panel.counter_totals(table, qs)
+    assert totals.shape == (3, 4, 5)
+    a = q_panel.a_bus(table, qs)
+    exp_totals = np.stack([((a >> (4 - i)) & 1).sum(axis=-1) for i in range(5)], axis=-1)
+    assert np.all(totals == exp_totals)
+
+
+@pytest.mark.parametrize('seed', [3, 14, 15])
+def test_compiled_truth_table_vs_colossus(colossus, seed):
+    zs = colossus.punch_random_tape(TAPE_LENGTH)
+    top_cfgs, bottom_cfgs, negating_cfg = random_q_panel_cfgs(seed)
+    colossus.reset_q_panel_cfg()
+    for i, cfg in enumerate(top_cfgs):
+        colossus.set_q_panel_top_unit_cfg(i, cfg)
+    for i, cfg in enumerate(bottom_cfgs):
+        colossus.set_q_panel_bottom_unit_cfg(i, cfg)
+    colossus.set_q_panel_negating_cfg(negating_cfg)
+    colossus.set_q_selector_cfg(0x20) # un-delta'd Z
+    a_vec = colossus.snoop_A_vec(TAPE_LENGTH)
+
+    table = q_panel.compile_q_panel(top_cfgs, bottom_cfgs, negating_cfg)
+    assert np.all(a_vec == q_panel.a_bus(table, zs))
@@ -18,6 +18,10 @@
 import numpy as np
 import pytest
 
+from colossus import QPanelTopUnitCfg
+import q_panel
+from q_selector import q_stream, counted_q
+
 TAPE_LENGTH = 320
 
 
@@ -66,3 +70,64 @@ def test_command_target(colossus):
         assert colossus.snoop_Q() == (z - 1) % 32
         colossus.enable_q_selector_one_shot()
         assert colossus.snoop_Q() == z
+
+
+def load_random_chi_wheels(colossus, rng):
+    for i in range(5):
+        pattern = rng.randint(2, size=colossus.N_CAMS_ALL[i]).astype(np.uint8)
+        colossus.load_chi_wheel_pattern(i, pattern)
+
+
+@pytest.mark.parametrize('cfg', [0x20, 0x30, 0x28, 0x2c, 0x0c, 0x3c, 0x24, 0x1c])
+def test_q_stream_vs_colossus(colossus, cfg):
+    rng = np.random.RandomState(cfg)
+    zs = colossus.punch_random_tape(TAPE_LENGTH)
+    load_random_chi_wheels(colossus, rng)
+    colossus.set_q_selector_cfg(cfg)
+    colossus.reset_q_selector()
+    snooped = colossus.snoop_vec(TAPE_LENGTH, buses=('Z', 'Chi', 'Q'))
+    assert np.all(snooped['Z'] == zs & 31)
+    assert np.all(snooped['Q'] == q_stream(cfg, snooped['Z'], snooped['Chi'], 0))
+
+
+@pytest.mark.parametrize('cfg', [0x20, 0x30, 0x2c, 0x3f, 0x23])
+def test_q_stream_batch(cfg):
+    rng = np.random.RandomState(42)
+    z = rng.randint(32, size=100)
+    chi = rng.randint(32, size=(7, 100))
+    psi = rng.randint(32, size=(7, 100))
+    got_qs = q_stream(cfg, z, chi, psi)
+    assert got_qs.shape == (7, 100)
+    for row_qs, row_chi, row_psi in zip(got_qs, chi, psi):
+        exp_qs = np.zeros(100, dtype=np.int64)
+        for stream, shift in [(z, 4), (row_chi, 2), (row_psi, 0)]:
+            if (cfg >> (shift + 1)) & 1:
+                exp_qs ^= stream
+                if (cfg >> shift) & 1:
+                    exp_qs[1:] ^= stream[:-1]
+        assert np.all(row_qs == exp_qs)
+
+
+def test_q_stream_one_back():
+    z = np.array([3, 5, 6])
+    assert np.all(q_stream(0x30, z, 0, 0) == [3, 6, 3])
+    assert np.all(q_stream(0x30, z, 0, 0, one_back=(1, 0, 0)) == [2, 6, 3])
+    assert np.all(q_stream(0x30, z[1:], 0, 0, one_back=(3, 0, 0))
+                  == q_stream(0x30, z, 0, 0)[1:])
+
+
+@pytest.mark.parametrize('cfg', [0x20, 0x30])
+def test_counting_prediction(colossus, cfg):
+    zs = colossus.punch_random_tape(TAPE_LENGTH)
+    colossus.set_q_selector_cfg(cfg)
+    colossus.reset_q_panel_cfg()
+    top_cfg = QPanelTopUnitCfg(0x1f, 0x0b, 0, 0x06)
+    colossus.set_q_panel_top_unit_cfg(0, top_cfg)
+    colossus.run_tape_once()
+    colossus.snapshot_counters()
+    got_counts = colossus.read_all_counters()
+
+    q = q_stream(cfg, zs & 31, 0, 0)
+    table = q_panel.compile_q_panel([top_cfg])
+    exp_counts = q_panel.counter_totals(table, counted_q(cfg, q))
+    assert np.all(got_counts == exp_counts)
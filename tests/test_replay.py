@@ -0,0 +1,68 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+from colossus import Colossus
+from transports import ModelTransport
+from tracing import RingBufferTracer
+from replay import load_cmd_stream, replay, effective_addrs
+
+
+def test_replay_text_stream_against_reference():
+    cmds, expected = load_cmd_stream('repl-input-short-run-with-chi.txt')
+    assert len(cmds) == 390
+    assert expected is None
+
+    reference = replay(ModelTransport(), cmds)
+    result = replay(ModelTransport(), cmds, (reference.error_p, reference.response_bytes))
+    assert len(result.mismatch_idxs) == 0
+    assert result.cmds_per_second > 0
+
+    latencies = result.latency_by_addr()
+    assert sum(lat.n_cmds for lat in latencies) == len(cmds)
+    assert [lat.addr for lat in latencies] == sorted(set(effective_addrs(cmds)))
+    # Each command is timed on its own, not just each batch:
+    assert len(set(lat.p50_us for lat in latencies)) > 1
+
+    f_out = io.StringIO()
+    result.report(f_out)
+    assert '0 mismatched responses' in f_out.getvalue()
+
+
+def test_replay_recorded_trace(tmp_path):
+    dump_path = str(tmp_path / 'session.bin')
+    tracer = RingBufferTracer(dump_path=dump_path)
+    colossus = Colossus(backend='model', tracer=tracer)
+    colossus.punch_random_tape(100)
+    assert colossus.add_nibbles(4, 3) == 7
+    # Fails, so the transport stops before the second:
+    colossus.transport.submit_cmds([(27, 0x02), (8, 0x56)], 1)
+    assert colossus.add_nibbles(6, 5) == 11
+    tracer.dump()
+
+    cmds, expected = load_cmd_stream(dump_path)
+    assert expected[0].sum() == 1
+
+    # Replay continues past the failing command.
+    result = replay(ModelTransport(), cmds, expected)
+    assert len(result.mismatch_idxs) == 0
+    assert result.response_bytes[-1] == 11
+
+    # A changed recorded response is found:
+    expected[1][-1] ^= 1
+    result = replay(ModelTransport(), cmds, expected)
+    assert list(result.mismatch_idxs) == [len(cmds) - 1]
@@ -0,0 +1,142 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from colossus import WorkerIndex, ColossusTesting
+
+
+def establish_agreed_state(colossus):
+    # Bodies must agree for reads not to be errors.
+    colossus.reset_all_stepping()
+    ColossusTesting.establish_sample_counts(colossus)
+    colossus.scheduler_trigger_manual(WorkerIndex.Comparator_Copy_Settings)
+    colossus.reset_movement()
+
+
+def test_bulk_register_readback(colossus, monkeypatch):
+    establish_agreed_state(colossus)
+    colossus.scheduler_trigger_manual(WorkerIndex.Comparator_Copy_Counter_Values)
+
+    exp_values = {
+        'counters': [colossus.read_counter(i) for i in range(colossus.N_COUNTERS)],
+        'comparator_setting_labels': [colossus.do_cmd(128, i)
+                                      for i in range(colossus.N_WHEELS)],
+        'step_counts_via_wheels': [colossus.read_cam_wheel_step_count(i)
+                                   for i in range(colossus.N_WHEELS)],
+    }
+
+    n_batches = [0]
+    orig_submit_cmds = colossus._submit_cmds
+
+    def counting_submit_cmds(cmds, max_n_in_flight):
+        n_batches[0] += 1
+        return orig_submit_cmds(cmds, max_n_in_flight)
+
+    monkeypatch.setattr(colossus, '_submit_cmds', counting_submit_cmds)
+    got_values = colossus.read_registers()
+    assert n_batches[0] == 1
+
+    assert set(got_values) == set(colossus.Readback_Map)
+    assert got_values['counters'].dtype == np.uint16
+    assert got_values['comparator_setting_labels'].dtype == np.uint8
+    for name, exp in exp_values.items():
+        assert np.all(got_values[name] == exp)
+
+    # The older per-register readers still give int64, so callers can
+    # subtract without wrapping:
+    assert colossus.read_all_counters().dtype == np.int64
+    assert colossus.read_step_counts_via_wheels().dtype == np.int64
+
+
+def test_snapshot_fields(colossus):
+    establish_agreed_state(colossus)
+    snapshot = colossus.snapshot()
+    assert np.all(snapshot.counters == colossus.read_all_counters())
+    assert np.all(snapshot.step_counts_via_wheels == colossus.read_step_counts_via_wheels())
+    assert np.all(snapshot.comparator_counter_values
+                  == colossus.comparator_read_counter_values())
+    assert snapshot.printer_fill_level[0] == colossus.do_cmd(242, 0x00)
+    assert snapshot.snooped_buses[0] == colossus.snoop_Z()
+
+
+def test_snapshot_has_no_side_effects(colossus):
+    establish_agreed_state(colossus)
+    snapshot_0 = colossus.snapshot()
+    snapshot_1 = colossus.snapshot()
+    assert snapshot_0 == snapshot_1
+    assert snapshot_0.diff(snapshot_1) == {}
+
+
+def test_snapshot_diff(colossus):
+    colossus.reset_counters()
+    colossus.snapshot_counters()
+    colossus.scheduler_trigger_manual(WorkerIndex.Comparator_Copy_Counter_Values)
+    establish_agreed_state(colossus)
+    snapshot_0 = colossus.snapshot()
+    assert np.all(snapshot_0.comparator_counter_values == 0)
+    assert np.any(snapshot_0.counters != 0)
+
+    colossus.scheduler_trigger_manual(WorkerIndex.Comparator_Copy_Counter_Values)
+    snapshot_1 = colossus.snapshot()
+
+    diffs = snapshot_0.diff(snapshot_1)
+    # The comparator's flags follow from the counter values.
+    assert set(diffs) - {'comparator_flags'} == {'comparator_counter_values'}
+    diff = diffs['comparator_counter_values']
+    exp_idxs = np.flatnonzero(snapshot_0.counters)
+    assert np.all(diff.idxs == exp_idxs)
+    assert np.all(diff.old == 0)
+    assert np.all(diff.new == snapshot_0.counters[exp_idxs])
+
+
+def test_snapshot_records_failed_reads(colossus, monkeypatch):
+    establish_agreed_state(colossus)
+    orig_submit_cmds = colossus._submit_cmds
+    failing_cmds = [(16, 0x12), (128, 0x03)]
+
+    def failing_submit_cmds(cmds, max_n_in_flight):
+        # As the transport does, stop after the first failed command.
+        error_p, response_bytes = orig_submit_cmds(cmds, max_n_in_flight)
+        fail_idxs = [idx for idx, cmd in enumerate(cmds) if cmd in failing_cmds]
+        if fail_idxs:
+            idx = fail_idxs[0]
+            error_p, response_bytes = error_p[:idx + 1], response_bytes[:idx + 1]
+            error_p[idx] = True
+            response_bytes[idx] = 0x07
+        return error_p, response_bytes
+
+    good_snapshot = colossus.snapshot()
+    monkeypatch.setattr(colossus, '_submit_cmds', failing_submit_cmds)
+    snapshot = colossus.snapshot()
+
+    assert list(np.flatnonzero(snapshot.errors['counters'])) == [2]
+    assert list(np.flatnonzero(snapshot.errors['comparator_setting_labels'])) == [3]
+    assert not np.any(snapshot.errors['snooped_buses'])
+    # Reads after the failed ones were still made:
+    assert np.all(snapshot.snooped_buses == good_snapshot.snooped_buses)
+    assert np.all(snapshot.step_counts_via_wheels == good_snapshot.step_counts_via_wheels)
+
+    diffs = good_snapshot.diff(snapshot)
+    assert list(diffs['errors.counters'].idxs) == [2]
+    assert 'errors.comparator_setting_labels' in diffs
+
+
+def test_snapshot_equality_with_other_types(colossus):
+    establish_agreed_state(colossus)
+    snapshot = colossus.snapshot()
+    assert snapshot != 42
+    assert snapshot.__eq__(None) is NotImplemented
@@ -17,7 +17,7 @@
 
 import numpy as np
 import pytest
-from colossus import SteppingCfg
+from colossus import SteppingCfg, StepCountVectorPhase, Colossus
 
 no_stepping_cfg = SteppingCfg(False, False, False, False)
 step_fast_cfg = SteppingCfg(True, False, False, False)
@@ -160,3 +160,34 @@ def test_next_ended(colossus, tgt_counts, ignore_ps, exp_ended):
         colossus.set_step_count_vector_config(i, cfg)
     got_ended = colossus.read_step_count_vector_ended()
     assert got_ended == exp_ended
+
+
+def test_plan_step_count_vector():
+    tgt_counts = [0, 5, 2, 5, 0, 9, 0, 0, 0, 0, 0, 1]
+    phases = Colossus.plan_step_count_vector(tgt_counts)
+    assert phases == [StepCountVectorPhase((1, 2, 3, 5, 11), 1),
+                      StepCountVectorPhase((1, 2, 3, 5), 1),
+                      StepCountVectorPhase((1, 3, 5), 3),
+                      StepCountVectorPhase((5,), 4)]
+
+    # Wrap round from start to target:
+    start_counts = [0] * 12
+    start_counts[0] = 40
+    phases = Colossus.plan_step_count_vector([1] + [0] * 11, start_counts)
+    assert phases == [StepCountVectorPhase((0,), 2)]
+
+    with pytest.raises(ValueError):
+        Colossus.plan_step_count_vector([41] + [0] * 11)
+
+
+def test_move_step_count_vector_to(colossus, sent_cmds):
+    tgt_counts = np.array([(n // 2) for n in colossus.N_CAMS_ALL])
+    colossus.move_step_count_vector_to(tgt_counts)
+    assert np.all(colossus.read_step_count_vector_values() == tgt_counts)
+    n_steps = sum(cmd == (236, 0x21) for cmd in sent_cmds)
+    assert n_steps == max(tgt_counts)
+
+    # Resume from current values, wrapping round some wheels:
+    tgt_counts = (tgt_counts + np.arange(12) * 3) % colossus.N_CAMS_ALL
+    colossus.move_step_count_vector_to(tgt_counts, reset_first_p=False)
+    assert np.all(colossus.read_step_count_vector_values() == tgt_counts)
@@ -37,3 +37,25 @@ def test_snoop_z(colossus):
     aug_zs = colossus.snoop_Z_vec(TAPE_LENGTH)
     exp_aug_zs = (128 * ((zs & 32) == 32)) + (zs & 31)
     assert np.all(aug_zs == exp_aug_zs)
+
+
+def test_snoop_vec(colossus):
+    colossus.punch_random_tape(TAPE_LENGTH)
+    # Expected values from one scalar snoop at a time:
+    colossus.reset_movement()
+    exp_zs, exp_qs, exp_as = np.array(
+        [(colossus.snoop_Z(), colossus.snoop_Q(), colossus.snoop_A(post_move_p=True))
+         for _ in range(TAPE_LENGTH)], dtype=np.uint8).T
+
+    snooped = colossus.snoop_vec(TAPE_LENGTH)
+    assert np.all(snooped['position'] == np.arange(TAPE_LENGTH))
+    assert np.all(snooped['Z'] == exp_zs)
+    assert np.all(snooped['Q'] == exp_qs)
+    assert np.all(snooped['A'] == exp_as)
+    assert np.all(colossus.snoop_Q_vec(TAPE_LENGTH) == exp_qs)
+
+    sampled = colossus.snoop_vec(TAPE_LENGTH, buses=['A', 'Z'],
+                                 positions=range(3, TAPE_LENGTH, 7))
+    assert sampled.dtype.names == ('position', 'A', 'Z')
+    assert np.all(sampled['Z'] == exp_zs[3::7])
+    assert np.all(sampled['A'] == exp_as[3::7])
@@ -18,7 +18,10 @@
 import numpy as np
 import pytest
 
-from colossus import QPanelTopUnitCfg
+from colossus import QPanelTopUnitCfg, SweepConfig
+import q_panel
+from q_selector import q_stream, counted_q
+from test_q_panel import random_q_panel_cfgs
 
 TAPE_LENGTH = 40
 
@@ -72,3 +75,53 @@ def test_counting_with_delta(colossus, cfg, exp_count):
 
     got_counts = colossus.read_all_counters()
     assert np.all(got_counts == exp_count)
+
+
+def sweep_configs_for_test():
+    return [SweepConfig(q_selector_cfg, *random_q_panel_cfgs(seed))
+            for q_selector_cfg, seed in [(0x20, 0), (0x30, 0), (0x30, 1),
+                                         (0x20, 2), (0x20, 2), (0x30, 3)]]
+
+
+def test_sweep_configs(colossus):
+    np.random.seed(42)
+    zs = np.random.randint(32, size=TAPE_LENGTH)
+    configs = sweep_configs_for_test()
+    results = colossus.sweep_configs(configs, zs=zs)
+    assert results.shape == (len(configs),)
+
+    for config, result in zip(configs, results):
+        table = q_panel.compile_q_panel(config.top_cfgs, config.bottom_cfgs,
+                                        config.negating_cfg)
+        q = q_stream(config.q_selector_cfg, zs, 0, 0)
+        exp_counts = q_panel.counter_totals(table, counted_q(config.q_selector_cfg, q))
+        assert result['q_selector_cfg'] == config.q_selector_cfg
+        assert np.all(result['counters'] == exp_counts)
+
+    # Cross-check against setting up each configuration by hand.
+    config = configs[2]
+    colossus.set_q_selector_cfg(config.q_selector_cfg)
+    colossus.reset_q_panel_cfg()
+    for i, cfg in enumerate(config.top_cfgs):
+        colossus.set_q_panel_top_unit_cfg(i, cfg)
+    for i, cfg in enumerate(config.bottom_cfgs):
+        colossus.set_q_panel_bottom_unit_cfg(i, cfg)
+    colossus.set_q_panel_negating_cfg(config.negating_cfg)
+    colossus.reset_movement()
+    colossus.run_tape_once()
+    colossus.snapshot_counters()
+    assert np.all(colossus.read_all_counters() == results[2]['counters'])
+
+
+def test_sweep_configs_writes_only_differences(colossus, sent_cmds):
+    np.random.seed(42)
+    zs = np.random.randint(32, size=TAPE_LENGTH)
+    configs = sweep_configs_for_test()
+    colossus.sweep_configs(configs[:1], zs=zs)
+
+    del sent_cmds[:]
+    results = colossus.sweep_configs([configs[0], configs[1], configs[1]], zs=zs)
+    n_run_cmds = 3 + 2 * colossus.N_COUNTERS
+    assert len(sent_cmds) == 3 * n_run_cmds + 1
+    assert sent_cmds[n_run_cmds] == (23, configs[1].q_selector_cfg)
+    assert np.all(results['counters'][1] == results['counters'][2])
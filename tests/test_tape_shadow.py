@@ -0,0 +1,67 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+TAPE_LENGTH = 320
+
+
+def test_unchanged_tape_not_resent(colossus, sent_cmds):
+    zs = colossus.punch_random_tape(TAPE_LENGTH)
+    del sent_cmds[:]
+    colossus.punch_random_tape(TAPE_LENGTH)
+    assert sent_cmds == []
+    assert np.all(colossus.read_tape_contents(TAPE_LENGTH) == zs)
+
+
+def test_changed_prefix_rewritten(colossus, sent_cmds):
+    zs = colossus.punch_random_tape(TAPE_LENGTH)
+    zs[5] ^= 1
+    del sent_cmds[:]
+    colossus.punch_tape(zs)
+    assert sent_cmds == [(28, 0), (29, zs[0])] + [(z,) for z in zs[1:6]]
+    got_zs = colossus.read_tape_contents(TAPE_LENGTH + 1)
+    assert np.all(got_zs == np.append(zs, 0x3f))
+
+
+def test_write_resumes_from_write_ptr(colossus, sent_cmds):
+    zs = np.random.randint(32, size=20)
+    colossus.clear_tape()
+    colossus.punch_tape(zs[:10], append_stop_p=False)
+    # Write pointer is now just after the partial tape, so completing the
+    # tape need not go back to the start.
+    del sent_cmds[:]
+    colossus.punch_tape(zs)
+    assert sent_cmds == [(29, zs[10])] + [(z,) for z in zs[11:]] + [(0x3f,)]
+    got_zs = colossus.read_tape_contents(21)
+    assert np.all(got_zs == np.append(zs, 0x3f))
+
+
+def test_clear_tape_known(colossus, sent_cmds):
+    colossus.clear_tape()
+    del sent_cmds[:]
+    colossus.punch_tape([0xa5] * 10, append_stop_p=False)
+    assert sent_cmds == []
+
+
+def test_raw_write_forgets_tape(colossus, sent_cmds):
+    zs = colossus.punch_random_tape(TAPE_LENGTH)
+    colossus.do_cmds([(28, 0), (29, 0)])
+    del sent_cmds[:]
+    colossus.punch_random_tape(TAPE_LENGTH)
+    assert len(sent_cmds) == TAPE_LENGTH + 2
+    assert np.all(colossus.read_tape_contents(TAPE_LENGTH) == zs)
@@ -0,0 +1,102 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pytest
+import numpy as np
+from colossus import Colossus
+from tracing import (NullTracer, RingBufferTracer, BinaryLogTracer,
+                     read_trace, format_record, Has_Addr, Error)
+
+
+def nibble_add_cmds(n):
+    return [(8, 0x21)] + [((i % 16),) for i in range(1, n)]
+
+
+def test_ring_buffer(tmp_path):
+    dump_path = str(tmp_path / 'trace.bin')
+    tracer = RingBufferTracer(capacity=10, dump_path=dump_path)
+    colossus = Colossus(backend='model', tracer=tracer)
+    colossus.do_cmds(nibble_add_cmds(25))
+
+    records = tracer.records()
+    assert len(records) == 10
+    assert np.all(records['flags'] == 0)
+    assert np.all(records['data'] == np.arange(15, 25) % 16)
+    assert np.all(records['response'] == records['data'])
+    assert np.all(np.diff(records['t_ns'].astype(np.int64)) >= 0)
+
+    assert not os.path.exists(dump_path)
+    with pytest.raises(RuntimeError):
+        colossus.do_cmds([(27, 0x02)])
+    dumped = read_trace(dump_path)
+    assert len(dumped) == 10
+    assert dumped[-1]['flags'] == Has_Addr | Error
+    assert (dumped[-1]['addr'], dumped[-1]['data'], dumped[-1]['response']) == (27, 2, 0x98)
+    assert "1b02 '1' 152" in format_record(dumped[-1])
+
+
+def test_ring_buffer_dumps_on_single_cmd_error(tmp_path):
+    dump_path = str(tmp_path / 'trace.bin')
+    colossus = Colossus(backend='model',
+                        tracer=RingBufferTracer(capacity=10, dump_path=dump_path))
+    with pytest.raises(RuntimeError):
+        colossus.do_cmd(27, 0x02)
+    dumped = read_trace(dump_path)
+    assert (dumped[-1]['addr'], dumped[-1]['data']) == (27, 2)
+
+
+@pytest.mark.parametrize('per_cmd_timing_p', [False, True])
+def test_ring_buffer_many_batches(per_cmd_timing_p):
+    tracer = RingBufferTracer(capacity=50, per_cmd_timing_p=per_cmd_timing_p)
+    colossus = Colossus(backend='model', tracer=tracer)
+    for _ in range(30):
+        colossus.do_cmds(nibble_add_cmds(7))
+    records = tracer.records()
+    assert len(records) == 50
+    assert np.all(records['data'][-7:] == [cmd[-1] for cmd in nibble_add_cmds(7)])
+    assert len(tracer.batches) <= 50 // 7 + 2
+    n_distinct_times = len(np.unique(records['t_ns'][-7:]))
+    if per_cmd_timing_p:
+        assert n_distinct_times > 1
+    else:
+        assert n_distinct_times == 1
+
+
+def test_binary_log_rotation(tmp_path):
+    path = str(tmp_path / 'trace.log')
+    tracer = BinaryLogTracer(path, max_bytes=4096, n_backups=100)
+    colossus = Colossus(backend='model', tracer=tracer)
+    n_cmds = 2000
+    for _ in range(n_cmds // 100):
+        colossus.do_cmds(nibble_add_cmds(100))
+    colossus.close()
+
+    backup_paths = sorted((p for p in os.listdir(str(tmp_path)) if p.endswith('.gz')),
+                          key=lambda p: -int(p.split('.')[-2]))
+    assert len(backup_paths) > 1
+    records = np.concatenate([read_trace(str(tmp_path / p)) for p in backup_paths]
+                             + [read_trace(path)])
+    # Plus initial configuration from Colossus constructor:
+    n_init_cmds = len(records) - n_cmds
+    assert n_init_cmds > 0
+    assert np.all(records['data'][n_init_cmds:] == [cmd[-1] for cmd in nibble_add_cmds(100)] * 20)
+
+
+def test_null_tracer():
+    colossus = Colossus(backend='model', tracer=NullTracer())
+    assert colossus.add_nibbles(3, 4) == 7
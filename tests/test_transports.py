@@ -0,0 +1,136 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import socket
+import sys
+import threading
+import pytest
+import numpy as np
+from colossus import Colossus
+from colossus_model import ColossusModel
+from tracing import RingBufferTracer
+from transports import (ModelTransport, MonitorProcessTransport,
+                        SocketTransport, serve_repl, TESTS_DIR)
+
+
+wire_formats = pytest.mark.parametrize('wire_format', ['text', 'binary'])
+
+
+def exercise(colossus):
+    assert colossus.add_nibbles(3, 4) == 7
+    zs = colossus.punch_random_tape(100)
+    assert np.all(colossus.read_tape_contents(100) == zs)
+    with pytest.raises(RuntimeError, match='error for 1b02'):
+        colossus.do_cmds([(27, 0x02)])
+    assert colossus.add_nibbles(5, 6) == 11
+
+
+def serve_model_on(sock, wire_format):
+    def serve():
+        with sock, sock.makefile('rb') as f_in, sock.makefile('wb') as f_out:
+            serve_repl(ColossusModel().submit, f_in, f_out, wire_format)
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+
+def accept_one_and_serve(listen_sock, wire_format):
+    def serve():
+        with listen_sock:
+            sock, _ = listen_sock.accept()
+        serve_model_on(sock, wire_format).join()
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_model_transport():
+    exercise(Colossus(transport=ModelTransport()))
+
+
+@wire_formats
+def test_socket_transport(wire_format):
+    client_sock, server_sock = socket.socketpair()
+    serve_model_on(server_sock, wire_format)
+    colossus = Colossus(transport=SocketTransport(client_sock, wire_format))
+    exercise(colossus)
+    colossus.close()
+
+
+@wire_formats
+def test_unix_socket_transport(wire_format, tmp_path):
+    path = str(tmp_path / 'colossus.sock')
+    listen_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listen_sock.bind(path)
+    listen_sock.listen(1)
+    accept_one_and_serve(listen_sock, wire_format)
+    colossus = Colossus(transport=SocketTransport.connect_unix(path, wire_format))
+    exercise(colossus)
+    colossus.close()
+
+
+@wire_formats
+def test_tcp_transport(wire_format):
+    listen_sock = socket.create_server(('127.0.0.1', 0))
+    port = listen_sock.getsockname()[1]
+    accept_one_and_serve(listen_sock, wire_format)
+    colossus = Colossus(transport=SocketTransport.connect_tcp('127.0.0.1', port, wire_format))
+    exercise(colossus)
+    colossus.close()
+
+
+@wire_formats
+def test_monitor_processes_side_by_side(wire_format, tmp_path):
+    monitor_cmd = [sys.executable, os.path.join(TESTS_DIR, 'model_monitor.py')]
+    boards = [Colossus(transport=MonitorProcessTransport(
+                  wire_format, monitor_cmd,
+                  cmd_fifo_path=str(tmp_path / ('repl-input-%d' % i))))
+              for i in range(2)]
+    for colossus in boards:
+        exercise(colossus)
+    for colossus in boards:
+        colossus.close()
+
+
+@wire_formats
+def test_stream_transport_traced(wire_format):
+    client_sock, server_sock = socket.socketpair()
+    serve_model_on(server_sock, wire_format)
+    tracer = RingBufferTracer()
+    colossus = Colossus(transport=SocketTransport(client_sock, wire_format), tracer=tracer)
+    n_before = tracer.n_recorded
+    colossus.do_cmds([(8, 0x21)] + [(0x43,)] * 99)
+    records = tracer.records()[n_before:]
+    assert len(records) == 100
+    assert np.all(records['response'][1:] == 7)
+    assert records['flags'][0] == 1
+    colossus.close()
+
+
+def test_text_repl_rejects_malformed_lines():
+    f_in = io.BytesIO(b'0803\n080\n8\n0g\n  08\n08\n')
+    f_out = io.BytesIO()
+    serve_repl(ColossusModel().submit, f_in, f_out, 'text', announce_ready_p=False)
+    lines = f_out.getvalue().decode('ascii').splitlines()
+    assert lines == ["COLOSSUS-RESPONSE: 0803 '0' 3",
+                     'COLOSSUS-RESPONSE: ?',
+                     'COLOSSUS-RESPONSE: ?',
+                     'COLOSSUS-RESPONSE: ?',
+                     'COLOSSUS-RESPONSE: ?',
+                     "COLOSSUS-RESPONSE: 08 '0' 8"]
@@ -0,0 +1,222 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+import wheels
+import wheel_patterns
+import q_panel
+from q_selector import q_stream, counted_q
+from test_q_panel import random_q_panel_cfgs
+
+
+def impulse_1_cross(letters):
+    return (letters & 16) != 0
+
+
+def impulse_2_dot(letters):
+    return (letters & 8) == 0
+
+
+def reference_extended_psi(psi, mu, psi_settings, mu_settings, n_sprockets):
+    """
+    Motor-extended psi letters, found one sprocket at a time by rotating
+    lists as the machine moves its wheels.  PSI_1 (psi[0]) gives the
+    most-significant bit.
+    """
+    psi = [list(wheels.rot_wheel(np.asarray(w), int(n))) for w, n in zip(psi, psi_settings)]
+    mu_61, mu_37 = [list(wheels.rot_wheel(np.asarray(w), int(n)))
+                    for w, n in zip(mu, mu_settings)]
+    letters = []
+    for _ in range(n_sprockets):
+        letters.append(sum(w[0] << (4 - i) for i, w in enumerate(psi)))
+        if mu_37[0]:
+            psi = [w[1:] + w[:1] for w in psi]
+        if mu_61[0]:
+            mu_37 = mu_37[1:] + mu_37[:1]
+        mu_61 = mu_61[1:] + mu_61[:1]
+    return np.array(letters, dtype=np.uint8)
+
+
+@pytest.fixture
+def ciphertext():
+    np.random.seed(42)
+    return np.random.randint(32, size=2000).astype(np.uint8)
+
+
+@pytest.mark.parametrize('delta_p', [False, True])
+@pytest.mark.parametrize('wheel_idxs', [[0], [1, 4], [3, 0]])
+def test_count_grid(ciphertext, wheel_idxs, delta_p):
+    statistic = impulse_1_cross if 0 in wheel_idxs else impulse_2_dot
+    step_counts = [3, 1, 4, 1, 5]
+    got_counts = wheels.count_grid(ciphertext, wheel_patterns.chi, wheel_idxs,
+                                   statistic, delta_p, step_counts)
+    assert got_counts.shape == tuple(wheel_patterns.chi[i].size for i in wheel_idxs)
+
+    np.random.seed(99)
+    for _ in range(10):
+        settings = [np.random.randint(wheel_patterns.chi[i].size) for i in wheel_idxs]
+        for i, s in zip(wheel_idxs, settings):
+            step_counts[i] = s
+        de_chi = ciphertext ^ wheels.Chi(wheel_patterns.chi, step_counts).letters(ciphertext.size)
+        if delta_p:
+            de_chi = de_chi[1:] ^ de_chi[:-1]
+        assert got_counts[tuple(settings)] == np.sum(statistic(de_chi))
+
+
+@pytest.mark.parametrize('delta_p', [False, True])
+@pytest.mark.parametrize('target', [0, 1])
+@pytest.mark.parametrize('wheel_idxs', [[0], [2, 3]])
+def test_rotation_counts(ciphertext, wheel_idxs, delta_p, target):
+    # Impulse 3 XOR impulse 4 of the tape:
+    impulses = ((ciphertext >> 2) ^ (ciphertext >> 1)) & 1
+    wheel_patterns_used = [wheel_patterns.chi[i] for i in wheel_idxs]
+    got_counts = wheels.rotation_counts(impulses, wheel_patterns_used, delta_p, target)
+    assert got_counts.shape == tuple(w.size for w in wheel_patterns_used)
+
+    np.random.seed(99)
+    for _ in range(10):
+        settings = [np.random.randint(w.size) for w in wheel_patterns_used]
+        key = np.zeros_like(impulses)
+        for w, s in zip(wheel_patterns_used, settings):
+            key ^= wheels.impulse_stream_from_wheel(wheels.rot_wheel(w, s), impulses.size)
+        x = impulses ^ key
+        if delta_p:
+            x = x[1:] ^ x[:-1]
+        assert got_counts[tuple(settings)] == np.sum(x == target)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 61, 1000, 5000])
+def test_letter_chunks(chunk_size):
+    n_sprockets = 4321
+    chi = wheels.Chi(wheel_patterns.chi, [2, 5, 10, 10, 7])
+    psi_and_mu = wheels.PsiAndMu(wheel_patterns.psi, wheel_patterns.mu,
+                                 [1, 2, 3, 4, 5, 6, 7])
+    for generator in [chi, psi_and_mu]:
+        chunks = [chunk.copy() for chunk in generator.letter_chunks(n_sprockets, chunk_size)]
+        assert all(chunk.size == chunk_size for chunk in chunks[:-1])
+        assert np.all(np.concatenate(chunks) == generator.letters(n_sprockets))
+
+
+def test_letter_chunks_reuse_buffer():
+    chi = wheels.Chi(wheel_patterns.chi, [0] * 5)
+    chunks = list(chi.letter_chunks(300, 100))
+    assert len(chunks) == 3
+    assert all(np.shares_memory(chunks[0], chunk) for chunk in chunks[1:])
+
+
+def test_extended_psi_against_reference():
+    psi_settings = [3, 1, 4, 1, 5]
+    mu_settings = np.stack(np.meshgrid([0, 7, 60], [0, 20, 36], indexing='ij'), axis=-1)
+    n_sprockets = 300
+    got_psi = wheels.extended_psi_letters(wheel_patterns.psi, wheel_patterns.mu,
+                                          psi_settings, mu_settings, n_sprockets)
+    assert got_psi.shape == (3, 3, n_sprockets)
+    for idxs in np.ndindex(3, 3):
+        exp_psi = reference_extended_psi(wheel_patterns.psi, wheel_patterns.mu,
+                                         psi_settings, mu_settings[idxs], n_sprockets)
+        assert np.all(got_psi[idxs] == exp_psi)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 64, 1000])
+def test_psi_letter_chunks_against_reference(chunk_size):
+    step_counts = [1, 2, 3, 4, 5, 6, 7]
+    n_sprockets = 500
+    psi_and_mu = wheels.PsiAndMu(wheel_patterns.psi, wheel_patterns.mu, step_counts)
+    got_psi = np.concatenate([chunk.copy() for chunk
+                              in psi_and_mu.letter_chunks(n_sprockets, chunk_size)])
+    exp_psi = reference_extended_psi(wheel_patterns.psi, wheel_patterns.mu,
+                                     step_counts[:5], step_counts[5:], n_sprockets)
+    assert np.all(got_psi == exp_psi)
+
+
+def test_key_letters_batch():
+    np.random.seed(7)
+    n_sprockets = 500
+    step_counts = np.stack([np.random.randint(len(w), size=(4, 3))
+                            for w in (wheel_patterns.chi + wheel_patterns.psi
+                                      + wheel_patterns.mu)], axis=-1)
+    got_key = wheels.key_letters(wheel_patterns.chi, wheel_patterns.psi, wheel_patterns.mu,
+                                 step_counts, n_sprockets)
+    assert got_key.shape == (4, 3, n_sprockets)
+    for idxs in np.ndindex(4, 3):
+        sc = step_counts[idxs]
+        chi_key = wheels.Chi(wheel_patterns.chi, sc[:5]).letters(n_sprockets)
+        psi_key = reference_extended_psi(wheel_patterns.psi, wheel_patterns.mu,
+                                         sc[5:10], sc[10:], n_sprockets)
+        assert np.all(got_key[idxs] == chi_key ^ psi_key)
+
+
+
+def random_step_counts(n_settings):
+    return np.stack([np.random.randint(len(w), size=n_settings)
+                     for w in (wheel_patterns.chi + wheel_patterns.psi
+                               + wheel_patterns.mu)], axis=-1)
+
+
+@pytest.mark.parametrize('q_selector_cfg', [0x20, 0x30, 0x28, 0x2c, 0x2a, 0x3f, 0x0b])
+@pytest.mark.parametrize('q_panel_seed', [0, 1, 2])
+def test_bit_sliced_counter(ciphertext, q_selector_cfg, q_panel_seed):
+    np.random.seed(q_panel_seed)
+    step_counts = random_step_counts(40)
+    run_length = 1500
+    q_panel_cfgs = random_q_panel_cfgs(q_panel_seed)
+    counter = wheels.BitSlicedCounter(ciphertext, wheel_patterns.chi, wheel_patterns.psi,
+                                      wheel_patterns.mu, q_selector_cfg, *q_panel_cfgs,
+                                      run_length=run_length)
+    got_counts = counter.counts(step_counts, chunk_size=16)
+
+    key = wheels.key_letters(wheel_patterns.chi, wheel_patterns.psi, wheel_patterns.mu,
+                             step_counts, run_length)
+    chi = wheels.chi_letters(wheel_patterns.chi, step_counts[:, :5], run_length)
+    q = q_stream(q_selector_cfg, ciphertext[:run_length], chi, key ^ chi)
+    exp_counts = q_panel.counter_totals(q_panel.compile_q_panel(*q_panel_cfgs),
+                                        counted_q(q_selector_cfg, q))
+    assert np.all(got_counts == exp_counts)
+
+
+def test_bit_sliced_counter_vs_colossus(colossus, ciphertext):
+    tape_length = 400
+    colossus.punch_tape(ciphertext[:tape_length])
+    colossus.load_all_wheels(wheel_patterns.chi, wheel_patterns.psi, wheel_patterns.mu)
+
+    q_selector_cfg = 0x2e
+    top_cfgs, bottom_cfgs, negating_cfg = random_q_panel_cfgs(7)
+    colossus.set_q_selector_cfg(q_selector_cfg)
+    colossus.reset_q_panel_cfg()
+    for i, cfg in enumerate(top_cfgs):
+        colossus.set_q_panel_top_unit_cfg(i, cfg)
+    for i, cfg in enumerate(bottom_cfgs):
+        colossus.set_q_panel_bottom_unit_cfg(i, cfg)
+    colossus.set_q_panel_negating_cfg(negating_cfg)
+
+    counter = wheels.BitSlicedCounter(ciphertext[:tape_length], wheel_patterns.chi,
+                                      wheel_patterns.psi, wheel_patterns.mu,
+                                      q_selector_cfg, top_cfgs, bottom_cfgs, negating_cfg)
+    np.random.seed(11)
+    step_counts = random_step_counts(3)
+    exp_counts = counter.counts(step_counts)
+
+    for settings, exp_settings_counts in zip(step_counts, exp_counts):
+        colossus.reset_all_stepping()
+        for i, setting in enumerate(settings):
+            colossus.set_cam_wheel_stepping(i, int(setting))
+        colossus.reset_movement()
+        colossus.run_tape_once()
+        colossus.snapshot_counters()
+        assert np.all(colossus.read_all_counters() == exp_settings_counts)
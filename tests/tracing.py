@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+# Recording of the command/response traffic with a board, for post-mortem
+# examination.  A tracer is given batches of commands with their responses
+# and timings; there are three kinds:
+#
+#     NullTracer --- records nothing
+#     RingBufferTracer --- keeps the most recent records in memory, and
+#                          dumps them to a file on error
+#     BinaryLogTracer --- appends all records to a log file, from a
+#                         background thread, rotating and compressing
+#                         the log as it grows
+#
+# Trace files hold a magic header followed by records of Record_Dtype;
+# read them with read_trace(), or print one with 'python tracing.py FILE'.
+
+from collections import deque
+import gzip
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+
+
+Magic = b'COLTRC01'
+
+Record_Dtype = np.dtype([('t_ns', '<u8'),          # when command sent
+                         ('latency_ns', '<u4'),    # until response received
+                         ('flags', 'u1'),          # Has_Addr and Error bits
+                         ('addr', 'u1'),
+                         ('data', 'u1'),
+                         ('response', 'u1')])
+
+Has_Addr = 0x01
+Error = 0x02
+
+
+def now_ns():
+    return time.perf_counter_ns()
+
+
+def make_records(cmds, error_p, response_bytes, t_sent_ns, t_recv_ns):
+    """
+    Record array for the given commands, (addr, data) or (data,) tuples, and
+    their responses.  The times may be scalars or per-command arrays.
+    """
+    n = len(response_bytes)
+    records = np.zeros(n, dtype=Record_Dtype)
+    has_addr = np.fromiter((len(cmd) == 2 for cmd in cmds[:n]), dtype=bool, count=n)
+    records['flags'] = has_addr * Has_Addr | np.asarray(error_p, dtype=bool) * Error
+    records['addr'] = [cmd[0] if len(cmd) == 2 else 0 for cmd in cmds[:n]]
+    records['data'] = [cmd[-1] for cmd in cmds[:n]]
+    records['response'] = response_bytes
+    records['t_ns'] = t_sent_ns
+    records['latency_ns'] = np.minimum(np.asarray(t_recv_ns) - np.asarray(t_sent_ns),
+                                       np.iinfo(np.uint32).max)
+    return records
+
+
+class NullTracer:
+    enabled_p = False
+
+    # Whether the transport should time each command individually, rather
+    # than just each batch, which is cheaper.
+    per_cmd_timing_p = False
+
+    def record(self, cmds, error_p, response_bytes, t_sent_ns, t_recv_ns):
+        pass
+
+    def on_error(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RingBufferTracer(NullTracer):
+    """
+    Keep (at least) the most recent 'capacity' records.  On error, write
+    them to 'dump_path' (default /tmp/colossus-trace-PID.bin).
+
+    Recording only keeps a reference to each batch; records are built when
+    asked for.  By default, every command of a batch through the model
+    transport is stamped with the batch's start time and latency.
+    """
+    enabled_p = True
+
+    def __init__(self, capacity=65536, dump_path=None, per_cmd_timing_p=False):
+        self.capacity = capacity
+        self.per_cmd_timing_p = per_cmd_timing_p
+        self.batches = deque()
+        self.n_held = 0
+        self.n_recorded = 0
+        self.dump_path = (dump_path if dump_path is not None
+                          else '/tmp/colossus-trace-%d.bin' % os.getpid())
+
+    def record(self, cmds, error_p, response_bytes, t_sent_ns, t_recv_ns):
+        n = len(response_bytes)
+        self.batches.append((cmds, error_p, response_bytes, t_sent_ns, t_recv_ns))
+        self.n_held += n
+        self.n_recorded += n
+        while self.n_held - len(self.batches[0][2]) >= self.capacity:
+            self.n_held -= len(self.batches.popleft()[2])
+
+    def records(self):
+        """
+        The most recent 'capacity' records, oldest first.
+        """
+        if not self.batches:
+            return np.zeros(0, dtype=Record_Dtype)
+        records = np.concatenate([make_records(*batch) for batch in self.batches])
+        return records[-self.capacity:]
+
+    def dump(self, path=None):
+        path = path if path is not None else self.dump_path
+        with open(path, 'wb') as f_out:
+            f_out.write(Magic)
+            f_out.write(self.records().tobytes())
+        return path
+
+    def on_error(self):
+        self.dump()
+
+
+class BinaryLogTracer(NullTracer):
+    """
+    Append all records to the log file 'path', from a background thread.
+    When the log exceeds 'max_bytes', it is rotated to 'path.1.gz', the
+    previous 'path.1.gz' to 'path.2.gz', and so on, keeping 'n_backups'.
+    """
+    enabled_p = True
+
+    def __init__(self, path, max_bytes=64 << 20, n_backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.n_backups = n_backups
+        self.queue = queue.Queue()
+        self.f_log = self._open_log()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def record(self, cmds, error_p, response_bytes, t_sent_ns, t_recv_ns):
+        # Building the records is left to the writer thread.
+        self.queue.put((list(cmds), np.array(error_p), np.array(response_bytes),
+                        t_sent_ns, t_recv_ns))
+
+    def on_error(self):
+        self.flush()
+
+    def flush(self):
+        """
+        Wait until everything recorded so far is in the log file.
+        """
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.f_log.close()
+
+    def _open_log(self):
+        f_log = open(self.path, 'wb')
+        f_log.write(Magic)
+        return f_log
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.f_log.write(make_records(*item).tobytes())
+                self.f_log.flush()
+                if self.f_log.tell() >= self.max_bytes:
+                    self._rotate()
+            finally:
+                self.queue.task_done()
+
+    def _rotate(self):
+        self.f_log.close()
+        backup_path = lambda i: '%s.%d.gz' % (self.path, i)
+        for i in range(self.n_backups - 1, 0, -1):
+            if os.path.exists(backup_path(i)):
+                os.replace(backup_path(i), backup_path(i + 1))
+        if self.n_backups > 0:
+            with open(self.path, 'rb') as f_in, gzip.open(backup_path(1), 'wb') as f_out:
+                f_out.write(f_in.read())
+        self.f_log = self._open_log()
+
+
+def read_trace(path):
+    """
+    Record array from a trace file, compressed or not.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f_in:
+        contents = f_in.read()
+    if not contents.startswith(Magic):
+        raise ValueError('%s is not a trace file' % path)
+    return np.frombuffer(contents[len(Magic):], dtype=Record_Dtype)
+
+
+def format_record(record):
+    cmd = ('%02x%02x' % (record['addr'], record['data'])
+           if record['flags'] & Has_Addr
+           else '%02x' % record['data'])
+    return ("%14.6f %-4s '%d' %3d  %8.1fus"
+            % (record['t_ns'] * 1e-9, cmd, bool(record['flags'] & Error),
+               record['response'], record['latency_ns'] * 1e-3))
+
+
+if __name__ == '__main__':
+    for record in read_trace(sys.argv[1]):
+        print(format_record(record))
@@ -0,0 +1,411 @@
+# Copyright 2016 Ben North
+#
+# This file is part of "FPGA Colossus".
+#
+# "FPGA Colossus" is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# "FPGA Colossus" is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+import numpy as np
+import subprocess
+import socket
+import os
+import re
+import threading
+from colossus_model import ColossusModel
+from tracing import NullTracer, now_ns
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class ColossusResponse(namedtuple('ColossusResponse',
+                                  ['cmd', 'error_p', 'response_byte'])):
+    @classmethod
+    def from_cmd_response(cls, cmd, line):
+        s_cmd_echo, s_error_p, s_response_byte = line.rstrip().split()
+        if len(s_cmd_echo) == 2:
+            cmd_echo = (int(s_cmd_echo, 16),)
+        elif len(s_cmd_echo) == 4:
+            cmd_echo = (int(s_cmd_echo[:2], 16), int(s_cmd_echo[2:], 16))
+        else:
+            raise ValueError('expected echo to be of length 2 or 4')
+        if cmd_echo != cmd:
+            raise ValueError('expected echo to match given cmd')
+        if s_error_p == "'0'":
+            error_p = False
+        elif s_error_p == "'1'":
+            error_p = True
+        else:
+            raise ValueError("expected error-p to be '0' or '1'")
+        response_byte = int(s_response_byte)
+        return cls(cmd, error_p, response_byte)
+
+    @property
+    def cmd_str(self):
+        return ''.join('%02x' % x for x in self.cmd)
+
+
+class BinaryFrame:
+    """
+    Fixed-size frames of the optional binary wire format (see main() in
+    rpi-client/client.cpp).  A command frame is (flags, addr, data, 0); its
+    response frame echoes the flags, addr and data, with the error bit set
+    in the flags as appropriate, and carries the response byte in place of
+    the final zero.  For a data-only command, the 'addr' octet is zero.
+    """
+    N_Octets = 4
+    Has_Addr = 0x01
+    Error = 0x02
+    Invalid = 0x80
+
+    Command_Dtype = np.dtype([('flags', 'u1'), ('addr', 'u1'),
+                              ('data', 'u1'), ('reserved', 'u1')])
+    Response_Dtype = np.dtype([('flags', 'u1'), ('addr', 'u1'),
+                               ('data', 'u1'), ('response', 'u1')])
+
+    @classmethod
+    def command_frames(cls, cmds):
+        return np.array([(cls.Has_Addr, cmd[0], cmd[1], 0) if len(cmd) == 2
+                         else (0, 0, cmd[0], 0)
+                         for cmd in cmds],
+                        dtype=cls.Command_Dtype)
+
+    @classmethod
+    def decode_responses(cls, raw_frames, cmd_frames):
+        frames = np.frombuffer(raw_frames, dtype=cls.Response_Dtype)
+        if np.any(frames['flags'] & cls.Invalid):
+            raise ValueError('monitor rejected command frame')
+        if (np.any((frames['flags'] & cls.Has_Addr) != cmd_frames['flags'])
+            or np.any(frames['addr'] != cmd_frames['addr'])
+            or np.any(frames['data'] != cmd_frames['data'])):
+            #
+            raise ValueError('expected echo to match given cmd')
+        return (frames['flags'] & cls.Error) != 0, frames['response']
+
+
+def cmd_str(cmd_tup):
+    return ''.join('%02x' % x for x in cmd_tup)
+
+
+class Transport:
+    """
+    Means of submitting commands to one board, or a model of one.  Each
+    Colossus owns one transport.  If 'shared_p', other clients may also be
+    using the board, and only commands between begin_transaction() and
+    end_transaction() are guaranteed not to be interleaved with theirs.
+    All traffic is given to 'tracer' (see tracing.py).
+    """
+
+    shared_p = False
+    tracer = NullTracer()
+
+    def submit_cmds(self, cmds, max_n_in_flight):
+        """
+        Send all of the given commands, each an (addr, data) or (data,)
+        tuple, keeping up to 'max_n_in_flight' of them outstanding at once,
+        and return (error_p, response_bytes) arrays.  After a command fails,
+        no further commands are sent, but any already in flight are waited
+        for; the returned arrays stop there.
+        """
+        raise NotImplementedError
+
+    def begin_transaction(self):
+        pass
+
+    def end_transaction(self):
+        pass
+
+    def close(self):
+        self.tracer.close()
+
+
+class ModelTransport(Transport):
+    """
+    In-process transport to a ColossusModel; there is no wire format.
+    """
+
+    def __init__(self, model=None):
+        self.model = model if model is not None else ColossusModel()
+
+    def submit_cmds(self, cmds, max_n_in_flight):
+        n_cmds = len(cmds)
+        error_p = np.zeros(n_cmds, dtype=bool)
+        response_bytes = np.zeros(n_cmds, dtype=np.uint8)
+        tracer_p = self.tracer.enabled_p
+        per_cmd_timing_p = tracer_p and self.tracer.per_cmd_timing_p
+        t_ns = np.zeros(n_cmds + 1, dtype=np.uint64)
+        if tracer_p:
+            t_ns[0] = now_ns()
+        n_done = n_cmds
+        for idx, cmd in enumerate(cmds):
+            if per_cmd_timing_p:
+                t_ns[idx] = now_ns()
+            error_p[idx], response_bytes[idx] = self.model.submit(*cmd)
+            if error_p[idx]:
+                n_done = idx + 1
+                break
+        if per_cmd_timing_p:
+            t_ns[n_done] = now_ns()
+            self.tracer.record(cmds[:n_done], error_p[:n_done], response_bytes[:n_done],
+                               t_ns[:n_done], t_ns[1:n_done + 1])
+        elif tracer_p:
+            self.tracer.record(cmds[:n_done], error_p[:n_done], response_bytes[:n_done],
+                               t_ns[0], now_ns())
+        return error_p[:n_done], response_bytes[:n_done]
+
+
+class StreamTransport(Transport):
+    """
+    Transport speaking the monitor's wire format (text, or the binary
+    frames of BinaryFrame) over a byte stream.  Subclasses provide
+    _write(payload) and the binary file object 'f_resp', and call
+    _await_ready() once connected.
+    """
+
+    Ready_Line_Start = b'READY-FOR-INPUT'
+
+    def __init__(self, wire_format='text'):
+        if wire_format not in ('text', 'binary'):
+            raise ValueError('wire_format must be "text" or "binary"')
+        self.binary_p = (wire_format == 'binary')
+
+    def _await_ready(self):
+        while True:
+            line = self.f_resp.readline()
+            if not line:
+                raise RuntimeError('monitor exited before becoming ready')
+            if line.startswith(self.Ready_Line_Start):
+                break
+
+    def _encode_cmds(self, cmds):
+        if self.binary_p:
+            return BinaryFrame.command_frames(cmds)
+        return [cmd_str(cmd) + '\n' for cmd in cmds]
+
+    def _send_encoded_cmds(self, encoded_cmds):
+        payload = (encoded_cmds.tobytes() if self.binary_p
+                   else ''.join(encoded_cmds).encode('ascii'))
+        self._write(payload)
+
+    def _monitor_exited(self, cmd_tup):
+        self.tracer.on_error()
+        return RuntimeError('monitor exited while awaiting response to %s'
+                            % cmd_str(cmd_tup))
+
+    def _recv_text_response(self, cmd_tup):
+        while True:
+            m_resp_line = self.f_resp.readline()
+            if not m_resp_line:
+                raise self._monitor_exited(cmd_tup)
+            m_resp_match = re.match('^COLOSSUS-RESPONSE: (.*)',
+                                    m_resp_line.decode('ascii', 'replace'))
+            if m_resp_match:
+                return ColossusResponse.from_cmd_response(
+                    cmd_tup, m_resp_match.group(1))
+
+    def _recv_responses(self, cmds, encoded_cmds):
+        """
+        Return (error_p, response_bytes) arrays for the responses to the
+        given commands, which must be the oldest ones in flight.
+        """
+        if self.binary_p:
+            n_octets = len(cmds) * BinaryFrame.N_Octets
+            raw_frames = self.f_resp.read(n_octets)
+            if len(raw_frames) != n_octets:
+                raise self._monitor_exited(cmds[len(raw_frames) // BinaryFrame.N_Octets])
+            return BinaryFrame.decode_responses(raw_frames, encoded_cmds)
+        responses = [self._recv_text_response(cmd) for cmd in cmds]
+        return (np.array([r.error_p for r in responses], dtype=bool),
+                np.array([r.response_byte for r in responses], dtype=np.uint8))
+
+    def stream_cmds(self, cmds):
+        """
+        Send all of 'cmds' without waiting for any response, collecting
+        the responses meanwhile, and return (error_p, response_bytes)
+        arrays covering every command.  Unlike submit_cmds(), commands
+        after a failing one are still sent.  An exception raised while
+        sending is re-raised here.
+        """
+        encoded_cmds = self._encode_cmds(cmds)
+        send_failures = []
+
+        def send_all():
+            try:
+                self._send_encoded_cmds(encoded_cmds)
+            except BaseException as e:
+                send_failures.append(e)
+
+        sender = threading.Thread(target=send_all)
+        sender.start()
+        try:
+            return self._recv_responses(cmds, encoded_cmds)
+        finally:
+            sender.join()
+            if send_failures:
+                raise send_failures[0]
+
+    def submit_cmds(self, cmds, max_n_in_flight):
+        encoded_cmds = self._encode_cmds(cmds)
+        n_cmds = len(cmds)
+        error_p = np.zeros(n_cmds, dtype=bool)
+        response_bytes = np.zeros(n_cmds, dtype=np.uint8)
+        tracer_p = self.tracer.enabled_p
+        t_sent_ns = np.zeros(n_cmds, dtype=np.uint64)
+        n_sent = n_done = 0
+        n_to_send = n_cmds
+        while n_done < n_sent or n_sent < n_to_send:
+            n_sent_tgt = min(n_to_send, n_done + max_n_in_flight)
+            if n_sent < n_sent_tgt:
+                if tracer_p:
+                    t_sent_ns[n_sent:n_sent_tgt] = now_ns()
+                self._send_encoded_cmds(encoded_cmds[n_sent:n_sent_tgt])
+                n_sent = n_sent_tgt
+            # Collect half of what is in flight, so the pipeline never drains
+            # while we decode:
+            n_done_tgt = n_done + max(1, (n_sent - n_done) // 2)
+            chunk_error_p, chunk_response_bytes = self._recv_responses(
+                cmds[n_done:n_done_tgt], encoded_cmds[n_done:n_done_tgt])
+            error_p[n_done:n_done_tgt] = chunk_error_p
+            response_bytes[n_done:n_done_tgt] = chunk_response_bytes
+            if tracer_p:
+                self.tracer.record(cmds[n_done:n_done_tgt], chunk_error_p,
+                                   chunk_response_bytes,
+                                   t_sent_ns[n_done:n_done_tgt], now_ns())
+            n_done = n_done_tgt
+            if np.any(chunk_error_p):
+                n_to_send = n_sent
+        return error_p[:n_done], response_bytes[:n_done]
+
+
+class MonitorProcessTransport(StreamTransport):
+    """
+    Spawn a monitor process (by default monitor-repl.sh, i.e., the ISE
+    simulator, or rpi-client on the Raspberry Pi), sending it commands via
+    the FIFO 'cmd_fifo_path' and reading responses from its stdout.  The
+    FIFO is created if it does not exist.  Only rpi-client can be told to
+    use a FIFO other than the default.
+    """
+
+    Default_Cmd_FIFO_Path = '/tmp/repl-input'
+
+    def __init__(self, wire_format='text',
+                 monitor_cmd=None,
+                 cmd_fifo_path=Default_Cmd_FIFO_Path):
+        super().__init__(wire_format)
+        if monitor_cmd is None:
+            monitor_cmd = [os.path.join(TESTS_DIR, 'monitor-repl.sh')]
+        monitor_args = ['--binary'] if self.binary_p else []
+        if cmd_fifo_path != self.Default_Cmd_FIFO_Path:
+            monitor_args += ['--input', cmd_fifo_path]
+        if not os.path.exists(cmd_fifo_path):
+            os.mkfifo(cmd_fifo_path)
+        self.monitor_process = subprocess.Popen(list(monitor_cmd) + monitor_args,
+                                                stdout=subprocess.PIPE,
+                                                cwd=TESTS_DIR)
+        self.f_cmd = open(cmd_fifo_path, 'wb')
+        self.f_resp = self.monitor_process.stdout
+        self._await_ready()
+
+    def _write(self, payload):
+        self.f_cmd.write(payload)
+        self.f_cmd.flush()
+
+    def close(self):
+        self.f_cmd.close()
+        self.monitor_process.wait()
+        super().close()
+
+
+class SocketTransport(StreamTransport):
+    """
+    Talk to a monitor (e.g., a board server) over a connected stream
+    socket.  The far end announces READY-FOR-INPUT as rpi-client does, and
+    must have been set up for the same wire format.
+    """
+
+    def __init__(self, sock, wire_format='text'):
+        super().__init__(wire_format)
+        self.sock = sock
+        self.f_resp = sock.makefile('rb')
+        self._await_ready()
+
+    @classmethod
+    def connect_unix(cls, path, wire_format='text', **kwargs):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return cls(sock, wire_format, **kwargs)
+
+    @classmethod
+    def connect_tcp(cls, host, port, wire_format='text', **kwargs):
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(sock, wire_format, **kwargs)
+
+    def _write(self, payload):
+        self.sock.sendall(payload)
+
+    def close(self):
+        self.f_resp.close()
+        self.sock.close()
+        super().close()
+
+
+def serve_repl(submit, f_in, f_out, wire_format='text', announce_ready_p=True):
+    """
+    Act as a monitor, in the manner of rpi-client: announce READY-FOR-INPUT
+    on the binary file 'f_out' (unless told not to), then answer each
+    command read from 'f_in' until end of input.  The callable
+    'submit(addr_or_data, data=None)' carries out one command, returning
+    (error_p, response_byte).
+    """
+    if announce_ready_p:
+        f_out.write(b'READY-FOR-INPUT\n')
+        f_out.flush()
+    if wire_format == 'binary':
+        _serve_binary_repl(submit, f_in, f_out)
+    else:
+        _serve_text_repl(submit, f_in, f_out)
+
+
+def _serve_text_repl(submit, f_in, f_out):
+    for cmd_line in f_in:
+        cmd_line = cmd_line.rstrip(b'\r\n').decode('ascii', 'replace')
+        response = 'COLOSSUS-RESPONSE: '
+        # As rpi-client, accept only 'dd' or 'aadd' hex command lines.
+        if re.fullmatch('[0-9a-fA-F]{2}|[0-9a-fA-F]{4}', cmd_line):
+            cmd = tuple(int(cmd_line[i:i+2], 16) for i in range(0, len(cmd_line), 2))
+            error_p, response_byte = submit(*cmd)
+            response += "%s '%d' %d\n" % (cmd_line, int(error_p), response_byte)
+        else:
+            response += '?\n'
+        f_out.write(response.encode('ascii'))
+        f_out.flush()
+
+
+def _serve_binary_repl(submit, f_in, f_out):
+    while True:
+        frame = f_in.read(BinaryFrame.N_Octets)
+        if len(frame) < BinaryFrame.N_Octets:
+            break
+        flags, addr, data, _ = frame
+        response_byte = 0
+        if flags & ~BinaryFrame.Has_Addr:
+            flags = BinaryFrame.Invalid
+        else:
+            cmd = (addr, data) if flags & BinaryFrame.Has_Addr else (data,)
+            error_p, response_byte = submit(*cmd)
+            if error_p:
+                flags |= BinaryFrame.Error
+        f_out.write(bytes([flags, addr, data, response_byte]))
+        f_out.flush()
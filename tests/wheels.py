@@ -15,8 +15,12 @@
 # You should have received a copy of the GNU General Public License along with
 # "FPGA Colossus".  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import namedtuple
 import numpy as np
 
+from q_selector import q_stream, stream_cfg, first_counted_idx
+from q_panel import registers_from_cfgs, N_COUNTERS
+
 def letter_from_impulses(impulses):
     return (16 * impulses[0]
             + 8 * impulses[1]
@@ -38,6 +42,120 @@ def rot_wheel(w, n):
     return np.concatenate([w[n:], w[:n]])
 
 
+def _cams(w, positions, out=None):
+    """
+    Elements of the pattern W at POSITIONS, cyclically.  POSITIONS, an
+    int64 array, is reduced modulo the length of W in place.
+    """
+    w = np.asarray(w, dtype=np.uint8)
+    np.remainder(positions, w.size, out=positions)
+    return np.take(w, positions, mode='clip', out=out)
+
+
+def _exclusive_cumsum(bits, out=None):
+    """
+    Running totals of BITS along the last axis, starting from zero, with
+    one more element than BITS; the last element is the grand total.
+    """
+    if out is None:
+        out = np.empty(bits.shape[:-1] + (bits.shape[-1] + 1,), dtype=np.int64)
+    out[..., 0] = 0
+    np.cumsum(bits, axis=-1, out=out[..., 1:])
+    return out
+
+
+def letter_from_wheels(ws, settings, offsets, out=None):
+    """
+    Letters formed by the five wheels WS, the first giving the
+    most-significant bit, where wheel i is at position SETTINGS[..., i] +
+    OFFSETS at each sprocket.  SETTINGS has shape (..., 5), and OFFSETS
+    (which has the sprocket axis last) must broadcast against
+    SETTINGS[..., :1].  The letters are written to OUT if given.
+    """
+    settings = np.asarray(settings, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    shape = np.broadcast_shapes(settings.shape[:-1] + (1,), offsets.shape)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    positions = np.empty(shape, dtype=np.int64)
+    bits = np.empty(shape, dtype=np.uint8)
+    out[...] = 0
+    for i, w in enumerate(ws):
+        np.add(settings[..., i, None], offsets, out=positions)
+        _cams(w, positions, out=bits)
+        np.left_shift(bits, 4 - i, out=bits)
+        np.bitwise_or(out, bits, out=out)
+    return out
+
+
+def chi_letters(chi, chi_settings, n_sprockets):
+    """
+    Chi letters over N_SPROCKETS sprockets for each of a batch of settings
+    CHI_SETTINGS, of shape (..., 5).  Result has shape (..., N_SPROCKETS).
+    """
+    return letter_from_wheels(chi, chi_settings, np.arange(n_sprockets))
+
+
+MotorOffsets = namedtuple('MotorOffsets', 'mu_37 psi')
+
+
+def motor_offsets(mu, mu_settings, n_sprockets, out=None):
+    """
+    How far the mu-37 wheel and the psi wheels have moved before each of
+    N_SPROCKETS sprockets, for each of a batch of MU_SETTINGS, of shape
+    (..., 2).  The mu-61 wheel moves every sprocket; the mu-37 wheel moves
+    when the mu-61 wheel shows a cross; and the psi wheels move when the
+    mu-37 wheel shows a cross.  Each field of the result has shape (...,
+    N_SPROCKETS + 1), the last element being the total movement over the
+    whole run.  The offsets are written to OUT, a MotorOffsets, if given.
+    """
+    mu_settings = np.asarray(mu_settings, dtype=np.int64)
+    if out is None:
+        shape = mu_settings.shape[:-1] + (n_sprockets + 1,)
+        out = MotorOffsets(np.empty(shape, dtype=np.int64), np.empty(shape, dtype=np.int64))
+    sprocket_idxs = np.arange(n_sprockets, dtype=np.int64)
+    mu_61_bits = _cams(mu[0], mu_settings[..., 0, None] + sprocket_idxs)
+    _exclusive_cumsum(mu_61_bits, out=out.mu_37)
+    mu_37_bits = _cams(mu[1], mu_settings[..., 1, None] + out.mu_37[..., :-1])
+    _exclusive_cumsum(mu_37_bits, out=out.psi)
+    return out
+
+
+def extended_psi_letters(psi, mu, psi_settings, mu_settings, n_sprockets):
+    """
+    Motor-extended psi letters over N_SPROCKETS sprockets.  PSI_SETTINGS,
+    of shape (..., 5), and MU_SETTINGS, of shape (..., 2), are broadcast
+    against each other, so (for example) one psi setting can be combined
+    with a whole grid of mu settings.
+    """
+    psi_settings = np.asarray(psi_settings, dtype=np.int64)
+    psi_offsets = motor_offsets(mu, mu_settings, n_sprockets).psi[..., :-1]
+    return letter_from_wheels(psi, psi_settings, psi_offsets)
+
+
+def key_letters(chi, psi, mu, step_counts, n_sprockets):
+    """
+    Key (chi XOR extended psi) letters over N_SPROCKETS sprockets, for
+    each of a batch of 12-wheel STEP_COUNTS, of shape (..., 12), ordered
+    as on the machine: five chi, five psi, mu-61, mu-37.
+    """
+    step_counts = np.asarray(step_counts, dtype=np.int64)
+    return (chi_letters(chi, step_counts[..., :5], n_sprockets)
+            ^ extended_psi_letters(psi, mu, step_counts[..., 5:10],
+                                   step_counts[..., 10:12], n_sprockets))
+
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+def _chunk_lengths(n_sprockets, chunk_size):
+    "Lengths of the successive chunks of at most CHUNK_SIZE making up N_SPROCKETS."
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be positive')
+    return [min(chunk_size, n_sprockets - idx0)
+            for idx0 in range(0, n_sprockets, chunk_size)]
+
+
 class Chi:
     def __init__(self, chi, step_counts):
         "STEP_COUNTS --- list of values used as the wheels' settings."
@@ -47,6 +165,22 @@ class Chi:
         impulses = [impulse_stream_from_wheel(w, n_sprockets) for w in self.chi]
         return letter_from_impulses(impulses)
 
+    def letter_chunks(self, n_sprockets, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Yield the same letters as letters(N_SPROCKETS), CHUNK_SIZE at a
+        time (the last chunk possibly shorter).  Each chunk is a view of a
+        buffer which is overwritten when the next chunk is generated, so
+        must be copied if it is to be kept.
+        """
+        chunk_lengths = _chunk_lengths(n_sprockets, chunk_size)
+        sprocket_idxs = np.arange(chunk_size, dtype=np.int64)
+        letters = np.empty(chunk_size, dtype=np.uint8)
+        position = 0
+        for n in chunk_lengths:
+            yield letter_from_wheels(self.chi, np.full(5, position), sprocket_idxs[:n],
+                                     out=letters[:n])
+            position += n
+
 
 class PsiAndMu:
     def __init__(self, psi, mu, step_counts):
@@ -58,14 +192,303 @@ class PsiAndMu:
         self.mu = [rot_wheel(w, n) for w, n in zip(mu, step_counts[5:])]
 
     def letters(self, n_sprockets):
-        mu_0_stream = impulse_stream_from_wheel(self.mu[0], n_sprockets - 1)
-        unext_mu_1_stream = impulse_stream_from_wheel(self.mu[1], n_sprockets)
-        mu_1_idxs = np.concatenate([[0], np.cumsum(mu_0_stream.astype(np.int32))])
-        ext_mu_1_stream = unext_mu_1_stream[mu_1_idxs]
+        return extended_psi_letters(self.psi, self.mu, np.zeros(5), np.zeros(2),
+                                    n_sprockets)
+
+    def letter_chunks(self, n_sprockets, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Yield the same letters as letters(N_SPROCKETS), CHUNK_SIZE at a
+        time (the last chunk possibly shorter), with the positions of the
+        motor wheels and of the psi wheels carried from one chunk to the
+        next.  As for Chi.letter_chunks(), each chunk is a view of a reused
+        buffer.
+        """
+        chunk_lengths = _chunk_lengths(n_sprockets, chunk_size)
+        offsets = MotorOffsets(np.empty(chunk_size + 1, dtype=np.int64),
+                               np.empty(chunk_size + 1, dtype=np.int64))
+        letters = np.empty(chunk_size, dtype=np.uint8)
+        mu_61_position = mu_37_position = psi_position = 0
+        for n in chunk_lengths:
+            chunk_offsets = motor_offsets(self.mu, (mu_61_position, mu_37_position), n,
+                                          out=MotorOffsets(offsets.mu_37[:n + 1],
+                                                           offsets.psi[:n + 1]))
+            yield letter_from_wheels(self.psi, np.full(5, psi_position),
+                                     chunk_offsets.psi[:-1], out=letters[:n])
+            mu_61_position += n
+            mu_37_position += int(chunk_offsets.mu_37[-1])
+            psi_position += int(chunk_offsets.psi[-1])
+
+
+def delta_wheel(w):
+    """
+    Return the delta'd pattern of wheel W, whose [N] element is the XOR of
+    the [N] and [N-1] elements of W (cyclically).
+    """
+    return w ^ np.roll(w, 1)
+
+
+def chi_letters_excluding(chi, step_counts, excluded_wheel_idxs, n_sprockets):
+    "Chi letters from all wheels except those in EXCLUDED_WHEEL_IDXS."
+    impulses = [(impulse_stream_from_wheel(rot_wheel(w, n), n_sprockets)
+                 if i not in excluded_wheel_idxs
+                 else np.zeros(n_sprockets, dtype=np.uint8))
+                for i, (w, n) in enumerate(zip(chi, step_counts))]
+    return letter_from_impulses(impulses)
 
-        impulses = [impulse_stream_from_wheel(w, n_sprockets) for w in self.psi]
-        unext_psi_stream = letter_from_impulses(impulses)
-        psi_idxs = np.concatenate([[0], np.cumsum(ext_mu_1_stream[:-1].astype(np.int32))])
-        ext_psi_stream = unext_psi_stream[psi_idxs]
 
-        return ext_psi_stream
+def count_grid(ciphertext, chi_patterns, wheel_idxs, statistic,
+               delta_p=False, step_counts=None):
+    """
+    Return a dense array of counts, indexed by the settings of the chi
+    wheels WHEEL_IDXS, of the letters of the de-chi'd CIPHERTEXT for which
+    STATISTIC holds.  STATISTIC maps an array of letters to an array of
+    bools (or small counts); it is only ever evaluated on the 32 possible
+    letters.  If DELTA_P, STATISTIC is applied to the delta'd de-chi, giving
+    counts over the (len(CIPHERTEXT) - 1) consecutive pairs of letters.
+    Chi wheels not in WHEEL_IDXS stay at the settings given in STEP_COUNTS
+    (default all zero).
+
+    Rather than regenerating the key for each combination of settings, the
+    tape letters are histogrammed by their residues modulo the periods of
+    the chosen wheels, so the cost is independent of the tape length once
+    the histogram is built.  The work and memory needed grows with the
+    square of the product of the chosen wheels' periods, so this is best
+    suited to one or two wheels at a time.
+    """
+    wheel_idxs = list(wheel_idxs)
+    step_counts = list(step_counts) if step_counts is not None else [0] * len(chi_patterns)
+    n_sprockets = len(ciphertext)
+    periods = [chi_patterns[i].size for i in wheel_idxs]
+    n_residue_classes = int(np.prod(periods))
+
+    de_chi = ciphertext ^ chi_letters_excluding(chi_patterns, step_counts,
+                                                wheel_idxs, n_sprockets)
+    key_patterns = [np.asarray(chi_patterns[i], dtype=np.uint8) << (4 - i)
+                    for i in wheel_idxs]
+    positions = np.arange(n_sprockets)
+    if delta_p:
+        de_chi = de_chi[1:] ^ de_chi[:-1]
+        key_patterns = [delta_wheel(k) for k in key_patterns]
+        positions = positions[1:]
+
+    # Histogram of letters by residue class, with the statistic folded in:
+    # counts_by_key[r, y] is how many letters in residue class r would be
+    # counted if the key letter for that class were y.
+    residue_idxs = np.ravel_multi_index([positions % p for p in periods], periods)
+    letter_hist = np.bincount(residue_idxs * 32 + de_chi.astype(np.int64),
+                              minlength=n_residue_classes * 32)
+    letter_hist = letter_hist.reshape(n_residue_classes, 32)
+    statistic_lut = np.asarray(statistic(np.arange(32, dtype=np.uint8))).astype(np.int64)
+    all_letters = np.arange(32)
+    counts_by_key = letter_hist @ statistic_lut[all_letters[:, None] ^ all_letters[None, :]]
+
+    # Broadcast settings (leading axes) against residues (trailing axes):
+    n_wheels = len(wheel_idxs)
+    key = np.zeros([1] * (2 * n_wheels), dtype=np.int64)
+    residue_idx = np.zeros([1] * (2 * n_wheels), dtype=np.int64)
+    for j, (period, key_pattern) in enumerate(zip(periods, key_patterns)):
+        setting_shape = [1] * (2 * n_wheels)
+        setting_shape[j] = period
+        residue_shape = [1] * (2 * n_wheels)
+        residue_shape[n_wheels + j] = period
+        settings = np.arange(period).reshape(setting_shape)
+        residues = np.arange(period).reshape(residue_shape)
+        key = key ^ key_pattern[(settings + residues) % period]
+        residue_idx = residue_idx * period + residues
+
+    counts = counts_by_key.ravel()[residue_idx * 32 + key]
+    return counts.reshape(periods + [n_residue_classes]).sum(axis=-1)
+
+
+def rotation_counts(impulses, wheel_patterns, delta_p=False, target=0):
+    """
+    Return a dense array of counts, indexed by the rotations of the wheels
+    WHEEL_PATTERNS, of the sprockets at which the XOR of the IMPULSES
+    stream (zeros and ones) with the wheels' impulses equals TARGET.  For
+    example, with the impulse-1 stream of a tape and the chi-1 pattern,
+    TARGET=1 gives the 'impulse 1 cross' count of Q = Z + CHI for each
+    setting of chi-1.  If DELTA_P, the delta'd impulses and wheels are used
+    instead, giving counts over the (len(IMPULSES) - 1) consecutive pairs.
+
+    The stream is folded modulo the wheels' periods and then correlated
+    against the wheels with a single (multi-dimensional) FFT, so the cost
+    is O(n) for the fold plus O(P log P) where P is the product of the
+    periods.
+    """
+    x = np.asarray(impulses).astype(np.int64) & 1
+    patterns = [np.asarray(w).astype(np.int64) & 1 for w in wheel_patterns]
+    positions = np.arange(x.size)
+    if delta_p:
+        x = x[1:] ^ x[:-1]
+        patterns = [delta_wheel(w) for w in patterns]
+        positions = positions[1:]
+    periods = [w.size for w in patterns]
+
+    # Work with +1 for dot and -1 for cross, so that XOR becomes product:
+    residue_idxs = np.ravel_multi_index([positions % p for p in periods], periods)
+    folded = np.bincount(residue_idxs, weights=(1 - 2 * x),
+                         minlength=int(np.prod(periods))).reshape(periods)
+    signed_wheels = np.ones(periods)
+    for j, w in enumerate(patterns):
+        shape = [1] * len(periods)
+        shape[j] = periods[j]
+        signed_wheels = signed_wheels * (1 - 2 * w).reshape(shape)
+
+    # Circular cross-correlation: corr[s] = sum_r folded[r] * signed_wheels[r + s]
+    corr = np.fft.ifftn(np.conj(np.fft.fftn(folded)) * np.fft.fftn(signed_wheels)).real
+    corr = np.rint(corr).astype(np.int64)
+
+    n_counted = x.size
+    return (n_counted + (corr if target == 0 else -corr)) // 2
+
+
+########################################################################
+# Bit-sliced counting
+
+ALL_ONES = np.uint64(0xffffffffffffffff)
+
+
+def pack_bits(bits):
+    """
+    Pack the 0/1 array BITS along its last axis into uint64 words, 64
+    sprockets per word, zero-padding the final word.
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    n = bits.shape[-1]
+    n_words = -(-n // 64)
+    padded = np.zeros(bits.shape[:-1] + (64 * n_words,), dtype=np.uint8)
+    padded[..., :n] = bits
+    return np.packbits(padded, axis=-1, bitorder='little').view(np.uint64)
+
+
+def _popcount(words):
+    "Number of set bits in each row of WORDS."
+    return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+
+class BitSlicedCounter:
+    """
+    Counter values for runs of the tape Z from each of a batch of 12-wheel
+    step-count vectors, with the given Q selector configuration and Q panel
+    unit configurations (as for q_panel.registers_from_cfgs()), as the
+    machine would give them for a run of RUN_LENGTH sprockets (default
+    len(Z)).  Totals are not reduced modulo the counters' capacity.
+
+    Each impulse of Q is held as a bit-plane of packed uint64 words, 64
+    sprockets per word, for each setting.  The Q panel's match, negate and
+    parity logic is then evaluated with bitwise operations on whole words,
+    and each counter is a popcount.  The chi contribution comes from a
+    table of every rotation of each (packed) chi wheel, so chi streams are
+    never regenerated per setting; the psi stream depends on the motor
+    wheels, so is generated (vectorized over a chunk of settings) only if
+    the Q selector includes it.
+    """
+    def __init__(self, z, chi, psi, mu, q_selector_cfg,
+                 top_cfgs=(), bottom_cfgs=(), negating_cfg=None, run_length=None):
+        z = np.asarray(z, dtype=np.uint8)[:run_length] & 0x1f
+        self.n_sprockets = z.size
+        self.chi, self.psi, self.mu = chi, psi, mu
+        self.q_selector_cfg = q_selector_cfg
+        (self.top_regs,
+         self.bottom_regs,
+         self.negating_regs) = registers_from_cfgs(top_cfgs, bottom_cfgs, negating_cfg)
+
+        count_enable = np.zeros(self.n_sprockets, dtype=np.uint8)
+        count_enable[first_counted_idx(q_selector_cfg):] = 1
+        self.count_mask = pack_bits(count_enable)
+
+        z_contribution = q_stream(q_selector_cfg & 0x30, z, 0, 0)
+        self.z_planes = self._bit_planes(z_contribution)
+        self.chi_rotations = self._chi_rotation_planes()
+
+    def _bit_planes(self, letters):
+        """
+        Packed bit-planes of LETTERS, of shape (5, ..., n_words), with
+        plane b holding the bit of value (1 << b).
+        """
+        return np.stack([pack_bits((letters >> b) & 1) for b in range(5)])
+
+    def _chi_rotation_planes(self):
+        """
+        For each chi wheel, the packed stream of its (possibly delta'd)
+        contribution to Q, for every rotation of the wheel; or None if the
+        Q selector does not include chi.
+        """
+        include_p, delta_p = stream_cfg(self.q_selector_cfg, 1)
+        if not include_p:
+            return None
+        sprocket_idxs = np.arange(self.n_sprockets)
+        rotations = []
+        for w in self.chi:
+            w = np.asarray(w, dtype=np.uint8)
+            if delta_p:
+                # The first letter is not counted, so the cyclic delta
+                # gives the right contribution at every counted sprocket.
+                w = delta_wheel(w)
+            positions = np.arange(w.size)[:, None] + sprocket_idxs
+            rotations.append(pack_bits(w[positions % w.size]))
+        return rotations
+
+    def _q_planes(self, step_counts):
+        planes = np.broadcast_to(self.z_planes[:, None, :],
+                                 (5, len(step_counts), self.z_planes.shape[-1])).copy()
+        if self.chi_rotations is not None:
+            for i, rotations in enumerate(self.chi_rotations):
+                planes[4 - i] ^= rotations[step_counts[:, i] % len(self.chi[i])]
+        if stream_cfg(self.q_selector_cfg, 2)[0]:
+            psi_letters = extended_psi_letters(self.psi, self.mu, step_counts[:, 5:10],
+                                               step_counts[:, 10:12], self.n_sprockets)
+            planes ^= self._bit_planes(q_stream(self.q_selector_cfg & 0x03, 0, 0,
+                                                psi_letters))
+        return planes
+
+    def _counter_words(self, q_planes, counter_idx):
+        """
+        Packed words with a bit set for each sprocket at which counter
+        COUNTER_IDX is added to.
+        """
+        mask = 1 << (N_COUNTERS - 1 - counter_idx)
+        ones = np.full(q_planes.shape[1:], ALL_ONES)
+
+        top_product = ones.copy()
+        for match_en, match_tgt, cfg_2 in self.top_regs:
+            if not (cfg_2 & mask):
+                continue
+            match = ones.copy()
+            for b in range(5):
+                if (match_en >> b) & 1:
+                    match &= q_planes[b] if (match_tgt >> b) & 1 else ~q_planes[b]
+            top_product &= ~match if (cfg_2 >> 7) & 1 else match
+
+        bottom_product = ones.copy()
+        for coeff, cfg_1 in self.bottom_regs:
+            if not (cfg_1 & mask):
+                continue
+            parity = np.zeros_like(ones)
+            for b in range(5):
+                if (coeff >> b) & 1:
+                    parity ^= q_planes[b]
+            bottom_product &= parity if (cfg_1 >> 7) & 1 else ~parity
+
+        top_negates, global_negates = self.negating_regs
+        if top_negates & mask:
+            top_product = ~top_product
+        result = top_product & bottom_product
+        if global_negates & mask:
+            result = ~result
+        return result & self.count_mask
+
+    def counts(self, step_counts, chunk_size=1024):
+        """
+        Counter values, as (n_settings, N_COUNTERS) array, for each row of
+        the (n_settings, 12) array STEP_COUNTS.  Settings are processed
+        CHUNK_SIZE at a time to bound the memory used.
+        """
+        step_counts = np.asarray(step_counts, dtype=np.int64).reshape(-1, 12)
+        counts = np.zeros((len(step_counts), N_COUNTERS), dtype=np.int64)
+        for idx0 in range(0, len(step_counts), chunk_size):
+            q_planes = self._q_planes(step_counts[idx0 : idx0 + chunk_size])
+            for counter_idx in range(N_COUNTERS):
+                counts[idx0 : idx0 + chunk_size, counter_idx] = _popcount(
+                    self._counter_words(q_planes, counter_idx))
+        return counts